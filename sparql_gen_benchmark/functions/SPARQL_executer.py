@@ -1,86 +1,265 @@
+import os
+import random
+import threading
 import time
-import requests
-from SPARQLWrapper import JSON, SPARQLWrapper
+from concurrent.futures import ThreadPoolExecutor
 
-import re
+import requests
 
-def replace_comma_in_res(text):
-    def replace_match(match):
-        return match.group(1) + match.group(2).replace(',', '\\,')
+from .endpoint_router import get_router, is_mirror_failure
+from .http_pool import get_session
+from .query_preprocessor import preprocess_query
+from .query_validator import format_issues, has_errors, validate_query
+from .result_cache import result_cache
+from .result_stream import iter_batches, iter_bindings
+from .result_table import MEDIA_TYPES, BindingsView, parse_table
 
-    pattern = r'(res:)([^,\s]*(?:,[^,\s]*)*)'
-    return re.sub(pattern, replace_match, text)
+# リトライ対象のHTTPステータス
+RETRY_STATUS = {429, 500, 502, 503, 504}
 
+# ストリーミング時にキャッシュ用に集める最大行数（超えたらキャッシュしない）
+STREAM_CACHE_ROWS = int(os.environ.get("SPARQL_STREAM_CACHE_ROWS", "10000"))
 
-from multiprocessing import Process, Queue
-import time
+# エラー応答の本文を返す時の最大文字数
+ERROR_BODY_CHARS = 2000
 
+# エンドポイントごとの同時実行数の上限
+_endpoint_slots = {}
+_endpoint_slots_lock = threading.Lock()
 
-def execute_one_query(query, endpoint):
+def send_query(query_text, endpoint, timeout=600):
+    """
+    Send a SPARQL query through the pooled session of the endpoint and return the parsed JSON.
+    `endpoint` may list several mirrors separated by commas; the fastest healthy one is used.
+    """
     params = {
-        'query': query,
+        'query': query_text,
         'format': 'json'
-    }   
-    response = requests.get(endpoint, params=params, timeout=600)
-    response.raise_for_status()  # エラー発生時に例外を投げる
-    results = response.json()
-    return results["results"]["bindings"]
+    }
 
+    def request(url):
+        response = get_session(url).get(url, params=params, timeout=timeout)
+        response.raise_for_status()  # エラー発生時に例外を投げる
+        return response.json()
 
-def execute_query(question, endpoint, sparql_key_name, limit_number, prefix):
-    try:
-        # 特定の質問からSPARQLクエリを取得
-        sparql = SPARQLWrapper(endpoint)
+    return get_router(endpoint).call(request)
+
+
+def send_table_query(query_text, endpoint, result_format="tsv", timeout=600):
+    """
+    Send a SPARQL query asking for a TSV/CSV result and return the response text.
+    """
+    def request(url):
+        response = get_session(url).get(
+            url,
+            params={'query': query_text},
+            headers={'Accept': MEDIA_TYPES[result_format]},
+            timeout=timeout,
+        )
+        response.raise_for_status()
+        response.encoding = response.encoding or 'utf-8'
+        return response.text
+
+    return get_router(endpoint).call(request)
+
+
+def execute_one_query_table(query, endpoint, result_format="tsv", use_cache=True):
+    """
+    Execute a query with TSV/CSV content negotiation and return the result as a DataFrame.
+    """
+    text = result_cache.get(endpoint, query, result_format) if use_cache else None
+    if text is None:
+        text = send_table_query(query, endpoint, result_format)
+        if use_cache:
+            result_cache.set(endpoint, query, text, result_format)
+    return parse_table(text, result_format)
+
+
+def execute_one_query(query, endpoint, use_cache=True, result_format="json"):
+    if result_format != "json":
+        # 列指向の結果を従来のバインディングのリストとして参照できるようにする
+        return BindingsView(execute_one_query_table(query, endpoint, result_format, use_cache))
+    if use_cache:
+        cached = result_cache.get(endpoint, query)
+        if cached is not None:
+            return cached
+    results = send_query(query, endpoint)
+    bindings = results["results"]["bindings"]
+    if use_cache:
+        result_cache.set(endpoint, query, bindings)
+    return bindings
+
+
+def _open_stream(endpoint, params, timeout=600):
+    # 応答ヘッダーが届くまでに失敗したミラーは次のミラーに切り替える
+    router = get_router(endpoint)
+    mirrors = router.ranked()
+    for i, url in enumerate(mirrors):
+        start = time.monotonic()
+        response = None
+        try:
+            response = get_session(url).get(url, params=params, timeout=timeout, stream=True)
+            response.raise_for_status()
+        except Exception as e:
+            if response is not None:
+                response.close()
+            router.record(url, time.monotonic() - start, not is_mirror_failure(e))
+            if not is_mirror_failure(e) or i == len(mirrors) - 1:
+                raise
+            continue
+        router.record(url, time.monotonic() - start, True)
+        return response
+
+
+def execute_one_query_stream(query, endpoint, batch_size=1000, max_rows=None, max_bytes=None, use_cache=True):
+    """
+    Stream the bindings of a query in batches while the response is still downloading.
+    Stops after `max_rows` rows or `max_bytes` bytes of response body.
+    Only complete result sets of at most STREAM_CACHE_ROWS rows are stored in the result
+    cache; larger ones are not kept in memory for it.
+    """
+    if use_cache:
+        cached = result_cache.get(endpoint, query)
+        if cached is not None:
+            yield from iter_batches(cached[:max_rows] if max_rows else cached, batch_size)
+            return
+
+    params = {
+        'query': query,
+        'format': 'json'
+    }
+    rows = [] if use_cache else None
+    with _open_stream(endpoint, params) as response:
+        bindings = iter_bindings(response.iter_content(chunk_size=64 * 1024), max_rows, max_bytes)
+        batches = iter_batches(bindings, batch_size)
+        while True:
+            try:
+                batch = next(batches)
+            except StopIteration as stop:
+                complete = stop.value
+                break
+            if rows is not None:
+                rows.extend(batch)
+                if len(rows) > STREAM_CACHE_ROWS:
+                    rows = None  # キャッシュするには大きすぎるので集めるのをやめる
+            yield batch
 
-        query_text = prefix + question[sparql_key_name]
+    if rows is not None and complete:
+        result_cache.set(endpoint, query, rows)
 
-        query_text = query_text.replace("LIMIT", "#LIMIT")
-        if limit_number >= 1:
-            query_text = query_text + "\nLIMIT " + str(limit_number)
 
-        query_text = replace_comma_in_res(query_text)
+def build_query_text(question, sparql_key_name, limit_number, prefix):
+    # コメント削除・res: のエスケープ・外側の LIMIT の置き換えをまとめて行う
+    return preprocess_query(prefix + question[sparql_key_name], limit=limit_number).text
 
-        # コメントを削除
-        query_text = re.sub(r'(?m)^#.*$', '', query_text)
 
-        sparql.setQuery(query_text)
-        sparql.setReturnFormat(JSON)
-        sparql.setTimeout(10 * 60)
-        results = sparql.query().convert()
-        # results to dict
-        results = results.decode('utf-8')
+def execute_query(question, endpoint, sparql_key_name, limit_number, prefix, use_cache=True, result_format="json"):
+    try:
+        # 特定の質問からSPARQLクエリを取得
+        query_text = build_query_text(question, sparql_key_name, limit_number, prefix)
+        bindings = execute_one_query(query_text, endpoint, use_cache, result_format)
 
-       
-        return results["results"]["bindings"], question["id"]
+        return bindings, question["id"]
     except Exception as e:
         print(f"Execute Error: {e}")
         print(question["id"])
         return [], question
 
 
-def execute_query_for_error(question, endpoint, sparql_key_name, limit_number, prefix):
+def http_error_message(error):
+    """Status code and response body of an endpoint error (the body holds the endpoint's parse error)."""
+    response = error.response
+    if response is None:
+        return str(error)
+    return f"{response.status_code} {response.reason}: {response.text.strip()[:ERROR_BODY_CHARS]}"
+
+
+def execute_query_for_error(question, endpoint, sparql_key_name, limit_number, prefix, database=None):
     timeout_seconds = 600  # タイムアウト時間を設定
     try:
         # SPARQLクエリを準備
-        sparql = SPARQLWrapper(endpoint)
-
-        query_text = prefix + question[sparql_key_name]
-
-        query_text = query_text.replace("LIMIT", "#LIMIT")
-        if limit_number >= 1:
-            query_text += "\nLIMIT " + str(limit_number)
-
-        query_text = replace_comma_in_res(query_text)
-
-        # コメントを削除
-        query_text = re.sub(r'(?m)^#.*$', '', query_text)
+        query_text = build_query_text(question, sparql_key_name, limit_number, prefix)
 
-        sparql.setQuery(query_text)
-        sparql.setReturnFormat(JSON)
-        sparql.setTimeout(10 * 60)
+        # 構文エラーはエンドポイントに送る前に返す
+        issues = validate_query(query_text, database)
+        if has_errors(issues):
+            return format_issues(issues)
 
-        results = sparql.query().convert()
+        send_query(query_text, endpoint, timeout=timeout_seconds)
         return "no error"
+    except requests.HTTPError as e:
+        return http_error_message(e)
     except Exception as e:
         # エラー内容を返す
         return str(e)
+
+
+def _endpoint_slot(endpoint, limit):
+    # 上限は最初に作成した時の値が使われる
+    with _endpoint_slots_lock:
+        slot = _endpoint_slots.get(endpoint)
+        if slot is None:
+            slot = threading.BoundedSemaphore(limit)
+            _endpoint_slots[endpoint] = slot
+    return slot
+
+
+def execute_query_with_retry(query_text, endpoint, timeout=600, max_retries=3, backoff=1.0, max_per_endpoint=4, use_cache=True, result_format="json"):
+    """
+    Execute a query while holding one of the endpoint's concurrency slots.
+    429/5xx responses and connection failures are retried with exponential backoff.
+    """
+    if use_cache:
+        cached = result_cache.get(endpoint, query_text, result_format)
+        if cached is not None:
+            return cached if result_format == "json" else BindingsView(parse_table(cached, result_format))
+
+    for attempt in range(max_retries + 1):
+        try:
+            with _endpoint_slot(endpoint, max_per_endpoint):
+                if result_format == "json":
+                    result = send_query(query_text, endpoint, timeout=timeout)["results"]["bindings"]
+                else:
+                    result = send_table_query(query_text, endpoint, result_format, timeout=timeout)
+            if use_cache:
+                result_cache.set(endpoint, query_text, result, result_format)
+            return result if result_format == "json" else BindingsView(parse_table(result, result_format))
+        except requests.HTTPError as e:
+            status = e.response.status_code if e.response is not None else None
+            if status not in RETRY_STATUS or attempt == max_retries:
+                raise
+            retry_after = e.response.headers.get("Retry-After", "")
+            delay = float(retry_after) if retry_after.isdigit() else backoff * 2 ** attempt
+        except requests.ConnectionError:
+            if attempt == max_retries:
+                raise
+            delay = backoff * 2 ** attempt
+        time.sleep(delay + random.uniform(0, backoff))
+
+
+def execute_queries(questions, endpoint, sparql_key_name, limit_number, prefix, max_workers=8, max_per_endpoint=4, timeout=600, max_retries=3, use_cache=True, result_format="json"):
+    """
+    Execute the queries of a whole question list concurrently.
+    Returns {question["id"]: bindings} in the order of `questions`; failed queries give [].
+    """
+    def run(question):
+        try:
+            query_text = build_query_text(question, sparql_key_name, limit_number, prefix)
+            return execute_query_with_retry(
+                query_text,
+                endpoint,
+                timeout=timeout,
+                max_retries=max_retries,
+                max_per_endpoint=max_per_endpoint,
+                use_cache=use_cache,
+                result_format=result_format,
+            )
+        except Exception as e:
+            print(f"Execute Error: {e}")
+            print(question["id"])
+            return []
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        results = list(pool.map(run, questions))
+
+    return {question["id"]: bindings for question, bindings in zip(questions, results)}
@@ -1,9 +1,21 @@
-from .gpt_excute import excute_gpt
-from .rdf_config_executer import create_strain_text, execute_rdf_config
-from .text_extractor import extract_conditions_variables, extract_variable_names
+from .SPARQL_executer import build_query_text, http_error_message, send_query
+from .gpt_excute import generate_query_spec
+from .llm_gateway import track_usage
+from .query_repair import LLM_REPAIR, EndpointQueryError, classify_error, record_attempt, repair_query_spec
+from .query_spec import QuerySpecError
+from .query_validator import format_issues, has_errors, validate_query
+from .rdf_config_executer import generate_sparql
+from .variable_index import check_spec
+from concurrent.futures import ThreadPoolExecutor, as_completed
+import json
 import os
 import re
 
+import requests
+
+# ベンチマークの生成を並列に行うスレッド数（LLM のレート制限は llm_gateway が全スレッド共通で管理する）
+SPARQL_GEN_WORKERS = int(os.environ.get("SPARQL_GEN_WORKERS", "1"))
+
 def remove_specific_word_v2(query: str, word_to_remove: str) -> str:
     # SELECT と WHERE の間を正規表現で抽出
     pattern = re.compile(r"(SELECT\s+)(.*?)(\s+WHERE)", re.DOTALL)
@@ -25,119 +37,187 @@ def remove_specific_word_v2(query: str, word_to_remove: str) -> str:
         return query
     
 
-def sparql_gen(database: str, questions: list, verbose: bool = False):
+def check_query_on_endpoint(database: str, query: str, endpoint: str, timeout: int = 600):
     """
-    Generate and execute SPARQL queries for a list of questions using GPT-4, and update each question with the results.
+    Run the query once with LIMIT 1. Local validator errors and 4xx rejections raise EndpointQueryError;
+    connection failures, timeouts, 429 and 5xx responses are raised as they are (they say nothing about the query).
     """
-    for question in questions:
-        # Generate SPARQL queries using GPT-4 based on the filled prompt
-        retry = 0
-        max_retry = 3
-        while retry < max_retry:
+    query_text = build_query_text({"sparql": query}, "sparql", 1, "")
+    issues = validate_query(query_text, database)
+    if has_errors(issues):
+        raise EndpointQueryError(format_issues(issues), query)
+    try:
+        send_query(query_text, endpoint, timeout=timeout)
+    except requests.HTTPError as e:
+        status = e.response.status_code if e.response is not None else None
+        if status is not None and 400 <= status < 500 and status != 429:
+            raise EndpointQueryError(http_error_message(e), query) from e
+        raise
+
+
+def generate_question(database: str, question: dict, verbose: bool = False, max_retry: int = 3, endpoint: str = None, use_cache: bool = False):
+    """
+    Generate the SPARQL query of one benchmark question.
+    After a failure the next attempt repairs the previous output using the error (LLM_REPAIR) instead of regenerating it.
+    With `endpoint`, the query is also run there once; errors in the query count as failures,
+    while an unreachable endpoint only leaves llm_endpoint_checked False.
+    With `use_cache` the completions are read from / stored in the completion cache (LLM_CACHE).
+    Returns the fields to add to the question, or None if every attempt failed.
+    """
+    prompt = question["prompt_filled"]
+    attempts = []
+    previous = None  # 直前に失敗した (llm_output, error)
+    for retry in range(max_retry):
+        llm_output = None
+        if previous is not None and LLM_REPAIR and previous[0] and classify_error(previous[1]):
+            mode = f"repair:{classify_error(previous[1])}"
+        else:
+            mode = "generate" if previous is None else "regenerate"
+        attempts.append(mode)
+        with track_usage() as usage:
             try:
-                llm_output = excute_gpt(question["prompt_filled"])
+                # Variables and parameters from the GPT output (function calling or text)
+                if mode.startswith("repair"):
+                    llm_output, spec = repair_query_spec(database, prompt, *previous, attempt=retry, use_cache=use_cache)
+                else:
+                    llm_output, spec = generate_query_spec(prompt, attempt=retry, use_cache=use_cache)
 
-                # Extract variables and parameters from the GPT output
-                variables = extract_variable_names(llm_output)
+                variables = list(spec.variables)
                 if variables == []:
-                    raise Exception("No variables found in the GPT output", variables)
-                
-                parameters = extract_conditions_variables(llm_output)
-                if parameters == {}: 
-                    raise Exception("No parameters found in the GPT output", parameters)
+                    raise QuerySpecError("No variables found in the GPT output")
+
+                parameters = dict(spec.parameters)
+                if parameters == {}:
+                    raise QuerySpecError("No parameters found in the GPT output")
 
                 if verbose:
                     print("###"*100)
+                    print(f"Attempt: {mode}")
                     print(f"llm_output: {llm_output}")
                     print("---"*10)
                     print(f"Variables: {variables}")
                     print("---"*10)
                     print(f"Parameters: {parameters}")
 
-                # Create strain text and execute RDF configuration
-                create_strain_text(database, question["id"], variables, parameters)
-                rdf_result = execute_rdf_config(database, question["id"])
+                # Check the names against model.yaml before generating the query
+                variables, parameters, corrections = check_spec(database, variables, parameters)
+                if corrections:
+                    print(f"Corrected variables: {corrections}")
+
+                # Generate the SPARQL query with rdf-config
+                rdf_result = generate_sparql(database, variables, parameters, id=question["id"])
 
                 for key in parameters.keys():
                     rdf_result = remove_specific_word_v2(rdf_result, "?"+key)
-            
-                # Update each question dictionary with the results
-                question.update(
-                    {
-                        "llm_output": llm_output,
-                        "llm_variable": variables,
-                        "llm_parameter": parameters,
-                        "llm_rdf_result": rdf_result,
-                    }
-                )
-
-                break
+
+                endpoint_checked = False
+                if endpoint:
+                    try:
+                        check_query_on_endpoint(database, rdf_result, endpoint)
+                        endpoint_checked = True
+                    except requests.RequestException as e:
+                        # エンドポイントに届かない場合はクエリの誤りではないので、修正せずに結果を返す
+                        print(f"Endpoint check skipped: {e}")
             except Exception as e:
                 print(f"Error: {e}")
                 print(question["id"])
-
-                # load os.environ["PATH_RDF_CONFIG"] + "config/" + database + "/sparql.yaml"
-                path_config_sparql = os.environ["PATH_RDF_CONFIG"] + "config/" + database + "/sparql.yaml"
-                with open(path_config_sparql, "r") as file:
-                    config_sparql = file.read()
-                
-                print(f"Remove {question['id']} from {path_config_sparql}")
-                if str(question["id"])+":" in config_sparql:
-                    # remove after ID{question["id"]}
-                    config_sparql = config_sparql.split(str(question["id"]))[0]
-                    with open(path_config_sparql, "w") as file:
-                        file.write(config_sparql)
-                    print(f"{question['id']} removed from {path_config_sparql}")
-                retry += 1
-
+                record_attempt(mode, False, usage)
+                previous = (llm_output, e)
+                continue
+
+        record_attempt(mode, True, usage)
+        return {
+            "llm_output": llm_output,
+            "llm_variable": variables,
+            "llm_parameter": parameters,
+            "llm_variable_corrections": corrections,
+            "llm_rdf_result": rdf_result,
+            "llm_attempts": attempts,
+            "llm_endpoint_checked": endpoint_checked,
+        }
+    return None
+
+
+def load_checkpoint(path):
+    """{str(id): fields} of the questions already recorded in a JSONL checkpoint."""
+    done = {}
+    if not path or not os.path.exists(path):
+        return done
+    with open(path, "r") as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # 中断時に書きかけだった行は無視する（その質問は生成し直す）
+                continue
+            done[str(record.pop("id"))] = record
+    return done
+
+
+def open_checkpoint(path):
+    """Open a JSONL checkpoint for appending, terminating a partly written last line."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    log = open(path, "a+")
+    if log.tell() > 0:
+        log.seek(log.tell() - 1)
+        if log.read(1) != "\n":
+            log.write("\n")
+    return log
+
+
+def sparql_gen(database: str, questions: list, verbose: bool = False, max_workers: int = SPARQL_GEN_WORKERS, checkpoint: str = None, endpoint: str = None, use_cache: bool = True):
+    """
+    Generate the SPARQL queries of a list of questions on `max_workers` threads and update each question with the results.
+    With `checkpoint`, every finished question is appended to that JSONL file, and questions already in it are restored instead of generated again.
+    With `endpoint`, each query is checked there and repaired on errors (see generate_question).
+    Completions go through the completion cache (LLM_CACHE) so benchmark reruns are reproducible; the chat (generate_one_sparql) does not use it.
+    """
+    done = load_checkpoint(checkpoint)
+    pending = []
+    for question in questions:
+        fields = done.get(str(question["id"]))
+        if fields is None:
+            pending.append(question)
+        else:
+            question.update(fields)
+    if done:
+        print(f"Resuming from {checkpoint}: {len(questions) - len(pending)} done, {len(pending)} left")
+
+    log = open_checkpoint(checkpoint) if checkpoint else None
+    pool = ThreadPoolExecutor(max_workers=max(1, max_workers), thread_name_prefix="sparql_gen")
+    try:
+        futures = {pool.submit(generate_question, database, question, verbose, endpoint=endpoint, use_cache=use_cache): question for question in pending}
+        # 終わった順に反映して、すぐにチェックポイントへ書き出す（書き込みはこのスレッドだけ）
+        for future in as_completed(futures):
+            question = futures[future]
+            fields = future.result()
+            if fields is None:
+                continue
+            question.update(fields)
+            if log is not None:
+                log.write(json.dumps({"id": question["id"], **fields}, ensure_ascii=False) + "\n")
+                log.flush()
+    finally:
+        # Ctrl-C などで抜けた場合はまだ始まっていない質問を取り消す
+        pool.shutdown(wait=True, cancel_futures=True)
+        if log is not None:
+            log.close()
 
     # Since questions list is modified in place, return is not necessary unless needed for chaining or similar uses
     return questions
 
 
-def generate_one_sparql(database: str, user_prompt: str, verbose: bool = False):
+def generate_one_sparql(database: str, user_prompt: str, verbose: bool = False, endpoint: str = None):
     """
-    Generate and execute SPARQL queries for a list of questions using GPT-4, and update each question with the results.
+    Generate the SPARQL query for a single filled prompt (see generate_question).
+    Returns None if every attempt failed.
     """
-    # Generate SPARQL queries using GPT-4 based on the filled prompt
-    retry = 0
-    max_retry = 3
-    rdf_result = None
     print(f"User's question: {user_prompt}")
-    while retry < max_retry:
-        try:
-            llm_output = excute_gpt(user_prompt)
-
-            # Extract variables and parameters from the GPT output
-            variables = extract_variable_names(llm_output)
-            print(f"Variables: {variables}")
-            if variables == []:
-                raise Exception("No variables found in the GPT output", variables)
-            
-            parameters = extract_conditions_variables(llm_output)
-            print(f"Parameters: {parameters}")
-            if parameters == {}: 
-                raise Exception("No parameters found in the GPT output", parameters)
-
-            if verbose:
-                print("###"*100)
-                print(f"llm_output: {llm_output}")
-                print("---"*10)
-                print(f"Variables: {variables}")
-                print("---"*10)
-                print(f"Parameters: {parameters}")
-
-            # Create strain text and execute RDF configuration
-            create_strain_text(database, "docker-test", variables, parameters)
-            rdf_result = execute_rdf_config(database, "docker-test")
-
-            for key in parameters.keys():
-                rdf_result = remove_specific_word_v2(rdf_result, "?"+key)
-            break
-        except Exception as e:
-            print(f"Error: {e}")
-            retry += 1
-
-
-    # Since questions list is modified in place, return is not necessary unless needed for chaining or similar uses
-    return rdf_result
+    fields = generate_question(database, {"id": "query", "prompt_filled": user_prompt}, verbose, endpoint=endpoint)
+    if fields is None:
+        return None
+    print(f"Variables: {fields['llm_variable']}")
+    print(f"Parameters: {fields['llm_parameter']}")
+    return fields["llm_rdf_result"]
@@ -0,0 +1,55 @@
+import hashlib
+import json
+import os
+
+from .result_cache import ResultCache
+
+# LLM_CACHE: readthrough（ヒットすれば再利用、なければ呼び出して保存）、
+# record（常に呼び出して保存）、replay（キャッシュのみ、ミスはエラー）、off
+# 使われるのは use_cache を指定した呼び出し（ベンチマークの sparql_gen）だけで、チャットでは使わない
+CACHE_MODES = ("readthrough", "record", "replay", "off")
+LLM_CACHE_MODE = os.environ.get("LLM_CACHE", "readthrough").lower()
+LLM_CACHE_DIR = os.environ.get(
+    "LLM_CACHE_DIR",
+    os.path.join(os.environ.get("PATH_DIR", ""), "data/cache/llm"),
+)
+LLM_CACHE_TTL = float(os.environ.get("LLM_CACHE_TTL", "inf"))
+LLM_CACHE_MAX_BYTES = int(os.environ.get("LLM_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+
+class CompletionCacheMiss(KeyError):
+    """Raised in replay mode when a completion has not been recorded."""
+
+
+class CompletionCache(ResultCache):
+    """
+    Content-addressed cache of chat completions keyed by (model, messages, parameters),
+    stored in the same sharded gzip layout as the SPARQL result cache.
+    """
+
+    def __init__(self, mode=LLM_CACHE_MODE, directory=LLM_CACHE_DIR, ttl=LLM_CACHE_TTL, max_bytes=LLM_CACHE_MAX_BYTES, memory_items=256):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"LLM_CACHE must be one of {', '.join(CACHE_MODES)}, got {mode!r}")
+        super().__init__(directory=directory, memory_items=memory_items, ttl=ttl, max_bytes=max_bytes, enabled=mode != "off")
+        self.mode = mode
+
+    @staticmethod
+    def make_completion_key(model, messages, params):
+        text = json.dumps({"model": model, "messages": messages, "params": params}, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def lookup(self, model, messages, params):
+        """Return the recorded completion (a dict) or None when the API should be called."""
+        if self.mode in ("off", "record"):
+            return None
+        completion = self.get_key(self.make_completion_key(model, messages, params))
+        if completion is None and self.mode == "replay":
+            raise CompletionCacheMiss(f"No recorded completion for model {model} (LLM_CACHE=replay)")
+        return completion
+
+    def store(self, model, messages, params, completion):
+        if self.mode in ("readthrough", "record"):
+            self.set_key(self.make_completion_key(model, messages, params), completion)
+
+
+completion_cache = CompletionCache()
@@ -0,0 +1,159 @@
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import requests
+
+# ルーティングの設定（環境変数で上書き可能）
+EWMA_ALPHA = float(os.environ.get("SPARQL_EWMA_ALPHA", "0.2"))
+MIRROR_COOLDOWN = float(os.environ.get("SPARQL_MIRROR_COOLDOWN", "30"))
+HEDGE_ENABLED = os.environ.get("SPARQL_HEDGE", "off").lower() == "on"
+HEDGE_MIN_DELAY = float(os.environ.get("SPARQL_HEDGE_MIN_DELAY", "0.5"))
+
+# ミラーの障害とみなすHTTPステータス（4xx はクエリ側の問題なので切り替えない）
+FAILOVER_STATUS = {429, 500, 502, 503, 504}
+
+_hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="sparql-hedge")
+
+
+def split_mirrors(endpoint):
+    """`ENDPOINT_<DB>` may list several mirrors separated by commas."""
+    return [url.strip() for url in endpoint.split(",") if url.strip()]
+
+
+def is_mirror_failure(error):
+    if isinstance(error, requests.HTTPError):
+        return error.response is None or error.response.status_code in FAILOVER_STATUS
+    # ConnectTimeout は ConnectionError に含まれる。ReadTimeout はクエリが重いだけのことが多いので切り替えない
+    return isinstance(error, requests.ConnectionError)
+
+
+class MirrorStats:
+    """Latency and error rate of one mirror as exponentially weighted moving averages."""
+
+    def __init__(self, alpha=EWMA_ALPHA, window=50):
+        self.alpha = alpha
+        self.latency = None
+        self.error_rate = 0.0
+        self.down_until = 0.0
+        self.recent = deque(maxlen=window)  # p95 の計算用
+
+    def record(self, seconds, ok):
+        if ok:
+            self.latency = seconds if self.latency is None else self.alpha * seconds + (1 - self.alpha) * self.latency
+            self.recent.append(seconds)
+        self.error_rate = self.alpha * (0.0 if ok else 1.0) + (1 - self.alpha) * self.error_rate
+
+    def score(self):
+        # 未計測のミラーは一度試すため最優先にする
+        if self.latency is None:
+            return 0.0
+        return self.latency * (1 + 10 * self.error_rate)
+
+    def p95(self):
+        if len(self.recent) < 5:
+            return None
+        ordered = sorted(self.recent)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+class EndpointRouter:
+    """
+    Routes requests for one database to the fastest healthy mirror.
+
+    A mirror that fails (connection error or connect timeout, 429/5xx) is skipped for
+    `cooldown` seconds and the request moves on to the next mirror. With hedging,
+    a request that is slower than the best mirror's p95 latency is sent to the
+    second mirror as well and whichever answers first is used.
+    """
+
+    def __init__(self, mirrors, hedge=HEDGE_ENABLED, cooldown=MIRROR_COOLDOWN, hedge_min_delay=HEDGE_MIN_DELAY):
+        self.mirrors = list(mirrors)
+        self.stats = {mirror: MirrorStats() for mirror in self.mirrors}
+        self.hedge = hedge
+        self.cooldown = cooldown
+        self.hedge_min_delay = hedge_min_delay
+        self._lock = threading.Lock()
+
+    def ranked(self):
+        """Mirrors ordered best first; mirrors in cooldown go to the end."""
+        now = time.monotonic()
+        with self._lock:
+            return sorted(self.mirrors, key=lambda m: (self.stats[m].down_until > now, self.stats[m].score()))
+
+    def record(self, mirror, seconds, ok):
+        with self._lock:
+            stats = self.stats[mirror]
+            stats.record(seconds, ok)
+            if not ok:
+                stats.down_until = time.monotonic() + self.cooldown
+
+    def hedge_delay(self, mirror):
+        with self._lock:
+            p95 = self.stats[mirror].p95()
+        return max(self.hedge_min_delay, p95 or 0.0)
+
+    def _timed(self, mirror, request):
+        start = time.monotonic()
+        try:
+            result = request(mirror)
+        except Exception as e:
+            # クエリの誤り（400 など）はミラーの健全性に数えない
+            self.record(mirror, time.monotonic() - start, not is_mirror_failure(e))
+            raise
+        self.record(mirror, time.monotonic() - start, True)
+        return result
+
+    def call(self, request):
+        """Run `request(mirror_url)` on the best mirror, failing over and hedging as configured."""
+        mirrors = self.ranked()
+        if self.hedge and len(mirrors) > 1:
+            return self._call_hedged(request, mirrors)
+
+        for i, mirror in enumerate(mirrors):
+            try:
+                return self._timed(mirror, request)
+            except Exception as e:
+                if not is_mirror_failure(e) or i == len(mirrors) - 1:
+                    raise
+
+    def _call_hedged(self, request, mirrors):
+        pending = {_hedge_pool.submit(self._timed, mirrors[0], request)}
+        remaining = mirrors[1:]
+        timeout = self.hedge_delay(mirrors[0])
+        error = None
+        while pending:
+            done, pending = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    # 遅い方のリクエストはそのまま完了させ、結果は捨てる
+                    return future.result()
+                except Exception as e:
+                    if not is_mirror_failure(e):
+                        raise
+                    error = e
+            if remaining:
+                # 遅い、または失敗したので次のミラーにも送る
+                pending.add(_hedge_pool.submit(self._timed, remaining.pop(0), request))
+            else:
+                timeout = None
+        raise error
+
+
+_routers = {}
+_routers_lock = threading.Lock()
+
+
+def get_router(endpoint):
+    """Return the shared router for an endpoint setting (one URL or a comma-separated mirror list)."""
+    router = _routers.get(endpoint)
+    if router is not None:
+        return router
+    with _routers_lock:
+        router = _routers.get(endpoint)
+        if router is None:
+            router = EndpointRouter(split_mirrors(endpoint))
+            _routers[endpoint] = router
+    return router
@@ -0,0 +1,262 @@
+"""
+Local classifier for the "modify the previous query?" gate of the chat UI.
+
+A logistic regression over lexical overlap between the previous question, the
+previous SPARQL query and the new question. Train it from the stored chat history:
+
+    python -m functions.followup_classifier --api http://chatbot-backend:8000
+
+Training pairs are consecutive messages of a conversation; a pair is labelled
+"modify" when the two queries share most of their graph pattern (predicates and
+classes). Gate decisions made by the LLM are also logged and used as labels.
+"""
+import argparse
+import json
+import math
+import os
+import re
+import threading
+
+import numpy as np
+import requests
+
+from .sparql_tokenizer import tokenize
+
+FOLLOWUP_MODEL_PATH = os.environ.get(
+    "FOLLOWUP_MODEL",
+    os.path.join(os.environ.get("PATH_DIR", ""), "data/models/followup_classifier.json"),
+)
+FOLLOWUP_DECISIONS_PATH = os.environ.get(
+    "FOLLOWUP_DECISIONS",
+    os.path.join(os.environ.get("PATH_DIR", ""), "data/models/followup_decisions.jsonl"),
+)
+# この確率以上（または 1 - この確率以下）なら LLM を呼ばずに判定する
+FOLLOWUP_CONFIDENCE = float(os.environ.get("FOLLOWUP_CONFIDENCE", "0.8"))
+
+# 前の質問を参照していることを示す語
+FOLLOWUP_CUES = {
+    "it", "its", "they", "them", "their", "this", "that", "these", "those", "same",
+    "also", "instead", "only", "again", "too", "above", "previous", "each",
+    "それ", "その", "これ", "この", "同じ", "さらに", "また",
+}
+FEATURE_NAMES = [
+    "question_jaccard",
+    "question_containment",
+    "query_term_overlap",
+    "log_length",
+    "length_ratio",
+    "followup_cue",
+    "new_entity_ratio",
+    "same_question_word",
+]
+WORD = re.compile(r"\w+")
+CAMEL = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+
+
+def _words(text):
+    return [word.lower() for word in WORD.findall(text or "")]
+
+
+def _query_terms(query):
+    # 変数名や prefix:localName を単語に分解する（taxonomy_scientific_name → taxonomy, scientific, name）
+    terms = set()
+    for token in tokenize(query or ""):
+        if token.kind == "VAR":
+            name = token.value[1:]
+        elif token.kind == "PNAME":
+            name = token.value.split(":", 1)[1]
+        else:
+            continue
+        for part in re.split(r"[_\-]", name):
+            terms.update(word.lower() for word in CAMEL.findall(part))
+    return terms
+
+
+def _entities(text):
+    # 大文字を含む語や数字を含む語（遺伝子名、ID など）
+    return {word for word in WORD.findall(text or "") if any(c.isupper() for c in word[1:]) or any(c.isdigit() for c in word) or word[:1].isupper()}
+
+
+def extract_features(previous_input, previous_query, current_input):
+    previous_words = set(_words(previous_input))
+    current_list = _words(current_input)
+    current_words = set(current_list)
+    query_terms = _query_terms(previous_query)
+    new_entities = _entities(current_input) - _entities(previous_input)
+
+    union = previous_words | current_words
+    return [
+        len(previous_words & current_words) / len(union) if union else 0.0,
+        len(previous_words & current_words) / len(current_words) if current_words else 0.0,
+        len(current_words & query_terms) / len(current_words) if current_words else 0.0,
+        math.log1p(len(current_list)),
+        len(current_words) / max(len(previous_words), 1),
+        float(bool(current_words & FOLLOWUP_CUES)),
+        len(new_entities) / max(len(current_words), 1),
+        float(bool(current_list) and bool(previous_words) and current_list[0] == _words(previous_input)[0]),
+    ]
+
+
+def graph_terms(query):
+    """Predicates and classes of a query's pattern (PREFIX declarations excluded)."""
+    tokens = tokenize(query or "")
+    terms = set()
+    for i, token in enumerate(tokens):
+        if token.kind in ("PNAME", "IRI") and not (i > 0 and tokens[i - 1].value.upper() == "PREFIX") and not (i > 1 and tokens[i - 2].value.upper() == "PREFIX"):
+            terms.add(token.value)
+    return terms
+
+
+def label_from_queries(previous_query, next_query, threshold=0.5):
+    """Weak label: 1 when the next query keeps most of the previous graph pattern."""
+    previous_terms = graph_terms(previous_query)
+    next_terms = graph_terms(next_query)
+    union = previous_terms | next_terms
+    if not union:
+        return 0
+    return int(len(previous_terms & next_terms) / len(union) >= threshold)
+
+
+class FollowupClassifier:
+    """Logistic regression over `extract_features` with standardised inputs."""
+
+    def __init__(self, weights, bias, mean, scale):
+        self.weights = np.asarray(weights, dtype=float)
+        self.bias = float(bias)
+        self.mean = np.asarray(mean, dtype=float)
+        self.scale = np.asarray(scale, dtype=float)
+
+    @classmethod
+    def fit(cls, features, labels, l2=0.01, learning_rate=0.5, epochs=2000):
+        x = np.asarray(features, dtype=float)
+        y = np.asarray(labels, dtype=float)
+        mean = x.mean(axis=0)
+        scale = x.std(axis=0)
+        scale[scale == 0] = 1.0
+        x = (x - mean) / scale
+        weights = np.zeros(x.shape[1])
+        bias = 0.0
+        for _ in range(epochs):
+            p = 1 / (1 + np.exp(-(x @ weights + bias)))
+            weights -= learning_rate * (x.T @ (p - y) / len(y) + l2 * weights)
+            bias -= learning_rate * float(np.mean(p - y))
+        return cls(weights, bias, mean, scale)
+
+    def probability(self, features):
+        x = (np.asarray(features, dtype=float) - self.mean) / self.scale
+        return float(1 / (1 + np.exp(-(x @ self.weights + self.bias))))
+
+    def predict_proba(self, previous_input, previous_query, current_input):
+        return self.probability(extract_features(previous_input, previous_query, current_input))
+
+    def decide(self, previous_input, previous_query, current_input, confidence=FOLLOWUP_CONFIDENCE):
+        """Return True/False when the model is confident enough, otherwise None."""
+        probability = self.predict_proba(previous_input, previous_query, current_input)
+        if probability >= confidence:
+            return True
+        if probability <= 1 - confidence:
+            return False
+        return None
+
+    def save(self, path=FOLLOWUP_MODEL_PATH):
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(
+                {
+                    "features": FEATURE_NAMES,
+                    "weights": self.weights.tolist(),
+                    "bias": self.bias,
+                    "mean": self.mean.tolist(),
+                    "scale": self.scale.tolist(),
+                },
+                f,
+                indent=2,
+            )
+
+    @classmethod
+    def load(cls, path=FOLLOWUP_MODEL_PATH):
+        """Return the saved model, or None if it has not been trained yet."""
+        if not os.path.exists(path):
+            return None
+        with open(path, "r") as f:
+            model = json.load(f)
+        if model["features"] != FEATURE_NAMES:
+            return None  # 特徴量が変わったら再学習が必要
+        return cls(model["weights"], model["bias"], model["mean"], model["scale"])
+
+
+_decisions_lock = threading.Lock()
+
+
+def record_decision(previous_input, previous_query, current_input, decision, path=FOLLOWUP_DECISIONS_PATH):
+    """Log a decision made by the LLM gate so it can be used as a training label."""
+    record = {
+        "previous_input": previous_input,
+        "previous_query": previous_query,
+        "current_input": current_input,
+        "label": int(decision),
+    }
+    try:
+        with _decisions_lock:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            with open(path, "a") as f:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+    except OSError as e:
+        print(f"Failed to record follow-up decision: {e}")
+
+
+def history_examples(api_base_url):
+    """Training pairs from consecutive messages of every stored conversation."""
+    examples = []
+    conversations = requests.get(f"{api_base_url}/conversations/").json()
+    for conversation in conversations:
+        response = requests.get(f"{api_base_url}/conversations/{conversation['conversation_id']}/messages")
+        messages = [
+            m for m in response.json().get("messages", [])
+            if m.get("user_question") and m.get("sparql_query")
+        ]
+        for previous, current in zip(messages, messages[1:]):
+            examples.append((
+                extract_features(previous["user_question"], previous["sparql_query"], current["user_question"]),
+                label_from_queries(previous["sparql_query"], current["sparql_query"]),
+            ))
+    return examples
+
+
+def logged_examples(path=FOLLOWUP_DECISIONS_PATH):
+    if not os.path.exists(path):
+        return []
+    examples = []
+    with open(path, "r") as f:
+        for line in f:
+            record = json.loads(line)
+            examples.append((
+                extract_features(record["previous_input"], record["previous_query"], record["current_input"]),
+                record["label"],
+            ))
+    return examples
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train the follow-up gate classifier")
+    parser.add_argument("--api", help="chat backend URL to read the conversation history from")
+    parser.add_argument("--decisions", default=FOLLOWUP_DECISIONS_PATH, help="logged LLM gate decisions")
+    parser.add_argument("--output", default=FOLLOWUP_MODEL_PATH)
+    args = parser.parse_args()
+
+    examples = logged_examples(args.decisions)
+    if args.api:
+        examples += history_examples(args.api)
+    labels = [label for _, label in examples]
+    if len(set(labels)) < 2:
+        parser.error(f"need examples of both classes, got {len(examples)} examples")
+
+    model = FollowupClassifier.fit([features for features, _ in examples], labels)
+    accuracy = np.mean([(model.probability(features) >= 0.5) == label for features, label in examples])
+    model.save(args.output)
+    print(f"Trained on {len(examples)} examples ({sum(labels)} modify), training accuracy {accuracy:.2f}")
+    print(f"Saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,18 +1,66 @@
-from openai import OpenAI
+import json
 
+from .llm_gateway import chat, chat_completion
+from .query_spec import (
+    LLM_STRUCTURED_OUTPUT,
+    QUERY_SPEC_FUNCTION,
+    QUERY_SPEC_TOOL,
+    QuerySpecError,
+    extraction_stats,
+    spec_from_completion,
+    spec_from_text,
+)
 
-def excute_gpt(content):
+MODEL_NAME = "gpt-4-1106-preview"
+
+
+def excute_gpt(content, attempt=0, site="excute_gpt", use_cache=False):
     """
     Extracts the variable parameter from the query.
+    With `use_cache` the completion cache (LLM_CACHE) is used, e.g. for benchmark reruns.
     """
-    model_name = "gpt-4-1106-preview"
-    client = OpenAI()
+    model_name = MODEL_NAME
 
     prompt = {"role": "user", "content": content}
 
-    completion = client.chat.completions.create(
-        model=model_name,
-        messages=[prompt],
-    )
-    gpt_output = completion.choices[0].message.content
+    # 再試行ごとに別のキャッシュエントリにする（同じ失敗した出力を再生しないように）
+    gpt_output = chat([prompt], model=model_name, site=site, cache=use_cache, cache_tag=attempt or None)
     return gpt_output
+
+
+def excute_gpt_structured(content, attempt=0, site="excute_gpt_structured", use_cache=False):
+    """
+    Extracts the variables and parameters as a forced submit_query_spec function call.
+    Returns the QuerySpec; raises QuerySpecError if the call does not match the schema.
+    """
+    prompt = {"role": "user", "content": content}
+    completion = chat_completion(
+        [prompt],
+        model=MODEL_NAME,
+        site=site,
+        cache=use_cache,
+        cache_tag=attempt or None,
+        tools=[QUERY_SPEC_TOOL],
+        tool_choice={"type": "function", "function": {"name": QUERY_SPEC_FUNCTION}},
+    )
+    return spec_from_completion(completion)
+
+
+def generate_query_spec(content, attempt=0, structured=LLM_STRUCTURED_OUTPUT, site="excute_gpt", use_cache=False):
+    """
+    Return (llm_output, QuerySpec) for a generation prompt. With structured output the
+    spec comes from function calling and llm_output is its JSON; if that fails (or is
+    off), the free-text output is parsed with the text extractors.
+    Token usage is recorded under `site` (`site`_structured for function calling).
+    """
+    if structured:
+        try:
+            spec = excute_gpt_structured(content, attempt, site=f"{site}_structured", use_cache=use_cache)
+            extraction_stats["structured"] += 1
+            return json.dumps(spec._asdict(), ensure_ascii=False), spec
+        except QuerySpecError as e:
+            extraction_stats["structured_failed"] += 1
+            print(f"Structured output failed, falling back to text: {e}")
+    llm_output = excute_gpt(content, attempt=attempt, site=site, use_cache=use_cache)
+    extraction_stats["text"] += 1
+    return llm_output, spec_from_text(llm_output)
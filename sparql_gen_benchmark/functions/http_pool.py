@@ -0,0 +1,59 @@
+import os
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# 接続プールの設定（環境変数で上書き可能）
+POOL_CONNECTIONS = int(os.environ.get("SPARQL_POOL_CONNECTIONS", "4"))
+POOL_MAXSIZE = int(os.environ.get("SPARQL_POOL_MAXSIZE", "16"))
+POOL_BLOCK = os.environ.get("SPARQL_POOL_BLOCK", "false").lower() == "true"
+
+DEFAULT_HEADERS = {
+    "Accept": "application/sparql-results+json",
+    "Accept-Encoding": "gzip, deflate",
+    "Connection": "keep-alive",
+}
+
+_sessions = {}
+_lock = threading.Lock()
+
+
+def _host_key(endpoint):
+    parts = urlsplit(endpoint)
+    return f"{parts.scheme}://{parts.netloc}"
+
+
+def get_session(endpoint, pool_connections=None, pool_maxsize=None):
+    """
+    Return the shared keep-alive session for the host of the given endpoint.
+    Sessions are created once per host and reused by every SPARQL call.
+    """
+    key = _host_key(endpoint)
+    session = _sessions.get(key)
+    if session is not None:
+        return session
+
+    with _lock:
+        session = _sessions.get(key)
+        if session is None:
+            adapter = HTTPAdapter(
+                pool_connections=pool_connections or POOL_CONNECTIONS,
+                pool_maxsize=pool_maxsize or POOL_MAXSIZE,
+                pool_block=POOL_BLOCK,
+            )
+            session = requests.Session()
+            session.headers.update(DEFAULT_HEADERS)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+            _sessions[key] = session
+    return session
+
+
+def close_sessions():
+    """Close every pooled session (e.g. at the end of a benchmark run)."""
+    with _lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
@@ -0,0 +1,241 @@
+import os
+import random
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+import openai
+from openai import OpenAI
+from openai.types.chat import ChatCompletion
+
+from .completion_cache import completion_cache
+
+# レート制限とリトライの設定（環境変数で上書き可能）
+LLM_RPM = int(os.environ.get("LLM_RPM", "500"))
+LLM_TPM = int(os.environ.get("LLM_TPM", "300000"))
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", "5"))
+LLM_BACKOFF = float(os.environ.get("LLM_BACKOFF", "1.0"))
+LLM_TIMEOUT = float(os.environ.get("LLM_TIMEOUT", "600"))
+
+# 応答トークン数の見積もり（max_tokens が指定されていない場合）
+COMPLETION_TOKENS_ESTIMATE = 512
+
+_client = None
+_client_lock = threading.Lock()
+
+
+def get_client():
+    """Return the shared OpenAI client; its HTTP connection pool is reused by every call."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                # リトライはゲートウェイ側で行う
+                _client = OpenAI(max_retries=0, timeout=LLM_TIMEOUT)
+    return _client
+
+
+class RateLimiter:
+    """
+    Token buckets for requests per minute and tokens per minute.
+    `acquire` blocks until both budgets allow the call.
+    """
+
+    def __init__(self, rpm=LLM_RPM, tpm=LLM_TPM):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.requests = float(rpm)
+        self.tokens = float(tpm)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        elapsed = now - self.updated
+        self.updated = now
+        self.requests = min(self.rpm, self.requests + elapsed * self.rpm / 60)
+        self.tokens = min(self.tpm, self.tokens + elapsed * self.tpm / 60)
+
+    def acquire(self, tokens):
+        tokens = min(tokens, self.tpm)
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.blocked_until and self.requests >= 1 and self.tokens >= tokens:
+                    self.requests -= 1
+                    self.tokens -= tokens
+                    return
+                wait = max(
+                    self.blocked_until - now,
+                    (1 - self.requests) * 60 / self.rpm,
+                    (tokens - self.tokens) * 60 / self.tpm,
+                )
+            time.sleep(max(wait, 0.01))
+
+    def adjust(self, tokens):
+        """Correct the token budget once the real usage of a call is known."""
+        with self._lock:
+            self.tokens -= tokens
+
+    def pause(self, seconds):
+        """Hold every caller back, e.g. after a 429 with Retry-After."""
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+rate_limiter = RateLimiter()
+
+# 呼び出し元ごとのトークン数とレイテンシ
+_usage = defaultdict(lambda: {"calls": 0, "errors": 0, "cache_hits": 0, "prompt_tokens": 0, "completion_tokens": 0, "latency": 0.0})
+_usage_lock = threading.Lock()
+_scopes = threading.local()
+
+
+@contextmanager
+def track_usage():
+    """Collect the tokens of every call made by the current thread inside the block."""
+    totals = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0}
+    if not hasattr(_scopes, "stack"):
+        _scopes.stack = []
+    _scopes.stack.append(totals)
+    try:
+        yield totals
+    finally:
+        # 入れ子のスコープは同じ値を持ちうるので、値ではなく自分自身を取り除く
+        popped = _scopes.stack.pop()
+        assert popped is totals, "track_usage scopes must be exited in reverse order"
+
+
+def _record(site, prompt_tokens=0, completion_tokens=0, latency=0.0, error=False, cache_hit=False):
+    for totals in getattr(_scopes, "stack", ()):
+        totals["calls"] += 1
+        totals["prompt_tokens"] += prompt_tokens
+        totals["completion_tokens"] += completion_tokens
+    with _usage_lock:
+        usage = _usage[site]
+        usage["calls"] += 1
+        usage["errors"] += int(error)
+        usage["cache_hits"] += int(cache_hit)
+        usage["prompt_tokens"] += prompt_tokens
+        usage["completion_tokens"] += completion_tokens
+        usage["latency"] += latency
+
+
+def get_usage():
+    """Return {call site: {calls, errors, cache_hits, prompt_tokens, completion_tokens, latency}}."""
+    with _usage_lock:
+        return {site: dict(usage) for site, usage in _usage.items()}
+
+
+def reset_usage():
+    with _usage_lock:
+        _usage.clear()
+
+
+def estimate_tokens(messages, max_tokens=None):
+    # 1トークン≒4文字の大まかな見積もり
+    prompt_tokens = sum(len(message["content"]) for message in messages) // 4
+    return prompt_tokens + (max_tokens or COMPLETION_TOKENS_ESTIMATE)
+
+
+def _retry_delay(error, attempt, backoff):
+    response = getattr(error, "response", None)
+    retry_after = response.headers.get("retry-after", "") if response is not None else ""
+    try:
+        return float(retry_after)
+    except ValueError:
+        return backoff * 2 ** attempt + random.uniform(0, backoff)
+
+
+def _is_retryable(error):
+    if isinstance(error, (openai.RateLimitError, openai.APIConnectionError)):
+        return True
+    return isinstance(error, openai.APIStatusError) and error.status_code >= 500
+
+
+def _create(site, estimate, max_retries, backoff, **create_kwargs):
+    # レート制限を待ってから呼び出し、一時的なエラーは再試行する
+    for attempt in range(max_retries + 1):
+        rate_limiter.acquire(estimate)
+        start = time.monotonic()
+        try:
+            return get_client().chat.completions.create(**create_kwargs), start
+        except Exception as e:
+            _record(site, latency=time.monotonic() - start, error=True)
+            if not _is_retryable(e) or attempt == max_retries:
+                raise
+            delay = _retry_delay(e, attempt, backoff)
+            if isinstance(e, openai.RateLimitError):
+                rate_limiter.pause(delay)
+            time.sleep(delay)
+
+
+def _record_usage(site, usage, estimate, start):
+    if usage is None:
+        _record(site, latency=time.monotonic() - start)
+        return
+    rate_limiter.adjust(usage.total_tokens - estimate)
+    _record(site, usage.prompt_tokens, usage.completion_tokens, time.monotonic() - start)
+
+
+def chat_completion(messages, model, site="default", max_retries=LLM_MAX_RETRIES, backoff=LLM_BACKOFF, cache=False, cache_tag=None, **kwargs):
+    """
+    Create a chat completion through the shared client within the rate limits.
+    429/5xx responses and connection failures are retried with jittered exponential backoff.
+    Token usage and latency are recorded under `site`.
+    With `cache=True` the completion cache is used according to LLM_CACHE
+    (cache hits cost no tokens and are counted in `cache_hits`). `cache_tag` is added
+    to the cache key, e.g. to record a separate completion for each retry attempt.
+    """
+    key_params = dict(kwargs, cache_tag=cache_tag) if cache_tag is not None else kwargs
+    if cache:
+        cached = completion_cache.lookup(model, messages, key_params)
+        if cached is not None:
+            _record(site, cache_hit=True)
+            return ChatCompletion.model_validate(cached)
+
+    estimate = estimate_tokens(messages, kwargs.get("max_tokens"))
+    completion, start = _create(site, estimate, max_retries, backoff, model=model, messages=messages, **kwargs)
+
+    _record_usage(site, completion.usage, estimate, start)
+    if cache:
+        completion_cache.store(model, messages, key_params, completion.model_dump(mode="json"))
+    return completion
+
+
+def chat(messages, model, site="default", **kwargs):
+    """Return the text of a chat completion (see `chat_completion`)."""
+    return chat_completion(messages, model, site, **kwargs).choices[0].message.content
+
+
+def chat_stream(messages, model, site="default", max_retries=LLM_MAX_RETRIES, backoff=LLM_BACKOFF, **kwargs):
+    """
+    Yield the text of a chat completion piece by piece as the tokens arrive.
+    Failures before the first chunk are retried like `chat_completion`; token usage
+    is recorded from the final chunk.
+    """
+    estimate = estimate_tokens(messages, kwargs.get("max_tokens"))
+    stream, start = _create(
+        site,
+        estimate,
+        max_retries,
+        backoff,
+        model=model,
+        messages=messages,
+        stream=True,
+        stream_options={"include_usage": True},
+        **kwargs,
+    )
+
+    usage = None
+    try:
+        for chunk in stream:
+            if chunk.usage is not None:
+                usage = chunk.usage
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+    finally:
+        stream.close()
+        _record_usage(site, usage, estimate, start)
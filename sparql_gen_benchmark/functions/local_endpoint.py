@@ -0,0 +1,235 @@
+"""
+Local stand-in for the public SPARQL endpoints, for offline and reproducible benchmarking.
+
+    # serve fixture triples from an in-process RDF store (requires rdflib)
+    python -m functions.local_endpoint --fixtures data/fixtures/rdf/rhea.ttl --port 8890
+
+    # record the responses of a real endpoint once ...
+    python -m functions.local_endpoint --record https://sparql.rhea-db.org/sparql --cassettes data/fixtures/cassettes/rhea
+    # ... and replay them deterministically afterwards
+    python -m functions.local_endpoint --cassettes data/fixtures/cassettes/rhea
+
+Then point ENDPOINT_<DB> at the printed URL.
+"""
+import argparse
+import hashlib
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from .http_pool import get_session
+from .query_preprocessor import canonical_query
+
+JSON_TYPE = "application/sparql-results+json"
+TSV_TYPE = "text/tab-separated-values"
+CSV_TYPE = "text/csv"
+FORMAT_TYPES = {"json": JSON_TYPE, "tsv": TSV_TYPE, "csv": CSV_TYPE}
+
+
+def _result_type(accept):
+    for media_type in (TSV_TYPE, CSV_TYPE):
+        if media_type in accept:
+            return media_type
+    return JSON_TYPE
+
+
+class RecordReplayBackend:
+    """
+    Serves recorded endpoint responses from a cassette directory.
+    In record mode, unknown queries are forwarded to `upstream` and the response is saved.
+    """
+
+    def __init__(self, cassette_dir, upstream=None):
+        self.cassette_dir = cassette_dir
+        self.upstream = upstream
+        os.makedirs(cassette_dir, exist_ok=True)
+
+    def _path(self, query, accept):
+        text = canonical_query(query) + "\n" + _result_type(accept)
+        return os.path.join(self.cassette_dir, hashlib.sha256(text.encode("utf-8")).hexdigest() + ".json")
+
+    def handle(self, query, accept):
+        path = self._path(query, accept)
+        if os.path.exists(path):
+            with open(path, "r") as f:
+                cassette = json.load(f)
+            return cassette["status"], cassette["content_type"], cassette["body"].encode("utf-8")
+
+        if self.upstream is None:
+            return 404, "text/plain", f"No recorded response for query:\n{query}".encode("utf-8")
+
+        response = get_session(self.upstream).get(
+            self.upstream,
+            params={"query": query},
+            headers={"Accept": _result_type(accept)},
+            timeout=600,
+        )
+        content_type = response.headers.get("Content-Type", "text/plain")
+        # サーバー側の一時的なエラーは記録しない
+        if response.status_code < 500 and response.status_code != 429:
+            cassette = {
+                "query": query,
+                "accept": _result_type(accept),
+                "status": response.status_code,
+                "content_type": content_type,
+                "body": response.content.decode("utf-8", errors="replace"),
+            }
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w") as f:
+                json.dump(cassette, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        return response.status_code, content_type, response.content
+
+
+class RDFStoreBackend:
+    """
+    Answers queries from an in-memory rdflib graph loaded from fixture files
+    (a file or a directory of .ttl/.nt/.rdf files).
+    """
+
+    def __init__(self, paths):
+        try:
+            import rdflib
+        except ImportError as e:
+            raise ImportError("RDFStoreBackend requires rdflib (pip install rdflib)") from e
+
+        self.graph = rdflib.Graph()
+        self._lock = threading.Lock()  # rdflib のグラフはスレッドセーフではない
+        for path in paths:
+            files = [path] if os.path.isfile(path) else [
+                os.path.join(path, name) for name in sorted(os.listdir(path))
+            ]
+            for file in files:
+                if file.endswith((".ttl", ".nt", ".n3", ".rdf", ".owl", ".jsonld")):
+                    self.graph.parse(file)
+
+    def handle(self, query, accept):
+        result_type = _result_type(accept)
+        try:
+            with self._lock:
+                result = self.graph.query(query)
+                if result_type == TSV_TYPE:
+                    body = self._serialize_tsv(result)
+                elif result_type == CSV_TYPE:
+                    body = result.serialize(format="csv")
+                else:
+                    body = result.serialize(format="json")
+        except Exception as e:
+            return 400, "text/plain", f"Query error: {e}".encode("utf-8")
+        return 200, result_type, body
+
+    @staticmethod
+    def _serialize_tsv(result):
+        lines = ["\t".join(f"?{var}" for var in result.vars)]
+        for row in result:
+            lines.append("\t".join("" if term is None else term.n3() for term in row))
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class _SPARQLRequestHandler(BaseHTTPRequestHandler):
+    backend = None
+
+    def do_GET(self):
+        params = parse_qs(urlsplit(self.path).query)
+        self._answer(params)
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", "0"))
+        body = self.rfile.read(length).decode("utf-8")
+        params = parse_qs(urlsplit(self.path).query)
+        if self.headers.get("Content-Type", "").startswith("application/sparql-query"):
+            params["query"] = [body]
+        else:
+            params.update(parse_qs(body))
+        self._answer(params)
+
+    def _answer(self, params):
+        if "query" not in params:
+            self._send(400, "text/plain", b"Missing query parameter")
+            return
+        accept = self.headers.get("Accept", "")
+        if "format" in params:
+            accept = FORMAT_TYPES.get(params["format"][0], accept)
+        status, content_type, body = self.backend.handle(params["query"][0], accept)
+        self._send(status, content_type, body)
+
+    def _send(self, status, content_type, body):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class LocalEndpoint:
+    """
+    SPARQL protocol server on localhost, running in a background thread.
+
+        with LocalEndpoint(RDFStoreBackend(["data/fixtures/rdf/rhea.ttl"])) as endpoint:
+            execute_one_query(query, endpoint.url)
+    """
+
+    def __init__(self, backend, host="127.0.0.1", port=0):
+        handler = type("SPARQLRequestHandler", (_SPARQLRequestHandler,), {"backend": backend})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/sparql"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local SPARQL endpoint for offline benchmarking")
+    parser.add_argument("--fixtures", nargs="+", help="RDF fixture files or directories to serve")
+    parser.add_argument("--cassettes", help="directory of recorded responses")
+    parser.add_argument("--record", metavar="UPSTREAM", help="record responses of this endpoint into --cassettes")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8890)
+    args = parser.parse_args()
+
+    if args.record and not args.cassettes:
+        parser.error("--record requires --cassettes")
+    if args.fixtures:
+        backend = RDFStoreBackend(args.fixtures)
+    elif args.cassettes:
+        backend = RecordReplayBackend(args.cassettes, upstream=args.record)
+    else:
+        parser.error("either --fixtures or --cassettes is required")
+
+    endpoint = LocalEndpoint(backend, args.host, args.port)
+    print(f"Serving SPARQL endpoint at {endpoint.url}")
+    try:
+        endpoint.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        endpoint.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
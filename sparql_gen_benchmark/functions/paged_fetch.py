@@ -0,0 +1,90 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .query_preprocessor import outer_modifiers, preprocess_query
+from .SPARQL_executer import execute_one_query_stream
+
+FIRST_PAGE_SIZE = int(os.environ.get("SPARQL_FIRST_PAGE_SIZE", "100"))
+PAGE_SIZE = int(os.environ.get("SPARQL_PAGE_SIZE", "1000"))
+
+
+class QueryCancelled(Exception):
+    pass
+
+
+class PagedQuery:
+    """
+    Fetch a query result page by page with LIMIT/OFFSET.
+
+    The first page is small so it can be shown immediately; each following page is
+    prefetched in a background thread while the caller works on the previous one.
+    Pages stay within the query's own LIMIT/OFFSET.
+    Without ORDER BY the endpoint does not guarantee a stable order across pages.
+    """
+
+    def __init__(self, query, endpoint, first_page_size=FIRST_PAGE_SIZE, page_size=PAGE_SIZE):
+        self.query = query
+        self.endpoint = endpoint
+        self.first_page_size = first_page_size
+        self.page_size = page_size
+        # クエリ自身の LIMIT/OFFSET（ページはこの範囲の中で取得する）
+        self.limit, self.offset = outer_modifiers(query)
+        self.offset = self.offset or 0
+        self.rows_loaded = 0
+        self.has_more = True
+        self._cancelled = threading.Event()
+        self._executor = ThreadPoolExecutor(max_workers=1)
+        self._next = None  # 先読み中の次のページ
+
+    def _page_size(self, offset, size):
+        # クエリの LIMIT を超えないようにページを小さくする
+        if self.limit is None:
+            return size
+        return max(min(size, self.limit - offset), 0)
+
+    def _fetch(self, offset, limit):
+        if limit < 1:
+            return []
+        page_query = preprocess_query(self.query, limit=limit, offset=self.offset + offset).text
+        rows = []
+        for batch in execute_one_query_stream(page_query, self.endpoint, batch_size=min(limit, 200)):
+            if self._cancelled.is_set():
+                # ジェネレーターを閉じると接続も閉じられる
+                raise QueryCancelled()
+            rows.extend(batch)
+        return rows
+
+    def first_page(self):
+        """Fetch the first page synchronously and start prefetching the second one."""
+        size = self._page_size(0, self.first_page_size)
+        rows = self._fetch(0, size)
+        self._accept(rows, size)
+        return rows
+
+    def next_page(self):
+        """Return the next page, waiting for the prefetch if it is still running."""
+        if not self.has_more:
+            return []
+        size = self._page_size(self.rows_loaded, self.page_size)
+        future = self._next or self._executor.submit(self._fetch, self.rows_loaded, size)
+        self._next = None
+        rows = future.result()
+        self._accept(rows, size)
+        return rows
+
+    def _accept(self, rows, requested):
+        self.rows_loaded += len(rows)
+        next_size = self._page_size(self.rows_loaded, self.page_size)
+        self.has_more = len(rows) == requested and next_size > 0
+        if self.has_more and not self._cancelled.is_set():
+            self._next = self._executor.submit(self._fetch, self.rows_loaded, next_size)
+
+    def cancel(self):
+        """Stop prefetching, e.g. when the user asks a new question."""
+        self._cancelled.set()
+        self.has_more = False
+        if self._next is not None:
+            self._next.cancel()
+            self._next = None
+        self._executor.shutdown(wait=False)
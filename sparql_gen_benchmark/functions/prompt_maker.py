@@ -1,41 +1,147 @@
 import json
 import os
+import re
+import threading
+import time
+from functools import lru_cache
 
+from .schema_index import PROMPT_SCHEMA_TOP_K, prune_variables_info
 
-def make_prompt(
-    database: str, prompt_id: int, prompt_variable_id: int, questions: list
-):
+# データベースごとのチャット用プロンプトIDと変数ID
+DEFAULT_PROMPT_IDS = {
+    "uniprot": (2, 2),
+    "rhea": (5, 4),
+    "bgee": (6, 5),
+}
+
+# ファイルの更新を確認する間隔（秒）
+PROMPT_RELOAD_INTERVAL = float(os.environ.get("PROMPT_RELOAD_INTERVAL", "1.0"))
+
+
+class CompiledTemplate:
+    """
+    A prompt template split once into literal text and {variable} fields,
+    so that rendering is a single join instead of one str.replace per variable.
+    """
+
+    def __init__(self, text, variables):
+        self.variables = list(variables)
+        if self.variables:
+            pattern = re.compile("|".join(re.escape(f"{{{name}}}") for name in self.variables))
+            self.literals = pattern.split(text)
+            self.fields = [match[1:-1] for match in pattern.findall(text)]
+        else:
+            self.literals = [text]
+            self.fields = []
+
+    def render(self, params):
+        for input_field in self.variables:
+            if input_field not in params:
+                raise ValueError(f"変数 {input_field} がパラメータに見つかりません。")
+        parts = [self.literals[0]]
+        for field, literal in zip(self.fields, self.literals[1:]):
+            parts.append(str(params[field]))
+            parts.append(literal)
+        return "".join(parts)
+
+
+@lru_cache(maxsize=256)
+def compile_template(text, variables):
+    return CompiledTemplate(text, variables)
+
+
+class PromptRegistry:
+    """
+    prompts.json and variables.json loaded once and indexed by (database, id).
+    The files are reloaded when their mtime changes (checked at most every `reload_interval` seconds).
+    """
+
+    def __init__(self, path_prompts, path_variables, reload_interval=PROMPT_RELOAD_INTERVAL):
+        self.path_prompts = path_prompts
+        self.path_variables = path_variables
+        self.reload_interval = reload_interval
+        self._mtimes = None
+        self._checked = 0.0
+        self._lock = threading.Lock()
+        self.prompts = {}
+        self.variables = {}
+        self.databases = set()
+
+    def _refresh(self):
+        now = time.monotonic()
+        if self._mtimes is not None and now - self._checked < self.reload_interval:
+            return
+        with self._lock:
+            self._checked = now
+            mtimes = (os.path.getmtime(self.path_prompts), os.path.getmtime(self.path_variables))
+            if mtimes == self._mtimes:
+                return
+            with open(self.path_prompts, "r") as f:
+                prompts = json.load(f)
+            with open(self.path_variables, "r") as f:
+                variables = json.load(f)
+            self.prompts = {
+                (p["database"], p["id"]): (p, compile_template(p["prompt"], tuple(p["variables"])))
+                for p in prompts
+            }
+            self.variables = {(v["database"], v["id"]): v for v in variables}
+            # プロンプトと変数の両方があるデータベース
+            self.databases = {p["database"] for p in prompts} & {v["database"] for v in variables}
+            self._mtimes = mtimes
+
+    def get(self, database, prompt_id, prompt_variable_id):
+        """Return (compiled template, variable entry) for a database."""
+        self._refresh()
+        if database not in self.databases:
+            raise ValueError(f"データベース {database} はJSONファイルに存在しません。")
+        prompt = self.prompts.get((database, prompt_id))
+        variable = self.variables.get((database, prompt_variable_id))
+        if not prompt or not variable:
+            raise ValueError(
+                f"ID {prompt_id} または {prompt_variable_id} のプロンプトまたは変数が見つかりません。"
+            )
+        return prompt[1], variable
+
+    def variables_entry(self, database, prompt_variable_id):
+        self._refresh()
+        variable = self.variables.get((database, prompt_variable_id))
+        if not variable:
+            raise ValueError(f"ID {prompt_variable_id} の変数が見つかりません。")
+        return variable
+
+
+_registries = {}
+
+
+def get_registry():
+    """Registry for the prompt files configured by PATH_DIR, PATH_PROMPTS and PATH_VARIABLES."""
     path_prompts = os.environ["PATH_DIR"] + os.environ["PATH_PROMPTS"]
     path_variables = os.environ["PATH_DIR"] + os.environ["PATH_VARIABLES"]
+    key = (path_prompts, path_variables)
+    registry = _registries.get(key)
+    if registry is None:
+        registry = _registries.setdefault(key, PromptRegistry(path_prompts, path_variables))
+    return registry
 
-    # 指定されたファイルからJSONデータをロードします
-    with open(path_prompts, "r") as f:
-        prompts = json.load(f)
-    with open(path_variables, "r") as f:
-        variables = json.load(f)
-
-    # JSONデータから特定のエントリを取得します
-    prompts_database = [v for v in prompts if v["database"] == database]
-    variable_database = [v for v in variables if v["database"] == database]
 
-    if not prompts_database or not variable_database:
-        raise ValueError(f"データベース {database} はJSONファイルに存在しません。")
+def load_variables_info(database: str, prompt_variable_id: int):
+    variable = get_registry().variables_entry(database, prompt_variable_id)
+    return variable["variables_info"]
 
-    prompt = next((v for v in prompts_database if v["id"] == prompt_id), None)
-    variable = next(
-        (v for v in variable_database if v["id"] == prompt_variable_id), None
-    )
 
-    if not prompt or not variable:
-        raise ValueError(
-            f"ID {prompt_id} または {prompt_variable_id} のプロンプトまたは変数が見つかりません。"
-        )
+def make_prompt(
+    database: str, prompt_id: int, prompt_variable_id: int, questions: list, top_k: int = PROMPT_SCHEMA_TOP_K
+):
+    template, variable = get_registry().get(database, prompt_id, prompt_variable_id)
 
     # 質問ごとにプロンプトを生成
     results = []
     for question in questions:
         params = {**variable, **question}  # 変数と質問の辞書をマージします
-        filled_prompt = fill_template_with_params(prompt, params)
+        if top_k and "user_question" in question:
+            # 質問に関係するスキーマ部分だけを残す
+            params["variables_info"] = prune_variables_info(database, variable["variables_info"], question["user_question"], top_k)
+        filled_prompt = template.render(params)
 
         # 質問辞書に追加情報を追加します
         question["prompt_id"] = prompt_id
@@ -50,54 +156,18 @@ def fill_template_with_params(template, params):
     """
     テンプレートのプレースホルダーをユーザーから提供されたパラメータおよび変数で置き換えます。
     """
-    text = template["prompt"]
-    for input_field in template["variables"]:
-        if input_field in params:
-            text = text.replace(f"{{{input_field}}}", str(params[input_field]))
-        else:
-            raise ValueError(f"変数 {input_field} がパラメータに見つかりません。")
-
-    # 埋められたプロンプトを評価します
-    return text
-
-
+    return compile_template(template["prompt"], tuple(template["variables"])).render(params)
 
 
 def make_one_prompt(
-    database: str, user_question: str
+    database: str, user_question: str, top_k: int = PROMPT_SCHEMA_TOP_K
 ):
-    path_prompts = os.environ["PATH_DIR"] + os.environ["PATH_PROMPTS"]
-    path_variables = os.environ["PATH_DIR"] + os.environ["PATH_VARIABLES"]
-
-    # 指定されたファイルからJSONデータをロードします
-    with open(path_prompts, "r") as f:
-        prompts = json.load(f)
-    with open(path_variables, "r") as f:
-        variables = json.load(f)
-
-    # JSONデータから特定のエントリを取得します
-    prompts_database = [v for v in prompts if v["database"] == database]
-    variable_database = [v for v in variables if v["database"] == database]
-
-    if database == 'uniprot':
-        prompt_id = 2
-        prompt_variable_id = 2
-    elif database == 'rhea':
-        prompt_id = 5
-        prompt_variable_id = 4
-    elif database == 'bgee':
-        prompt_id = 6
-        prompt_variable_id = 5
-
-    prompt = next((v for v in prompts_database if v["id"] == prompt_id), None)
-    variable = next(
-        (v for v in variable_database if v["id"] == prompt_variable_id), None
-    )
-
-    variable["user_question"] = user_question
-
-    final_prompt = prompt["prompt"]
-    for _variable in prompt["variables"]:
-        final_prompt = final_prompt.replace(f"{{{_variable}}}", variable[_variable])
-
-    return final_prompt
+    prompt_id, prompt_variable_id = DEFAULT_PROMPT_IDS[database]
+    template, variable = get_registry().get(database, prompt_id, prompt_variable_id)
+
+    params = {
+        **variable,
+        "user_question": user_question,
+        "variables_info": prune_variables_info(database, variable["variables_info"], user_question, top_k),
+    }
+    return template.render(params)
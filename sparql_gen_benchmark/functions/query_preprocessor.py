@@ -0,0 +1,157 @@
+from functools import lru_cache
+from typing import NamedTuple
+
+from .sparql_tokenizer import Token, tokenize
+
+# 正規形で大文字にしない名前（大文字小文字を区別するもの）
+CASE_SENSITIVE_NAMES = {"a", "true", "false"}
+
+
+class PreparedQuery(NamedTuple):
+    text: str  # エンドポイントに送るクエリ
+    canonical: str  # キャッシュや重複排除のキーにする正規形
+
+
+def _escape_res_names(tokens):
+    # res:Paris,_Texas のようなローカル名のカンマをエスケープする
+    merged = []
+    i = 0
+    while i < len(tokens):
+        token = tokens[i]
+        if token.kind == "PNAME" and token.value.startswith("res:"):
+            value = token.value
+            end = token.start + len(token.value)
+            while (
+                i + 2 < len(tokens)
+                and tokens[i + 1].value == ","
+                and tokens[i + 1].start == end
+                and tokens[i + 2].start == end + 1
+                and tokens[i + 2].kind in ("NAME", "PNAME", "NUMBER")
+            ):
+                value += "\\," + tokens[i + 2].value
+                end = tokens[i + 2].start + len(tokens[i + 2].value)
+                i += 2
+            token = Token("PNAME", value, token.start)
+        merged.append(token)
+        i += 1
+    return merged
+
+
+def _modifier_range(tokens):
+    """
+    Return (start, end) of the outer solution modifiers: the tokens between the
+    closing brace of the outer query pattern and a trailing VALUES block.
+    """
+    depth = 0
+    pattern_close = None
+    values_start = None
+    after_values = False
+    for i, token in enumerate(tokens):
+        if token.kind == "NAME" and token.value.upper() == "VALUES" and depth == 0:
+            values_start = i
+            after_values = True
+        elif token.kind == "PUNCT" and token.value == "{":
+            depth += 1
+        elif token.kind == "PUNCT" and token.value == "}":
+            depth -= 1
+            if depth == 0:
+                if after_values:
+                    after_values = False
+                else:
+                    pattern_close = i
+                    values_start = None
+    if pattern_close is None:
+        return None
+    end = values_start if values_start is not None and values_start > pattern_close else len(tokens)
+    return pattern_close + 1, end
+
+
+def _next_significant(tokens, index, end):
+    for i in range(index + 1, end):
+        if tokens[i].kind != "WS":
+            return i
+    return None
+
+
+def _find_modifier(tokens, start, end, keyword):
+    """Return (keyword index, number index) of an outer LIMIT/OFFSET, or None."""
+    depth = 0
+    for i in range(start, end):
+        token = tokens[i]
+        if token.kind == "PUNCT" and token.value in "()":
+            depth += 1 if token.value == "(" else -1
+        elif depth == 0 and token.kind == "NAME" and token.value.upper() == keyword:
+            number = _next_significant(tokens, i, end)
+            if number is not None and tokens[number].kind == "NUMBER":
+                return i, number
+    return None
+
+
+def _set_modifier(tokens, keyword, value):
+    """Override, insert (value >= 1) or remove (value < 1) the outer LIMIT/OFFSET."""
+    span = _modifier_range(tokens)
+    if span is None:
+        return tokens
+    start, end = span
+    found = _find_modifier(tokens, start, end, keyword)
+    if found is not None:
+        index, number = found
+        if value >= 1:
+            return tokens[:number] + [Token("NUMBER", str(value), tokens[number].start)] + tokens[number + 1:]
+        return tokens[:index] + tokens[number + 1:]
+    if value < 1:
+        return tokens
+    # 解モディファイアの末尾（後続の空白や VALUES の前）に追加する
+    insert_at = end
+    while insert_at > start and tokens[insert_at - 1].kind == "WS":
+        insert_at -= 1
+    position = tokens[insert_at - 1].start
+    added = [Token("WS", "\n", position), Token("NAME", keyword, position), Token("WS", " ", position), Token("NUMBER", str(value), position)]
+    return tokens[:insert_at] + added + tokens[insert_at:]
+
+
+def canonicalize(tokens):
+    return " ".join(
+        token.value.upper() if token.kind == "NAME" and token.value not in CASE_SENSITIVE_NAMES else token.value
+        for token in tokens
+        if token.kind not in ("WS", "COMMENT")
+    )
+
+
+@lru_cache(maxsize=4096)
+def preprocess_query(query_text, limit=None, offset=None):
+    """
+    Prepare a generated query for execution in a single tokenizer pass:
+    strip comments, escape commas in res: local names and set the outer LIMIT/OFFSET
+    (None keeps the query's own value, a value < 1 removes it). LIMITs inside
+    subqueries and string literals are left untouched.
+    Results are memoized per (query_text, limit, offset).
+    """
+    tokens = [token for token in tokenize(query_text, keep_whitespace=True) if token.kind != "COMMENT"]
+    tokens = _escape_res_names(tokens)
+
+    if limit is not None:
+        tokens = _set_modifier(tokens, "LIMIT", limit)
+    if offset is not None:
+        tokens = _set_modifier(tokens, "OFFSET", offset)
+
+    text = "".join(token.value for token in tokens).strip()
+    return PreparedQuery(text, canonicalize(tokens))
+
+
+@lru_cache(maxsize=4096)
+def outer_modifiers(query_text):
+    """(LIMIT, OFFSET) of the outer query as ints; None for a modifier that is not set."""
+    tokens = [token for token in tokenize(query_text, keep_whitespace=True) if token.kind != "COMMENT"]
+    span = _modifier_range(tokens)
+    values = []
+    for keyword in ("LIMIT", "OFFSET"):
+        found = _find_modifier(tokens, *span, keyword) if span is not None else None
+        values.append(int(tokens[found[1]].value) if found is not None else None)
+    return tuple(values)
+
+
+@lru_cache(maxsize=4096)
+def canonical_query(query_text):
+    """Canonical form of a query: comments and formatting removed, keywords upper-cased."""
+    return canonicalize(tokenize(query_text))
@@ -0,0 +1,134 @@
+"""
+Repair stage for failed generations: instead of sending the same prompt again, the model
+gets a short follow-up with the user question, its previous output and the concrete error
+(unparsable output, unknown variable, rdf-config error or endpoint error).
+"""
+import os
+import threading
+from collections import defaultdict
+
+from .gpt_excute import generate_query_spec
+from .query_spec import LLM_STRUCTURED_OUTPUT, QuerySpecError
+from .rdf_config_executer import RDFConfigError
+from .variable_index import UnknownVariableError, get_variable_index
+
+# off にすると失敗時は従来どおり同じプロンプトで生成し直す
+LLM_REPAIR = os.environ.get("LLM_REPAIR", "on").lower() != "off"
+
+REPAIR_TEMPLATE = """Your previous output for the user question below could not be used to build a SPARQL query. Fix only what the error points to.
+
+User Question: {question}
+
+[PREVIOUS OUTPUT]:
+{previous_output}
+
+[ERROR]:
+{error}
+{context}{output_format}"""
+
+REPAIR_NAMES = """
+[VALID VARIABLES]:
+{names}
+"""
+
+REPAIR_QUERY = """
+[GENERATED QUERY]:
+{query}
+"""
+
+# テキスト形式のときだけ出力形式を示す（function calling ではスキーマで決まる）
+REPAIR_FORMAT = """
+Answer again in this format:
+1. Variables
+variables to look for based on elements in [variables_info]:
+- <variable>
+2. Conditions
+condition and variable pair:
+- {<variable>: "<value>"}
+[OUTPUT]:
+"""
+
+
+class EndpointQueryError(RuntimeError):
+    """The local validator or the endpoint (4xx response) rejected the generated query."""
+
+    def __init__(self, message, query):
+        super().__init__(message)
+        self.query = query
+
+
+def classify_error(error):
+    """Kind of a generation failure, or None if it is not worth a repair (e.g. API errors)."""
+    if isinstance(error, QuerySpecError):
+        return "parse"
+    if isinstance(error, UnknownVariableError):
+        return "unknown_variable"
+    if isinstance(error, RDFConfigError):
+        return "rdf_config"
+    if isinstance(error, EndpointQueryError):
+        return "endpoint"
+    return None
+
+
+def user_question(prompt):
+    # 生成プロンプトの末尾 "User Question: ...\n[OUTPUT]:" から質問だけを取り出す
+    if "User Question:" not in prompt:
+        return prompt.strip()
+    question = prompt.rsplit("User Question:", 1)[1]
+    return question.split("[OUTPUT]:", 1)[0].strip()
+
+
+def make_repair_prompt(database, prompt, previous_output, error, structured=LLM_STRUCTURED_OUTPUT):
+    """Short follow-up asking the model to fix `previous_output` given `error`."""
+    kind = classify_error(error)
+    if kind == "endpoint":
+        context = REPAIR_QUERY.format(query=error.query.strip())
+    else:
+        index = get_variable_index(database)
+        context = REPAIR_NAMES.format(names=", ".join([*index.subjects, *index.variables]))
+    return REPAIR_TEMPLATE.format(
+        question=user_question(prompt),
+        previous_output=previous_output.strip(),
+        error=str(error),
+        context=context,
+        output_format="" if structured else REPAIR_FORMAT,
+    )
+
+
+def repair_query_spec(database, prompt, previous_output, error, attempt=0, structured=LLM_STRUCTURED_OUTPUT, use_cache=False):
+    """(llm_output, QuerySpec) from the repair follow-up; recorded under the site `repair_query_spec`."""
+    content = make_repair_prompt(database, prompt, previous_output, error, structured)
+    return generate_query_spec(content, attempt=attempt, structured=structured, site="repair_query_spec", use_cache=use_cache)
+
+
+# 試行の種類（generate / regenerate / repair:<kind>）ごとの成功数とトークン数
+_stats = defaultdict(lambda: {"attempts": 0, "successes": 0, "prompt_tokens": 0, "completion_tokens": 0})
+_stats_lock = threading.Lock()
+
+
+def record_attempt(mode, success, usage):
+    with _stats_lock:
+        stats = _stats[mode]
+        stats["attempts"] += 1
+        stats["successes"] += int(success)
+        stats["prompt_tokens"] += usage["prompt_tokens"]
+        stats["completion_tokens"] += usage["completion_tokens"]
+
+
+def get_repair_stats():
+    """Per attempt mode: attempts, success rate and tokens per attempt."""
+    with _stats_lock:
+        summary = {}
+        for mode, stats in _stats.items():
+            attempts = stats["attempts"]
+            summary[mode] = {
+                **stats,
+                "success_rate": stats["successes"] / attempts,
+                "tokens_per_attempt": (stats["prompt_tokens"] + stats["completion_tokens"]) / attempts,
+            }
+        return summary
+
+
+def reset_repair_stats():
+    with _stats_lock:
+        _stats.clear()
@@ -0,0 +1,100 @@
+import json
+import os
+from collections import Counter
+from typing import Dict, NamedTuple, Tuple
+
+from .text_extractor import extract_conditions_variables, extract_variable_names
+
+# on: 変数と条件を function calling の JSON で受け取る（失敗したらテキスト解析に戻る）
+LLM_STRUCTURED_OUTPUT = os.environ.get("LLM_STRUCTURED_OUTPUT", "off").lower() == "on"
+
+QUERY_SPEC_FUNCTION = "submit_query_spec"
+QUERY_SPEC_TOOL = {
+    "type": "function",
+    "function": {
+        "name": QUERY_SPEC_FUNCTION,
+        "description": "Submit the variables and the conditions identified for the user's question.",
+        "parameters": {
+            "type": "object",
+            "properties": {
+                "variables": {
+                    "type": "array",
+                    "items": {"type": "string"},
+                    "description": "Variables to look for, using the names in [variables_info].",
+                },
+                "parameters": {
+                    "type": "object",
+                    "additionalProperties": {"type": "string"},
+                    "description": "Conditions as {variable name: value}, e.g. {\"mnemonic\": \"ACE2_HUMAN\"}.",
+                },
+            },
+            "required": ["variables", "parameters"],
+        },
+    },
+}
+
+# 抽出方法ごとの回数（structured / structured_failed / text）
+extraction_stats = Counter()
+
+
+class QuerySpecError(ValueError):
+    """Raised when the structured output does not match the query spec schema."""
+
+
+class QuerySpec(NamedTuple):
+    variables: Tuple[str, ...]
+    parameters: Dict[str, str]
+
+
+def _parameter_text(key, value):
+    if isinstance(value, bool):
+        return "true" if value else "false"
+    if isinstance(value, (int, float)):
+        return str(value)
+    if isinstance(value, str):
+        return value.strip().strip('"')
+    raise QuerySpecError(f"parameter {key!r} must be a string, got {type(value).__name__}")
+
+
+def parse_query_spec(arguments):
+    """Validate the JSON arguments of a submit_query_spec call into a QuerySpec."""
+    try:
+        data = json.loads(arguments) if isinstance(arguments, str) else arguments
+    except json.JSONDecodeError as e:
+        raise QuerySpecError(f"arguments are not valid JSON: {e}") from e
+    if not isinstance(data, dict):
+        raise QuerySpecError("arguments must be a JSON object")
+
+    variables = data.get("variables")
+    if not isinstance(variables, list) or not all(isinstance(v, str) for v in variables):
+        raise QuerySpecError("variables must be a list of strings")
+    names = []
+    for variable in variables:
+        variable = variable.strip()
+        if variable and variable not in names:
+            names.append(variable)
+
+    parameters = data.get("parameters", {})
+    if isinstance(parameters, list):
+        # [{"name": ..., "value": ...}] の形で返されることがある
+        try:
+            parameters = {item["name"]: item["value"] for item in parameters}
+        except (KeyError, TypeError) as e:
+            raise QuerySpecError("parameters must be an object of name: value") from e
+    if not isinstance(parameters, dict):
+        raise QuerySpecError("parameters must be an object of name: value")
+    return QuerySpec(tuple(names), {str(k).strip(): _parameter_text(k, v) for k, v in parameters.items()})
+
+
+def spec_from_completion(completion):
+    """QuerySpec from the forced submit_query_spec tool call of a chat completion."""
+    message = completion.choices[0].message
+    for tool_call in message.tool_calls or []:
+        if tool_call.function.name == QUERY_SPEC_FUNCTION:
+            return parse_query_spec(tool_call.function.arguments)
+    raise QuerySpecError("the completion has no submit_query_spec call")
+
+
+def spec_from_text(llm_output):
+    """QuerySpec scraped from the free-text output format."""
+    return QuerySpec(tuple(extract_variable_names(llm_output)), extract_conditions_variables(llm_output))
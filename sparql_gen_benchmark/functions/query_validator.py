@@ -0,0 +1,159 @@
+import os
+import re
+from functools import lru_cache
+
+from .sparql_tokenizer import line_column, tokenize
+
+QUERY_FORMS = {"SELECT", "ASK", "CONSTRUCT", "DESCRIBE"}
+# 最後の } の後に置けるキーワード（解モディファイア）
+MODIFIER_KEYWORDS = {"GROUP", "BY", "HAVING", "ORDER", "ASC", "DESC", "LIMIT", "OFFSET", "VALUES", "UNDEF", "AS"}
+BRACKETS = {"{": "}", "(": ")", "[": "]"}
+PREFIX_LINE = re.compile(r"^\s*([\w\-.]*)\s*:\s*<([^>]*)>")
+
+
+@lru_cache(maxsize=None)
+def load_prefixes(database):
+    """
+    Read rdf-config/config/<database>/prefix.yaml into {prefix: iri}.
+    """
+    path = os.environ["PATH_RDF_CONFIG"] + "config/" + database + "/prefix.yaml"
+    prefixes = {}
+    with open(path, "r") as f:
+        for line in f:
+            match = PREFIX_LINE.match(line)
+            if match:
+                prefixes[match.group(1)] = match.group(2)
+    return prefixes
+
+
+def _issue(query, severity, message, position):
+    line, column = line_column(query, position)
+    return {"severity": severity, "message": message, "line": line, "column": column}
+
+
+def validate_query(query, database=None):
+    """
+    Check a SPARQL query locally before it is sent to an endpoint.
+
+    Returns a list of issues ({"severity", "message", "line", "column"}); "error" issues
+    mean the endpoint would reject the query, "warning" issues are likely mistakes.
+    Prefixes are checked against the query's PREFIX declarations and, when `database`
+    is given, against rdf-config/config/<database>/prefix.yaml.
+    """
+    tokens = [token for token in tokenize(query) if token.kind != "COMMENT"]
+    issues = []
+
+    # 字句エラー（閉じられていない文字列など）
+    for token in tokens:
+        if token.kind == "ERROR":
+            issues.append(_issue(query, "error", f"Unexpected character {token.value!r}", token.start))
+
+    # 括弧の対応
+    stack = []
+    last_close = None
+    for i, token in enumerate(tokens):
+        if token.kind != "PUNCT":
+            continue
+        if token.value in BRACKETS:
+            stack.append(token)
+        elif token.value in BRACKETS.values():
+            if not stack or BRACKETS[stack[-1].value] != token.value:
+                issues.append(_issue(query, "error", f"Unmatched '{token.value}'", token.start))
+                continue
+            stack.pop()
+            if token.value == "}" and not stack:
+                last_close = i
+    for token in stack:
+        issues.append(_issue(query, "error", f"Unclosed '{token.value}'", token.start))
+
+    # クエリ形式
+    names = [token for token in tokens if token.kind == "NAME"]
+    form = next((token for token in names if token.value.upper() in QUERY_FORMS), None)
+    if form is None:
+        issues.append(_issue(query, "error", "Missing query form (SELECT, ASK, CONSTRUCT or DESCRIBE)", 0))
+    elif form.value.upper() != "DESCRIBE" and not any(token.kind == "PUNCT" and token.value == "{" for token in tokens):
+        issues.append(_issue(query, "error", "Missing WHERE clause '{ ... }'", form.start))
+
+    # PREFIX 宣言と使用
+    declared = {}
+    for i, token in enumerate(tokens):
+        if token.kind == "NAME" and token.value.upper() == "PREFIX":
+            name = tokens[i + 1] if i + 1 < len(tokens) else None
+            iri = tokens[i + 2] if i + 2 < len(tokens) else None
+            if name is None or name.kind != "PNAME" or not name.value.endswith(":") or iri is None or iri.kind != "IRI":
+                issues.append(_issue(query, "error", "Malformed PREFIX declaration", token.start))
+                continue
+            declared[name.value[:-1]] = iri.value[1:-1]
+
+    known = load_prefixes(database) if database else {}
+    for prefix, iri in declared.items():
+        if prefix in known and known[prefix] != iri:
+            issues.append(_issue(query, "warning", f"Prefix '{prefix}:' is declared as <{iri}> but {database} uses <{known[prefix]}>", 0))
+
+    reported = set()
+    for i, token in enumerate(tokens):
+        if token.kind != "PNAME" or (i > 0 and tokens[i - 1].kind == "NAME" and tokens[i - 1].value.upper() == "PREFIX"):
+            continue
+        prefix = token.value.split(":", 1)[0]
+        if prefix in declared or prefix in reported:
+            continue
+        reported.add(prefix)
+        if prefix in known:
+            issues.append(_issue(query, "warning", f"Prefix '{prefix}:' is not declared in the query (known in {database})", token.start))
+        else:
+            issues.append(_issue(query, "error", f"Undeclared prefix '{prefix}:'", token.start))
+
+    # SELECT の変数がパターン中に現れるか
+    if form is not None and form.value.upper() == "SELECT":
+        start = tokens.index(form) + 1
+        end = next(
+            (i for i in range(start, len(tokens)) if (tokens[i].kind == "PUNCT" and tokens[i].value == "{") or (tokens[i].kind == "NAME" and tokens[i].value.upper() == "WHERE")),
+            len(tokens),
+        )
+        projected = []
+        bound = set()
+        for i in range(start, end):
+            token = tokens[i]
+            if token.kind != "VAR":
+                continue
+            if i > 0 and tokens[i - 1].kind == "NAME" and tokens[i - 1].value.upper() == "AS":
+                bound.add(token.value[1:])
+            else:
+                projected.append(token)
+        body_vars = {token.value[1:] for token in tokens[end:] if token.kind == "VAR"}
+        for token in projected:
+            name = token.value[1:]
+            if name not in body_vars and name not in bound:
+                issues.append(_issue(query, "warning", f"Variable '{token.value}' is selected but never used in the query pattern", token.start))
+
+    # 最後の } の後には解モディファイアしか置けない
+    if last_close is not None:
+        depth = 0
+        for i, token in enumerate(tokens[last_close + 1:], start=last_close + 1):
+            if token.kind == "PUNCT" and token.value in "()":
+                depth += 1 if token.value == "(" else -1
+            elif depth > 0 or token.kind != "NAME" or token.value.upper() in MODIFIER_KEYWORDS:
+                continue
+            elif i + 1 < len(tokens) and tokens[i + 1].value == "(":
+                continue  # ORDER BY STR(?x) などの関数呼び出し
+            else:
+                issues.append(_issue(query, "error", f"Unexpected '{token.value}' after the query pattern", token.start))
+                break
+        for i, token in enumerate(tokens[last_close + 1:], start=last_close + 1):
+            if token.kind == "NAME" and token.value.upper() in ("LIMIT", "OFFSET"):
+                following = tokens[i + 1] if i + 1 < len(tokens) else None
+                if following is None or following.kind != "NUMBER" or not following.value.isdigit():
+                    issues.append(_issue(query, "error", f"{token.value.upper()} must be followed by an integer", token.start))
+
+    return issues
+
+
+def has_errors(issues):
+    return any(issue["severity"] == "error" for issue in issues)
+
+
+def format_issues(issues):
+    return "\n".join(
+        f"{issue['severity']}: {issue['message']} (line {issue['line']}, column {issue['column']})"
+        for issue in issues
+    )
@@ -0,0 +1,72 @@
+import hashlib
+import json
+import os
+
+from .result_cache import ResultCache
+
+# rdf-config の出力キャッシュの設定（環境変数で上書き可能）
+RDF_CONFIG_CACHE_ENABLED = os.environ.get("RDF_CONFIG_CACHE", "on").lower() != "off"
+RDF_CONFIG_CACHE_DIR = os.environ.get(
+    "RDF_CONFIG_CACHE_DIR",
+    os.path.join(os.environ.get("PATH_DIR", ""), "data/cache/rdf_config"),
+)
+RDF_CONFIG_CACHE_ITEMS = int(os.environ.get("RDF_CONFIG_CACHE_ITEMS", "1024"))
+RDF_CONFIG_CACHE_MAX_BYTES = int(os.environ.get("RDF_CONFIG_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+
+# 生成結果に影響する設定ファイル
+SPEC_CONFIG_FILES = ("model.yaml", "prefix.yaml", "endpoint.yaml")
+
+
+def config_version(database):
+    """mtimes of the config files of a database; part of the key so edits invalidate entries."""
+    config_dir = os.path.join(os.environ["PATH_RDF_CONFIG"], "config", database)
+    version = []
+    for name in SPEC_CONFIG_FILES:
+        path = os.path.join(config_dir, name)
+        version.append(os.path.getmtime(path) if os.path.exists(path) else None)
+    return version
+
+
+def canonical_spec(database, variables, parameters):
+    """
+    Normalized (database, variables, parameters). rdf-config ignores repeated variables, so
+    those are dropped; order is kept because it decides the SELECT, comment and VALUES order.
+    """
+    names = []
+    for variable in variables:
+        if variable not in names:
+            names.append(variable)
+    return {
+        "database": database,
+        "variables": names,
+        "parameters": [[key, str(value)] for key, value in parameters.items()],
+    }
+
+
+class RDFConfigCache(ResultCache):
+    """
+    Generated SPARQL keyed by a hash of the canonical query spec and the config file mtimes,
+    shared by every caller of rdf_config_executer.generate_sparql.
+    """
+
+    def __init__(self, directory=RDF_CONFIG_CACHE_DIR, memory_items=RDF_CONFIG_CACHE_ITEMS, max_bytes=RDF_CONFIG_CACHE_MAX_BYTES, enabled=RDF_CONFIG_CACHE_ENABLED):
+        super().__init__(directory=directory, memory_items=memory_items, ttl=float("inf"), max_bytes=max_bytes, enabled=enabled)
+
+    @staticmethod
+    def make_spec_key(database, variables, parameters):
+        spec = canonical_spec(database, variables, parameters)
+        spec["config_version"] = config_version(database)
+        text = json.dumps(spec, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def lookup(self, database, variables, parameters):
+        if not self.enabled:
+            return None
+        return self.get_key(self.make_spec_key(database, variables, parameters))
+
+    def store(self, database, variables, parameters, sparql):
+        if self.enabled:
+            self.set_key(self.make_spec_key(database, variables, parameters), sparql)
+
+
+rdf_config_cache = RDFConfigCache()
@@ -1,17 +1,41 @@
+import argparse
+import json
 import os
+import queue
+import shlex
 import subprocess
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
 
+from .rdf_config_cache import rdf_config_cache
 
-# config/{database}/sparql.yamlに追記するテキストを生成
-def create_strain_text(database, id, variables, parameters):
-    path_config_sparql = (
-        os.environ["PATH_RDF_CONFIG"] + "config/" + database + "/sparql.yaml"
-    )
+# rdf-config の実行方法（環境変数で上書き可能）
+RDF_CONFIG_COMMAND = os.environ.get("RDF_CONFIG_COMMAND", "bundle exec rdf-config")
+RDF_CONFIG_WORKER = os.environ.get("RDF_CONFIG_WORKER", "on").lower() != "off"
+RDF_CONFIG_WORKER_COMMAND = os.environ.get("RDF_CONFIG_WORKER_COMMAND", "bundle exec ruby")
+RDF_CONFIG_WORKERS = int(os.environ.get("RDF_CONFIG_WORKERS", "2"))
+# on にすると rdf-config を使わず functions/sparql_builder.py でクエリを組み立てる
+SPARQL_BUILDER_NATIVE = os.environ.get("SPARQL_BUILDER_NATIVE", "off").lower() == "on"
+
+WORKER_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "rdf_config_worker.rb")
+
+
+class RDFConfigError(RuntimeError):
+    """rdf-config rejected the query spec (e.g. no path between the variables)."""
+
+    def __init__(self, message):
+        super().__init__(f"rdf-config: {message}")
+
+
+# sparql.yaml の1エントリ分のテキストを生成
+def make_strain_text(id, variables, parameters):
     # ヘッダー部分のテキスト生成
     header = f"\n{id}:\n  variables: ["
     header += ", ".join(variables)
     header += "]\n"
-    
+
     if len(parameters) > 0:
         header += "  parameters:\n"
     # パラメータ部分のテキスト生成
@@ -23,15 +47,30 @@ def create_strain_text(database, id, variables, parameters):
             param_text += f'    {key}: "{value}"\n'
 
     param_text += "  options:\n    distinct: true\n\n"
+    return header + param_text
+
 
-    # save path_config_sparql to save_path
-    with open(path_config_sparql, "a") as file:
-        file.write(header + param_text)
+@contextmanager
+def overlay_config(database, id, variables, parameters):
+    """
+    Temporary config directory for one request: links to the files of config/{database}
+    plus a sparql.yaml holding only this query, so config/{database}/sparql.yaml is never written.
+    """
+    config_dir = os.path.abspath(os.environ["PATH_RDF_CONFIG"] + "config/" + database)
+    with tempfile.TemporaryDirectory(prefix="rdf-config-") as tmp:
+        overlay_dir = os.path.join(tmp, database)
+        os.mkdir(overlay_dir)
+        for name in os.listdir(config_dir):
+            if name != "sparql.yaml":
+                os.symlink(os.path.join(config_dir, name), os.path.join(overlay_dir, name))
+        with open(os.path.join(overlay_dir, "sparql.yaml"), "w") as file:
+            file.write(make_strain_text(id, variables, parameters))
+        yield overlay_dir
 
 
 # コマンドとそのパラメータをリストとして定義
-def execute_rdf_config(database, id):
-    command = f"bundle exec rdf-config --config config/{database} --sparql {id}"
+def execute_rdf_config(config_dir, id):
+    command = f"{RDF_CONFIG_COMMAND} --config {shlex.quote(config_dir)} --sparql {shlex.quote(str(id))}"
     # 実行するディレクトリのパス
     directory_path = os.environ["PATH_RDF_CONFIG"]
 
@@ -47,5 +86,165 @@ def execute_rdf_config(database, id):
         )
     except subprocess.CalledProcessError as e:
         print("エラーが発生しました:", e)  # エラー内容を表示
+        raise RDFConfigError(e.stderr.strip()) from e
 
     return result.stdout
+
+
+class RDFConfigWorker:
+    """
+    A long-lived rdf-config process (functions/rdf_config_worker.rb) that keeps the
+    configs loaded and answers one JSON request per line.
+    """
+
+    def __init__(self, rdf_config_dir, command=RDF_CONFIG_WORKER_COMMAND):
+        self.rdf_config_dir = rdf_config_dir
+        self.command = shlex.split(command) + [WORKER_SCRIPT, os.path.abspath(rdf_config_dir)]
+        self.process = None
+
+    def start(self):
+        self.process = subprocess.Popen(
+            self.command,
+            cwd=self.rdf_config_dir,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.DEVNULL,
+            text=True,
+            bufsize=1,
+        )
+
+    def request(self, payload):
+        for attempt in range(2):
+            if self.process is None or self.process.poll() is not None:
+                self.start()
+            try:
+                self.process.stdin.write(json.dumps(payload) + "\n")
+                self.process.stdin.flush()
+                line = self.process.stdout.readline()
+            except (BrokenPipeError, OSError):
+                line = ""
+            if line:
+                return json.loads(line)
+            # プロセスが落ちていたら一度だけ起動し直す
+            self.close()
+        raise RuntimeError("rdf-config worker exited unexpectedly")
+
+    def close(self):
+        if self.process is not None:
+            self.process.kill()
+            self.process.wait()
+            self.process = None
+
+
+class RDFConfigWorkerPool:
+    """Up to `size` workers; each request takes one worker for its duration."""
+
+    def __init__(self, rdf_config_dir, size=RDF_CONFIG_WORKERS):
+        self.rdf_config_dir = rdf_config_dir
+        self.size = size
+        self._idle = queue.Queue()
+        self._created = 0
+        self._lock = threading.Lock()
+
+    def _acquire(self):
+        with self._lock:
+            if self._idle.empty() and self._created < self.size:
+                self._created += 1
+                return RDFConfigWorker(self.rdf_config_dir)
+        return self._idle.get()
+
+    def generate(self, database, variables, parameters):
+        worker = self._acquire()
+        try:
+            response = worker.request({"database": database, "variables": list(variables), "parameters": dict(parameters)})
+        finally:
+            self._idle.put(worker)
+        if "error" in response:
+            raise RDFConfigError(response["error"])
+        return response["sparql"]
+
+    def close(self):
+        while not self._idle.empty():
+            self._idle.get().close()
+        self._created = 0
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_worker_pool():
+    rdf_config_dir = os.environ["PATH_RDF_CONFIG"]
+    with _pools_lock:
+        if rdf_config_dir not in _pools:
+            _pools[rdf_config_dir] = RDFConfigWorkerPool(rdf_config_dir)
+        return _pools[rdf_config_dir]
+
+
+def generate_sparql(database, variables, parameters, id="query"):
+    """
+    Generate the SPARQL query for (database, variables, parameters) with rdf-config.
+    Results are memoised in rdf_config_cache until the database's config files change.
+    """
+    sparql = rdf_config_cache.lookup(database, variables, parameters)
+    if sparql is None:
+        sparql = _generate_sparql(database, variables, parameters, id)
+        rdf_config_cache.store(database, variables, parameters, sparql)
+    return sparql
+
+
+def _generate_sparql(database, variables, parameters, id):
+    """
+    Uses the in-process builder when SPARQL_BUILDER_NATIVE=on, otherwise the persistent worker
+    unless RDF_CONFIG_WORKER=off, in which case rdf-config is run as a command on a
+    per-request overlay config. Nothing is written to config/{database}.
+    """
+    if SPARQL_BUILDER_NATIVE:
+        from .sparql_builder import build_sparql_from_text
+
+        try:
+            return build_sparql_from_text(database, variables, parameters)
+        except Exception as e:
+            print(f"sparql_builder failed, falling back to rdf-config: {e}")
+    if RDF_CONFIG_WORKER:
+        return get_worker_pool().generate(database, variables, parameters)
+    with overlay_config(database, id, variables, parameters) as config_dir:
+        return execute_rdf_config(config_dir, id)
+
+
+def benchmark(database, variables, parameters, repeat=5):
+    """Per-call seconds of the rdf-config command (with --query) and of the worker."""
+    query_args = " ".join(shlex.quote(v) for v in variables if v not in parameters)
+    query_args += " " + " ".join(shlex.quote(f"{k}={v}") for k, v in parameters.items())
+    command = f"{RDF_CONFIG_COMMAND} --config config/{database} --query {query_args}"
+    timings = {"command": [], "worker": []}
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, shell=True, check=True, capture_output=True, cwd=os.environ["PATH_RDF_CONFIG"])
+        timings["command"].append(time.perf_counter() - start)
+
+    pool = get_worker_pool()
+    pool.generate(database, variables, parameters)  # 起動と設定の読み込みは初回のみ
+    for _ in range(repeat):
+        start = time.perf_counter()
+        pool.generate(database, variables, parameters)
+        timings["worker"].append(time.perf_counter() - start)
+    return {name: sum(values) / len(values) for name, values in timings.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare rdf-config command and worker per-call time")
+    parser.add_argument("--database", required=True)
+    parser.add_argument("--variables", nargs="+", required=True)
+    parser.add_argument("--parameters", nargs="*", default=[], help="name=value")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    parameters = dict(parameter.split("=", 1) for parameter in args.parameters)
+    result = benchmark(args.database, args.variables, parameters, args.repeat)
+    print(f"rdf-config command: {result['command'] * 1000:.1f} ms/call")
+    print(f"rdf-config worker:  {result['worker'] * 1000:.1f} ms/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env ruby
+# Long-lived rdf-config process used by functions/rdf_config_executer.py.
+#
+#   ruby functions/rdf_config_worker.rb <rdf-config directory>
+#
+# Reads one JSON request per line on stdin and writes one JSON response per line on stdout:
+#   {"database": "rhea", "variables": ["Reaction", "reaction_equation"], "parameters": {"reaction_id": "10024"}}
+#   => {"sparql": "PREFIX ..."} or {"error": "..."}
+# Configs (and their parsed models) stay in memory and are reloaded when a YAML file changes.
+
+require 'date'
+require 'json'
+require 'yaml'
+
+RDF_CONFIG_DIR = File.expand_path(ARGV[0] || Dir.pwd)
+$LOAD_PATH.unshift(File.join(RDF_CONFIG_DIR, 'lib'))
+require 'rdf-config'
+
+QUERY_NAME = 'worker'.freeze
+CONFIG_FILES = %w[model.yaml prefix.yaml endpoint.yaml].freeze
+
+# sparql.yaml に書いた場合と同じ解釈になるように値を YAML として読む
+def parameter_value(value)
+  value = value.to_s
+  text = value.end_with?("'") || value.include?(':') ? value : %("#{value}")
+  YAML.safe_load("value: #{text}", permitted_classes: [Date, Time])['value']
+end
+
+def config_mtimes(dir)
+  CONFIG_FILES.map { |name| File.exist?(File.join(dir, name)) ? File.mtime(File.join(dir, name)) : nil }
+end
+
+configs = {}
+
+def load_config(configs, database)
+  dir = File.join(RDF_CONFIG_DIR, 'config', database)
+  raise ArgumentError, "Unknown database: #{database}" unless File.directory?(dir)
+
+  mtimes = config_mtimes(dir)
+  cached = configs[dir]
+  return cached[:config] if cached && cached[:mtimes] == mtimes
+
+  configs[dir] = { config: RDFConfig::Config.new(dir), mtimes: mtimes }
+  configs[dir][:config]
+end
+
+def generate(configs, request)
+  config = load_config(configs, request.fetch('database'))
+  spec = { 'variables' => request.fetch('variables'), 'options' => request['options'] || { 'distinct' => true } }
+  parameters = (request['parameters'] || {}).transform_values { |value| parameter_value(value) }
+  spec['parameters'] = parameters unless parameters.empty?
+  config.instance_variable_set(:@sparql, { QUERY_NAME => spec })
+
+  # rdf-config はプロセス単位のシングルトンを使うので、リクエストごとに作り直す
+  RDFConfig::SPARQL::Validator.instance_variable_set(:@instance, nil)
+  RDFConfig::SPARQL::VariablesHandler.instance_variable_set(:@instance, {})
+
+  RDFConfig::SPARQL.new(config, sparql: QUERY_NAME).generate
+end
+
+# 警告の出力がプロトコルに混ざらないよう stdout を stderr に向ける
+protocol = $stdout.dup
+protocol.sync = true
+$stdout = $stderr
+
+while (line = $stdin.gets)
+  next if line.strip.empty?
+
+  response = begin
+    { 'sparql' => generate(configs, JSON.parse(line)) }
+  rescue StandardError => e
+    { 'error' => e.message }
+  end
+  protocol.puts(response.to_json)
+end
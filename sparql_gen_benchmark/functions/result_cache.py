@@ -0,0 +1,157 @@
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from .query_preprocessor import canonical_query
+
+# キャッシュの設定（環境変数で上書き可能）
+CACHE_ENABLED = os.environ.get("SPARQL_CACHE", "on").lower() != "off"
+CACHE_DIR = os.environ.get(
+    "SPARQL_CACHE_DIR",
+    os.path.join(os.environ.get("PATH_DIR", ""), "data/cache/sparql"),
+)
+CACHE_MEMORY_ITEMS = int(os.environ.get("SPARQL_CACHE_MEMORY_ITEMS", "128"))
+CACHE_TTL = int(os.environ.get("SPARQL_CACHE_TTL", str(7 * 24 * 60 * 60)))
+CACHE_MAX_BYTES = int(os.environ.get("SPARQL_CACHE_MAX_BYTES", str(1024 * 1024 * 1024)))
+
+
+class ResultCache:
+    """
+    Two-level cache of SPARQL results (JSON bindings or TSV/CSV text) keyed by
+    (endpoint, canonical query, result format).
+    An in-memory LRU sits in front of gzip-compressed JSON files on disk.
+    """
+
+    def __init__(self, directory=CACHE_DIR, memory_items=CACHE_MEMORY_ITEMS, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES, enabled=True):
+        self.enabled = enabled
+        self.directory = directory
+        self.memory_items = memory_items
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+        self._memory = OrderedDict()
+        self._disk_bytes = None  # ディスク使用量（初回書き込み時に計算）
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(endpoint, query, variant="json"):
+        text = endpoint + "\n" + canonical_query(query)
+        if variant != "json":
+            text += "\n" + variant  # TSV/CSVなど結果フォーマットごとに分ける
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], key + ".json.gz")
+
+    def get(self, endpoint, query, variant="json"):
+        """Return the cached result, or None on a miss."""
+        if not self.enabled:
+            return None
+        return self.get_key(self.make_key(endpoint, query, variant))
+
+    def set(self, endpoint, query, bindings, variant="json"):
+        if not self.enabled:
+            return
+        self.set_key(self.make_key(endpoint, query, variant), bindings)
+
+    def get_key(self, key):
+        """Look up an entry by its raw key."""
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and time.time() - entry[0] <= self.ttl:
+                self._memory.move_to_end(key)
+                self.stats["memory_hits"] += 1
+                return entry[1]
+
+        bindings = self._read_disk(key)
+        with self._lock:
+            if bindings is None:
+                self.stats["misses"] += 1
+                return None
+            self.stats["disk_hits"] += 1
+            self._remember(key, bindings, time.time())
+        return bindings
+
+    def set_key(self, key, bindings):
+        with self._lock:
+            self._remember(key, bindings, time.time())
+        if self.directory:
+            self._write_disk(key, bindings)
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+        for path, _, _ in self._disk_entries():
+            os.remove(path)
+        self._disk_bytes = None
+
+    def _remember(self, key, bindings, created):
+        self._memory[key] = (created, bindings)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def _read_disk(self, key):
+        if not self.directory:
+            return None
+        path = self._path(key)
+        try:
+            if time.time() - os.path.getmtime(path) > self.ttl:
+                os.remove(path)
+                return None
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_disk(self, key, bindings):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        # 書き込み途中のファイルを読まれないよう一時ファイル経由で置き換える
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8") as f:
+            json.dump(bindings, f)
+        replaced = os.path.getsize(path) if os.path.exists(path) else 0
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = sum(size for _, _, size in self._disk_entries())
+            else:
+                self._disk_bytes += os.path.getsize(path) - replaced
+            if self._disk_bytes > self.max_bytes:
+                self._evict_disk()
+
+    def _disk_entries(self):
+        if not self.directory or not os.path.isdir(self.directory):
+            return []
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".json.gz"):
+                    path = os.path.join(root, name)
+                    stat = os.stat(path)
+                    entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def _evict_disk(self):
+        entries = self._disk_entries()
+        total = sum(size for _, _, size in entries)
+        now = time.time()
+        # 期限切れのものと古いものから削除する
+        for path, mtime, size in sorted(entries, key=lambda e: e[1]):
+            if total <= self.max_bytes and now - mtime <= self.ttl:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+        self._disk_bytes = total
+
+
+result_cache = ResultCache(enabled=CACHE_ENABLED)
@@ -0,0 +1,97 @@
+import codecs
+import json
+import re
+
+# "bindings": [ の位置を探す（head.vars 内の "bindings" という変数名とは区別する）
+BINDINGS_START = re.compile(r'"bindings"\s*:\s*\[')
+# 見つからなかった時に次のチャンクと合わせて探すために残す文字数
+SEARCH_OVERLAP = 64
+
+_decoder = json.JSONDecoder()
+_whitespace = " \t\n\r,"
+
+
+def iter_bindings(chunks, max_rows=None, max_bytes=None):
+    """
+    Incrementally parse an application/sparql-results+json body and yield each binding
+    as soon as it is complete.
+
+    `chunks` is an iterable of bytes (e.g. response.iter_content()). Parsing stops after
+    `max_rows` bindings or once more than `max_bytes` bytes have been read.
+    Returns True only when the whole bindings array was read; False when a limit cut it
+    short, the body ended early or it had no bindings array (e.g. an HTML error page).
+    """
+    text_decoder = codecs.getincrementaldecoder("utf-8")()
+    buffer = ""
+    position = None  # bindings 配列内の読み取り位置
+    bytes_read = 0
+    rows = 0
+    finished = False
+
+    chunk_iter = iter(chunks)
+    while not finished:
+        chunk = next(chunk_iter, None)
+        if chunk is None:
+            finished = True
+            buffer += text_decoder.decode(b"", final=True)
+        else:
+            bytes_read += len(chunk)
+            buffer += text_decoder.decode(chunk)
+
+        if position is None:
+            match = BINDINGS_START.search(buffer)
+            if match is None:
+                if max_bytes is not None and bytes_read > max_bytes:
+                    return False
+                # 配列の前の部分は使わないので、チャンクをまたぐ "bindings" の分だけ残す
+                buffer = buffer[-SEARCH_OVERLAP:]
+                continue
+            buffer = buffer[match.end():]
+            position = 0
+
+        while True:
+            while position < len(buffer) and buffer[position] in _whitespace:
+                position += 1
+            if position >= len(buffer):
+                break
+            if buffer[position] == "]":
+                return True
+            try:
+                binding, position = _decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if finished:
+                    raise
+                break  # オブジェクトが途中なので次のチャンクを待つ
+            yield binding
+            rows += 1
+            if max_rows is not None and rows >= max_rows:
+                return False
+
+        buffer = buffer[position:]
+        position = 0
+
+        if max_bytes is not None and bytes_read > max_bytes:
+            return False
+
+    # bindings 配列が閉じられないまま終わった場合や、配列が無かった場合は不完全とみなす
+    return False
+
+
+def iter_batches(bindings, batch_size=1000):
+    """
+    Group an iterator of bindings into lists of at most `batch_size` rows.
+    Returns the return value of `bindings` (see iter_bindings).
+    """
+    bindings = iter(bindings)
+    batch = []
+    while True:
+        try:
+            binding = next(bindings)
+        except StopIteration as stop:
+            if batch:
+                yield batch
+            return stop.value
+        batch.append(binding)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
@@ -0,0 +1,210 @@
+import csv
+import io
+import re
+from collections.abc import Sequence
+
+import pandas as pd
+
+XSD = "http://www.w3.org/2001/XMLSchema#"
+INTEGER_TYPES = {
+    XSD + name
+    for name in (
+        "integer", "int", "long", "short", "byte",
+        "nonNegativeInteger", "positiveInteger", "nonPositiveInteger", "negativeInteger",
+        "unsignedLong", "unsignedInt", "unsignedShort", "unsignedByte",
+    )
+}
+FLOAT_TYPES = {XSD + "decimal", XSD + "double", XSD + "float"}
+BOOLEAN_TYPE = XSD + "boolean"
+
+# 結果フォーマットごとのAcceptヘッダー
+MEDIA_TYPES = {
+    "tsv": "text/tab-separated-values",
+    "csv": "text/csv",
+}
+
+LITERAL_PATTERN = re.compile(r'^"(.*)"(?:@([A-Za-z0-9-]+)|\^\^<([^>]*)>)?$', re.DOTALL)
+ESCAPE_PATTERN = re.compile(r'\\(u[0-9A-Fa-f]{4}|U[0-9A-Fa-f]{8}|.)')
+ESCAPES = {"t": "\t", "n": "\n", "r": "\r", "b": "\b", "f": "\f", '"': '"', "'": "'", "\\": "\\"}
+INTEGER_PATTERN = re.compile(r"^[+-]?\d+$")
+FLOAT_PATTERN = re.compile(r"^[+-]?(\d+\.\d*|\.\d+|\d+)([eE][+-]?\d+)?$")
+
+
+class IRI(str):
+    """An IRI cell. Compares equal to the plain string of the IRI."""
+
+    __slots__ = ()
+
+
+class BNode(str):
+    """A blank node cell."""
+
+    __slots__ = ()
+
+
+_iris = {}
+
+
+def intern_iri(value):
+    # 同じIRIは同じオブジェクトを共有する
+    iri = _iris.get(value)
+    if iri is None:
+        iri = _iris.setdefault(value, IRI(value))
+    return iri
+
+
+def _unescape(text):
+    def replace(match):
+        code = match.group(1)
+        if code[0] in "uU" and len(code) > 1:
+            return chr(int(code[1:], 16))
+        return ESCAPES.get(code, code)
+
+    return ESCAPE_PATTERN.sub(replace, text) if "\\" in text else text
+
+
+def _typed_value(value, datatype):
+    try:
+        if datatype in INTEGER_TYPES:
+            return int(value)
+        if datatype in FLOAT_TYPES:
+            return float(value)
+    except ValueError:
+        return value
+    if datatype == BOOLEAN_TYPE:
+        return value in ("true", "1")
+    return value
+
+
+def parse_tsv_term(term):
+    """Convert one RDF term of a SPARQL TSV result into a Python value."""
+    if term == "":
+        return None  # 未束縛
+    if term[0] == "<" and term[-1] == ">":
+        return intern_iri(term[1:-1])
+    if term.startswith("_:"):
+        return BNode(term[2:])
+    if term[0] == '"':
+        match = LITERAL_PATTERN.match(term)
+        if match is None:
+            return term
+        value = _unescape(match.group(1))
+        return _typed_value(value, match.group(3)) if match.group(3) else value
+    if INTEGER_PATTERN.match(term):
+        return int(term)
+    if FLOAT_PATTERN.match(term):
+        return float(term)
+    if term in ("true", "false"):
+        return term == "true"
+    return term
+
+
+def parse_tsv(text):
+    """
+    Parse a text/tab-separated-values SPARQL result straight into a DataFrame.
+    IRIs are interned and typed literals become int/float/bool columns.
+    """
+    # splitlines() は \u2028 や \x85 などリテラル内に現れ得る文字でも分割するので、改行だけで分ける
+    lines = [line[:-1] if line.endswith("\r") else line for line in text.split("\n")]
+    if lines[-1] == "":
+        lines.pop()
+    if not lines:
+        return pd.DataFrame()
+    columns = [name.lstrip("?$") for name in lines[0].split("\t")]
+    values = [[] for _ in columns]
+    for line in lines[1:]:
+        terms = line.split("\t")
+        for i, column_values in enumerate(values):
+            column_values.append(parse_tsv_term(terms[i]) if i < len(terms) else None)
+    return pd.DataFrame({column: pd.Series(column_values, dtype=_dtype(column_values)) for column, column_values in zip(columns, values)})
+
+
+def parse_csv(text):
+    """
+    Parse a text/csv SPARQL result into a DataFrame.
+    The CSV format carries no term types, so every cell stays a string.
+    """
+    reader = csv.reader(io.StringIO(text))
+    header = next(reader, None)
+    if header is None:
+        return pd.DataFrame()
+    values = [[] for _ in header]
+    for row in reader:
+        for i, column_values in enumerate(values):
+            column_values.append(row[i] if i < len(row) and row[i] != "" else None)
+    return pd.DataFrame({column: pd.Series(column_values, dtype=object) for column, column_values in zip(header, values)})
+
+
+def parse_table(text, result_format):
+    if result_format == "tsv":
+        return parse_tsv(text)
+    if result_format == "csv":
+        return parse_csv(text)
+    raise ValueError(f"Unsupported result format: {result_format}")
+
+
+def _dtype(column_values):
+    kinds = {type(value) for value in column_values if value is not None}
+    has_missing = len(kinds) == 0 or any(value is None for value in column_values)
+    if kinds == {int}:
+        return "Int64" if has_missing else "int64"
+    if kinds <= {int, float} and kinds:
+        return "float64"
+    if kinds == {bool}:
+        return "boolean" if has_missing else "bool"
+    return object
+
+
+def _term_dict(value):
+    if isinstance(value, IRI):
+        return {"type": "uri", "value": str(value)}
+    if isinstance(value, BNode):
+        return {"type": "bnode", "value": str(value)}
+    if isinstance(value, bool):
+        return {"type": "literal", "datatype": BOOLEAN_TYPE, "value": "true" if value else "false"}
+    if isinstance(value, int):
+        return {"type": "literal", "datatype": XSD + "integer", "value": str(value)}
+    if isinstance(value, float):
+        return {"type": "literal", "datatype": XSD + "double", "value": repr(value)}
+    return {"type": "literal", "value": str(value)}
+
+
+class BindingsView(Sequence):
+    """
+    Read-only list-of-dicts view over a result table, in the SPARQL JSON binding shape.
+    Rows are only materialized when accessed; `table` gives the columnar data.
+    """
+
+    def __init__(self, table):
+        self.table = table
+
+    def __len__(self):
+        return len(self.table)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        row = self.table.iloc[index]
+        return {
+            column: _term_dict(value.item() if hasattr(value, "item") else value)
+            for column, value in row.items()
+            if not pd.isna(value)
+        }
+
+
+def to_value_frame(results, as_strings=False):
+    """
+    Return a DataFrame of plain cell values for any result shape:
+    a DataFrame, a BindingsView or a list of SPARQL JSON bindings.
+    With `as_strings`, typed TSV columns become object columns of lexical values (None when
+    unbound), the same values a JSON result gives; the evaluator compares frames this way.
+    """
+    if isinstance(results, BindingsView):
+        results = results.table
+    if isinstance(results, pd.DataFrame):
+        if not as_strings:
+            return results
+        # Int64/boolean 列は "missing" などで埋められないので object にしてから変換する
+        return results.astype(object).map(lambda x: None if pd.isna(x) else _term_dict(x)["value"])
+    df = pd.DataFrame(results) if results else pd.DataFrame()
+    return df if df.empty else df.map(lambda x: x["value"] if isinstance(x, dict) and "value" in x else x)
@@ -6,6 +6,8 @@ from scipy.optimize import linear_sum_assignment
 from tqdm import tqdm
 import hashlib
 
+from .result_table import to_value_frame
+
 
 def dict_to_tuple(d):
     if isinstance(d, dict):
@@ -55,8 +57,9 @@ def find_best_column_matches(df1: pd.DataFrame, df2: pd.DataFrame) -> List[tuple
 
 def pad_rows(df1: pd.DataFrame, df2: pd.DataFrame) -> Tuple[pd.DataFrame, pd.DataFrame]:
     max_len = max(len(df1), len(df2))
-    df1_padded = df1.reindex(range(max_len)).fillna(value="missing")
-    df2_padded = df2.reindex(range(max_len)).fillna(value="missing")
+    # 型付きの列（Int64 など）にも "missing" を入れられるように object にしてから埋める
+    df1_padded = df1.astype(object).reindex(range(max_len)).fillna(value="missing")
+    df2_padded = df2.astype(object).reindex(range(max_len)).fillna(value="missing")
     # print(f"Padded DataFrames:\nDF1:\n{df1_padded}\n\nDF2:\n{df2_padded}")
     return df1_padded, df2_padded
 
@@ -66,13 +69,11 @@ def evaluate_nested_data(
     all_metrics = {}
     for q, a in zip(questions, answer):
         try:
-            q_df = pd.DataFrame(q["results"]) if q["results"] else pd.DataFrame()
-            q_df = q_df if q_df.empty else q_df.applymap(lambda x: x["value"])
+            q_df = to_value_frame(q["results"], as_strings=True)
             save_columns = [key for key in q["variables"] if key in q_df.columns]
             q_df = q_df[save_columns]
 
-            a_df = pd.DataFrame(a["results"]) if a["results"] else pd.DataFrame()
-            a_df = a_df if a_df.empty else a_df.applymap(lambda x: x["value"])
+            a_df = to_value_frame(a["results"], as_strings=True)
             save_columns = [key for key in q["variables"] if key in a_df.columns]
             a_df = a_df[save_columns]
 
@@ -230,12 +231,10 @@ def evaluate_jaccard(
             continue
 
         # 質問のDataFrame
-        q_df = pd.DataFrame(q["results"]) if q["results"] else pd.DataFrame()
-        q_df = q_df if q_df.empty else q_df.applymap(lambda x: x["value"] if isinstance(x, dict) and "value" in x else x)
+        q_df = to_value_frame(q["results"], as_strings=True)
 
         # 回答のDataFrame
-        a_df = pd.DataFrame(a["results"]) if a["results"] else pd.DataFrame()
-        a_df = a_df if a_df.empty else a_df.applymap(lambda x: x["value"] if isinstance(x, dict) and "value" in x else x)
+        a_df = to_value_frame(a["results"], as_strings=True)
 
 
         # print(q_df.shape, a_df.shape)
@@ -0,0 +1,322 @@
+"""
+Index of the subjects and variables of rdf-config/config/<db>/model.yaml, used to put
+only the schema fragments relevant to a question into the generation prompt.
+
+Compare prompt size and schema coverage on a question set (JSON list of questions):
+
+    python -m functions.schema_index --database rhea --questions questions.json --top-k 3 --gold-key sparql
+"""
+import argparse
+import json
+import math
+import os
+import re
+from collections import Counter, deque
+from functools import lru_cache
+from typing import NamedTuple, Tuple
+
+from .sparql_builder import Literal, Subject, ValueList, ruby_str
+from .sparql_builder import load_model as load_config_model
+from .sparql_tokenizer import tokenize
+
+PROMPT_SCHEMA_TOP_K = int(os.environ.get("PROMPT_SCHEMA_TOP_K", "0"))  # 0 = スキーマ全体を使う
+
+WORD = re.compile(r"[A-Z]?[a-z]+|[A-Z]+(?![a-z])|\d+")
+
+
+class SchemaVariable(NamedTuple):
+    name: str
+    subject: str
+    path: Tuple[str, ...]  # 主語からの述語（空白ノードを経由する場合は複数）
+    example: str
+    comment: str
+
+
+class SchemaSubject(NamedTuple):
+    name: str
+    example: str
+    types: Tuple[str, ...]
+    variables: Tuple[SchemaVariable, ...]
+
+
+def _split_comment(text):
+    # 引用符の外で空白の後に続く # 以降をコメントとする（IRI の # は残す）
+    quoted = False
+    for i, char in enumerate(text):
+        if char == '"':
+            quoted = not quoted
+        elif char == "#" and not quoted and (i == 0 or text[i - 1] in " \t"):
+            return text[:i].rstrip(), text[i + 1:].strip()
+    return text.rstrip(), ""
+
+
+@lru_cache(maxsize=None)
+def _comments(path, mtime):
+    # YAML として読むとコメントが失われるので、"- name: example # comment" の行からコメントだけを拾う
+    comments = {}
+    with open(path, "r") as f:
+        for line in f:
+            stripped = line.strip()
+            if not stripped.startswith("- "):
+                continue
+            body, comment = _split_comment(stripped[2:])
+            if comment and ":" in body:
+                comments.setdefault(body.split(":", 1)[0].strip(), comment)
+    return comments
+
+
+def _example(model, obj):
+    # model.yaml に書かれていた形に戻す（文字列リテラルは引用符付き、主語の参照はその名前）
+    if isinstance(obj, Subject):
+        return obj.as_object_value
+    if isinstance(obj, ValueList):
+        return ", ".join(_example(model, value) for value in obj.value)
+    if isinstance(obj, Literal) and isinstance(obj.value, str):
+        # "A, B" のように主語名を並べた値は references() で参照として扱うので引用符を付けない
+        if all(model.is_subject(name) for name in re.split(r",\s*", obj.value)):
+            return obj.value
+        return f'"{obj.value}"'
+    return ruby_str(obj.value)
+
+
+@lru_cache(maxsize=None)
+def _schema_subjects(model, comments):
+    comments = dict(comments)
+    variables = {subject.name: [] for subject in model.subjects}
+    for triple in model.triples:
+        if triple.predicates[-1].rdf_type or not triple.object_name or not isinstance(triple.object_name, str):
+            continue
+        variables[triple.subject.name].append(
+            SchemaVariable(
+                triple.object_name,
+                triple.subject.name,
+                tuple(predicate.uri for predicate in triple.predicates),
+                _example(model, triple.object),
+                comments.get(triple.object_name, ""),
+            )
+        )
+    return tuple(
+        SchemaSubject(subject.name, subject.value or "", tuple(subject.types), tuple(variables[subject.name]))
+        for subject in model.subjects
+    )
+
+
+def model_path(database):
+    return os.environ["PATH_RDF_CONFIG"] + "config/" + database + "/model.yaml"
+
+
+def load_model(database):
+    """
+    SchemaSubjects of a database, taken from the sparql_builder model of config/<database>
+    (the same reading of model.yaml that query generation uses); rebuilt when the files change.
+    """
+    path = model_path(database)
+    comments = _comments(path, os.path.getmtime(path))
+    return _schema_subjects(load_config_model(database), tuple(comments.items()))
+
+
+def _terms(text):
+    # taxonomy_scientific_name, hasExpressionLevel などを単語に分解し、簡単に複数形を揃える
+    terms = []
+    for word in WORD.findall(text or ""):
+        word = word.lower()
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        terms.append(word)
+    return terms
+
+
+def references(subjects):
+    """Undirected graph {subject: {subject}} of subjects referring to each other through variables."""
+    names = {subject.name for subject in subjects}
+    graph = {name: set() for name in names}
+    for subject in subjects:
+        for variable in subject.variables:
+            for target in re.split(r",\s*", variable.example):
+                if target in names and target != subject.name:
+                    graph[subject.name].add(target)
+                    graph[target].add(subject.name)
+    return graph
+
+
+class SchemaIndex:
+    """BM25 index with one document per subject (its name, types, predicates and variables)."""
+
+    def __init__(self, subjects, descriptions=None, k1=1.2, b=0.75):
+        self.subjects = {subject.name: subject for subject in subjects}
+        self.graph = references(subjects)
+        self.k1 = k1
+        self.b = b
+        descriptions = descriptions or {}
+        self.documents = {}
+        for subject in subjects:
+            text = [subject.name, *subject.types]
+            for variable in subject.variables:
+                text += [variable.name, *variable.path, variable.comment, descriptions.get(variable.name, "")]
+                if not variable.example.startswith('"'):
+                    text.append(variable.example)
+            self.documents[subject.name] = Counter(_terms(" ".join(text)))
+        self.average_length = sum(sum(d.values()) for d in self.documents.values()) / max(len(self.documents), 1)
+        self.document_frequency = Counter(term for document in self.documents.values() for term in document)
+
+    def scores(self, question):
+        n = len(self.documents)
+        scores = {}
+        for name, document in self.documents.items():
+            length = sum(document.values())
+            score = 0.0
+            for term in set(_terms(question)):
+                tf = document.get(term, 0)
+                if not tf:
+                    continue
+                idf = math.log(1 + (n - self.document_frequency[term] + 0.5) / (self.document_frequency[term] + 0.5))
+                score += idf * tf * (self.k1 + 1) / (tf + self.k1 * (1 - self.b + self.b * length / self.average_length))
+            scores[name] = score
+        return scores
+
+    def _path(self, start, goals):
+        # 幅優先探索で選択済みの主語までの経路を求める
+        previous = {start: None}
+        queue = deque([start])
+        while queue:
+            current = queue.popleft()
+            if current in goals:
+                path = []
+                while current is not None:
+                    path.append(current)
+                    current = previous[current]
+                return path
+            for neighbour in self.graph[current]:
+                if neighbour not in previous:
+                    previous[neighbour] = current
+                    queue.append(neighbour)
+        return [start]
+
+    def select(self, question, top_k):
+        """Top-k subjects for the question plus the subjects that connect them. None if nothing matches."""
+        scores = self.scores(question)
+        ranked = [name for name, score in sorted(scores.items(), key=lambda item: -item[1]) if score > 0][:top_k]
+        if not ranked:
+            return None
+        selected = {ranked[0]}
+        for name in ranked[1:]:
+            selected.update(self._path(name, selected))
+        return selected
+
+
+def parse_descriptions(variables_info):
+    """{variable: description} from the "name: example # description" lines of a variables_info block."""
+    descriptions = {}
+    for line in variables_info.splitlines():
+        body, comment = _split_comment(line.strip().lstrip("- "))
+        if ":" in body and comment:
+            descriptions[body.split(":", 1)[0].strip()] = comment
+    return descriptions
+
+
+@lru_cache(maxsize=None)
+def _cached_index(database, mtime, variables_info):
+    return SchemaIndex(load_model(database), parse_descriptions(variables_info))
+
+
+def get_index(database, variables_info=""):
+    return _cached_index(database, os.path.getmtime(model_path(database)), variables_info)
+
+
+def prune_variables_info(database, variables_info, question, top_k=PROMPT_SCHEMA_TOP_K):
+    """
+    Keep only the parts of a variables_info block that belong to the top-k subjects for
+    the question. Returns the block unchanged when pruning is off or nothing matches.
+    """
+    if not top_k:
+        return variables_info
+    index = get_index(database, variables_info)
+    selected = index.select(question, top_k)
+    if selected is None:
+        return variables_info
+    lines = variables_info.splitlines()
+    if "[VARIABLES]" in variables_info:
+        # "name: example # description" の一覧形式: 選ばれなかった主語の変数の行を落とす
+        dropped = {
+            name
+            for subject in index.subjects.values() if subject.name not in selected
+            for name in [subject.name, *(v.name for v in subject.variables)]
+        }
+        kept = [line for line in lines if line.split(":", 1)[0].strip() not in dropped]
+        return "\n".join(kept)
+
+    # model.yaml と同じ木構造の形式: 主語ごとのブロック単位で残す
+    blocks, current = [], []
+    for line in lines:
+        if line.startswith("- ") and current:
+            blocks.append(current)
+            current = []
+        current.append(line)
+    if current:
+        blocks.append(current)
+    kept = [block for block in blocks if not block[0].startswith("- ") or block[0][2:].split(" ", 1)[0] in selected]
+    return "\n".join(line for block in kept for line in block)
+
+
+def estimate_tokens(text):
+    # 1トークン≒4文字の大まかな見積もり
+    return len(text) // 4
+
+
+def gold_predicates(query):
+    tokens = tokenize(query or "")
+    return {
+        token.value for i, token in enumerate(tokens)
+        if token.kind == "PNAME" and not (i > 0 and tokens[i - 1].value.upper() == "PREFIX")
+    }
+
+
+def evaluate_pruning(database, questions, top_k, variables_info, question_key="user_question", gold_key=None):
+    """
+    Prompt size with and without pruning for a question set. With `gold_key`, also the share
+    of questions whose gold query predicates are all still present in the pruned schema.
+    """
+    index = get_index(database, variables_info)
+    schema_predicates = {p for s in index.subjects.values() for v in s.variables for p in v.path}
+    full_tokens = pruned_tokens = covered = 0
+    for question in questions:
+        pruned = prune_variables_info(database, variables_info, question[question_key], top_k)
+        full_tokens += estimate_tokens(variables_info)
+        pruned_tokens += estimate_tokens(pruned)
+        if gold_key:
+            selected = index.select(question[question_key], top_k) or set(index.subjects)
+            kept = {p for s in selected for v in index.subjects[s].variables for p in v.path}
+            needed = gold_predicates(question[gold_key]) & schema_predicates
+            covered += needed <= kept
+    report = {
+        "questions": len(questions),
+        "full_tokens": full_tokens,
+        "pruned_tokens": pruned_tokens,
+        "token_savings": 1 - pruned_tokens / full_tokens if full_tokens else 0.0,
+    }
+    if gold_key:
+        report["schema_coverage"] = covered / len(questions) if questions else 0.0
+    return report
+
+
+def main():
+    from .prompt_maker import DEFAULT_PROMPT_IDS, load_variables_info
+
+    parser = argparse.ArgumentParser(description="Report token savings of schema-pruned prompts")
+    parser.add_argument("--database", required=True)
+    parser.add_argument("--questions", required=True, help="JSON list of question dicts")
+    parser.add_argument("--top-k", type=int, nargs="+", default=[1, 2, 3, 5])
+    parser.add_argument("--question-key", default="user_question")
+    parser.add_argument("--gold-key", help="key of the reference SPARQL query in each question")
+    args = parser.parse_args()
+
+    with open(args.questions, "r") as f:
+        questions = json.load(f)
+    variables_info = load_variables_info(args.database, DEFAULT_PROMPT_IDS[args.database][1])
+    for top_k in args.top_k:
+        report = evaluate_pruning(args.database, questions, top_k, variables_info, args.question_key, args.gold_key)
+        print(f"top_k={top_k}: {json.dumps(report)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1278 @@
+"""
+In-process port of rdf-config's SPARQL generation (`rdf-config --sparql`) for a single config.
+
+Each config/<db> is loaded once into a graph of subjects, predicates and objects; the
+paths from every variable back to its subjects are computed when the model is loaded,
+so building a query for a (variables, parameters) spec needs no Ruby process.
+
+Check the builder against rdf-config on the queries stored in sparql.yaml:
+
+    python -m functions.sparql_builder --database rhea uniprot bgee
+"""
+import argparse
+import copy
+import difflib
+import math
+import os
+import re
+import time
+from functools import cmp_to_key, lru_cache
+
+import yaml
+
+CONFIG_FILES = ("model.yaml", "prefix.yaml", "endpoint.yaml")
+PROPERTY_PATH_SEP = " / "
+INDENT = " " * 4
+DEFAULT_OPTIONS = {"distinct": False, "limit": 100, "offset": None, "order_by": None}
+
+
+def ruby_str(value):
+    """`value.to_s` as rdf-config would print a YAML value."""
+    if value is None:
+        return ""
+    if value is True:
+        return "true"
+    if value is False:
+        return "false"
+    if isinstance(value, float):
+        if math.isinf(value):
+            return "Infinity" if value > 0 else "-Infinity"
+        if math.isnan(value):
+            return "NaN"
+        text = repr(value)
+        mantissa, _, exponent = text.partition("e")
+        if exponent and "." not in mantissa:
+            text = f"{mantissa}.0e{exponent}"
+        return text
+    if isinstance(value, (list, tuple)):
+        return "[" + ", ".join(f'"{v}"' if isinstance(v, str) else ruby_str(v) for v in value) + "]"
+    return str(value)
+
+
+def _cmp(a, b):
+    return (a > b) - (a < b)
+
+
+def _intersect(left, right):
+    # Ruby の Array#& と同じく左側の順序で重複なし
+    result = []
+    for item in left:
+        if item in right and item not in result:
+            result.append(item)
+    return result
+
+
+def _uniq(items):
+    result = []
+    for item in items:
+        if item not in result:
+            result.append(item)
+    return result
+
+
+def _uniq_by(items, key):
+    seen, result = set(), []
+    for item in items:
+        k = key(item)
+        if k not in seen:
+            seen.add(k)
+            result.append(item)
+    return result
+
+
+def _uniq_identity(items):
+    return _uniq_by(items, id)
+
+
+# ---------------------------------------------------------------------------
+# YAML
+# ---------------------------------------------------------------------------
+
+
+class _ConfigLoader(yaml.SafeLoader):
+    """SafeLoader that accepts the `- []:` blank node keys of model.yaml."""
+
+
+def _construct_mapping(loader, node, deep=False):
+    mapping = {}
+    for key_node, value_node in node.value:
+        key = loader.construct_object(key_node, deep=True)
+        if isinstance(key, list):
+            key = tuple(key)
+        mapping[key] = loader.construct_object(value_node, deep=True)
+    return mapping
+
+
+_ConfigLoader.add_constructor(yaml.resolver.BaseResolver.DEFAULT_MAPPING_TAG, _construct_mapping)
+
+
+def load_yaml(path):
+    with open(path, "r") as f:
+        # model.yaml には値の後ろにタブが残っていることがある
+        return yaml.load(f.read().replace("\t", " "), Loader=_ConfigLoader)
+
+
+def parameter_value(value):
+    """Read a parameter string the way rdf-config reads it from the sparql.yaml entry written by rdf_config_executer.make_strain_text."""
+    if not isinstance(value, str):
+        return value
+    text = value if value.endswith("'") or ":" in value else f'"{value}"'
+    return yaml.safe_load(f"value: {text}")["value"]
+
+
+# ---------------------------------------------------------------------------
+# model.yaml graph (RDFConfig::Model)
+# ---------------------------------------------------------------------------
+
+
+class Predicate:
+    def __init__(self, name):
+        self.name = name
+        self.uri = "rdf:type" if name == "a" else name
+        self.cardinality = None  # (min, max)
+        self.objects = []
+        last_char = self.uri[-1:] if isinstance(self.uri, str) else ""
+        if last_char in ("?", "*", "+"):
+            self.uri = self.uri[:-1]
+            self.cardinality = {"?": (0, 1), "*": (0, None), "+": (1, None)}[last_char]
+        elif last_char == "}":
+            pos = self.uri.rindex("{")
+            cardinality = self.uri[pos + 1:-1]
+            self.uri = self.uri[:pos]
+            if "," in cardinality:
+                low, high = [part.strip() for part in cardinality.split(",", 1)]
+                self.cardinality = (int(low) if low else None, int(high) if high else None)
+            else:
+                self.cardinality = (int(cardinality), int(cardinality))
+
+    @property
+    def rdf_type(self):
+        return self.uri in ("a", "rdf:type")
+
+    @property
+    def required(self):
+        return self.cardinality is None or (self.cardinality[0] is not None and self.cardinality[0] > 0)
+
+
+class ModelObject:
+    blank_node = False
+
+    def __init__(self, data):
+        if isinstance(data, dict):
+            self.name = next(iter(data))
+            self.value = data[self.name]
+        else:
+            self.name = ""
+            self.value = data
+
+
+class URI(ModelObject):
+    pass
+
+
+class Literal(ModelObject):
+    def has_lang_tag(self):
+        return re.match(r'\A".*"@[\w\-]+\Z', ruby_str(self.value).strip(), re.ASCII) is not None
+
+    def has_data_type(self):
+        return re.match(r'\A".*"\^\^.+\Z', ruby_str(self.value).strip()) is not None
+
+
+class Unknown(ModelObject):
+    pass
+
+
+class ValueList(ModelObject):
+    pass
+
+
+class BlankNodeObject(ModelObject):
+    blank_node = True
+
+    def __init__(self, data):
+        super().__init__(data)
+        self.value = Subject(self.name)
+
+
+class Subject:
+    def __init__(self, key):
+        if isinstance(key, tuple):
+            self.name, self.value = key, None
+        else:
+            parts = key.split(None, 1)
+            self.name = parts[0]
+            self.value = parts[1] if len(parts) > 1 else None
+        self.predicates = []
+        self.as_object = {}
+
+    @property
+    def blank_node(self):
+        return isinstance(self.name, tuple)
+
+    @property
+    def types(self):
+        return [obj.value for p in self.predicates if p.rdf_type for obj in p.objects]
+
+    def has_rdf_type(self):
+        return bool(self.types)
+
+    def objects(self):
+        return [obj for p in self.predicates for obj in p.objects]
+
+    @property
+    def object_names(self):
+        return [
+            obj.as_object_name if isinstance(obj, Subject) else obj.name
+            for p in self.predicates if not p.rdf_type for obj in p.objects
+        ]
+
+    def as_subject_object(self, subject_name, predicate_uri, name):
+        # 目的語として使われた主語（predicates は元の主語と共有する）
+        clone = copy.copy(self)
+        clone.as_object = {"subject_name": subject_name, "predicate_uri": predicate_uri, "object": Literal({name: self.name})}
+        return clone
+
+    @property
+    def used_as_object(self):
+        return bool(self.as_object)
+
+    @property
+    def as_object_name(self):
+        return self.as_object["object"].name
+
+    @property
+    def as_object_value(self):
+        return self.as_object["object"].value
+
+
+def _object_equal(element, other):
+    # Array#include? は要素側の == を使う（Subject だけ名前で比較）
+    if isinstance(element, Subject):
+        return element.name == getattr(other, "name", None)
+    return element is other
+
+
+class ModelTriple:
+    def __init__(self, subject, predicates, obj):
+        self.subject = subject
+        self.predicates = predicates
+        self.object = obj
+
+    @property
+    def object_name(self):
+        return self.object.as_object_name if isinstance(self.object, Subject) else self.object.name
+
+    @property
+    def object_value(self):
+        return self.object.as_object_value if isinstance(self.object, Subject) else self.object.value
+
+    def property_path(self, separator=PROPERTY_PATH_SEP):
+        return separator.join(p.uri for p in self.predicates)
+
+    def bnode_connecting(self):
+        return len(self.predicates) > 1
+
+    def same(self, other):
+        return (
+            self.subject.name == other.subject.name
+            and self.property_path() == other.property_path()
+            and self.object_name == other.object_name
+        )
+
+
+class RDFConfigModel:
+    """One config/<db> directory: model graph, prefixes, endpoints and stored queries."""
+
+    def __init__(self, config_dir):
+        self.config_dir = config_dir
+        self.name = os.path.basename(os.path.normpath(config_dir))
+        self.prefix = load_yaml(os.path.join(config_dir, "prefix.yaml")) or {}
+        endpoint_path = os.path.join(config_dir, "endpoint.yaml")
+        self.endpoint = load_yaml(endpoint_path) if os.path.exists(endpoint_path) else None
+        self.subjects = []
+        self.object_names = []
+        self._build_graph(load_yaml(os.path.join(config_dir, "model.yaml")))
+        self._build_triples()
+        self._compile()
+
+    # Graph (RDFConfig::Model::Graph)
+    def _build_graph(self, model):
+        self.subjects = [Subject(next(iter(subject_hash))) for subject_hash in model]
+        self._subject_by_name = {}
+        for subject in self.subjects:
+            self._subject_by_name.setdefault(subject.name, subject)
+        for subject, subject_hash in zip(self.subjects, model):
+            self._target_subject = subject
+            self._setup_subject(subject, subject_hash)
+
+    def _setup_subject(self, subject, subject_hash):
+        for predicate_object_hashes in subject_hash.values():
+            for predicate_object_hash in predicate_object_hashes or []:
+                if not isinstance(predicate_object_hash, dict):
+                    continue
+                for predicate, obj in predicate_object_hash.items():
+                    if obj is None:
+                        continue
+                    subject.predicates.append(self._predicate_instance(predicate, obj))
+
+    def _predicate_instance(self, predicate_uri, object_data):
+        if isinstance(predicate_uri, str):
+            predicate_uri = predicate_uri.strip()
+        predicate = Predicate(predicate_uri)
+        self._current_predicate_uri = predicate.uri
+        if isinstance(object_data, str):
+            predicate.objects.append(self._object_instance(object_data))
+        elif isinstance(object_data, list):
+            for data in object_data:
+                if isinstance(data, dict):
+                    name = next(iter(data))
+                    if isinstance(name, str) and name:
+                        self.object_names.append(name)
+                predicate.objects.append(self._object_instance(data))
+        return predicate
+
+    def _object_type(self, value):
+        if isinstance(value, str):
+            if re.match(r"\A<.+>\Z", value):
+                return URI
+            if value.split(":", 1)[0] in self.prefix:
+                return URI
+        return Literal
+
+    def _object_instance(self, data):
+        if isinstance(data, dict):
+            name = next(iter(data))
+            value = data[name]
+        elif isinstance(data, str):
+            name, value = None, data
+        else:
+            name = value = None
+
+        subject = self._subject_by_name.get(value) if isinstance(value, str) else None
+        if subject is not None:
+            return subject.as_subject_object(self._target_subject.name, self._current_predicate_uri, name)
+        if isinstance(name, tuple):
+            bnode = BlankNodeObject(data)
+            self._setup_subject(bnode.value, data)
+            return bnode
+        if value is None:
+            return Unknown(data)
+        if isinstance(value, list):
+            return ValueList({name: [self._object_instance({name: v}) for v in value]})
+        return self._object_type(value)(data)
+
+    # Triples (RDFConfig::Model#generate_triples)
+    def _build_triples(self):
+        self.triples = []
+        self.bnode_subjects = []
+        for subject in self.subjects:
+            self._proc_subject(subject, subject, [])
+
+    def _proc_subject(self, top, subject, predicates):
+        for predicate in subject.predicates:
+            for obj in predicate.objects:
+                if obj.blank_node:
+                    self.bnode_subjects.append(obj.value)
+                    self._proc_subject(top, obj.value, predicates + [predicate])
+                else:
+                    self.triples.append(ModelTriple(top, predicates + [predicate], obj))
+
+    def _compile(self):
+        # 変数ごとの経路と、同じプロパティパスを持つ変数の数を先に求めておく
+        self._find_cache = {}
+        self._path_cache = {}
+        self._bnode_types_cache = {}
+        for name in _uniq([*self.object_names, *self.subject_names]):
+            self.triples_by_object_name(name)
+        self._path_count = {}
+        for name in _uniq(self.object_names):
+            path = tuple(self.property_path(name))
+            self._path_count[path] = self._path_count.get(path, 0) + 1
+
+    # Lookups
+    @property
+    def subject_names(self):
+        return [subject.name for subject in self.subjects]
+
+    def find_subject(self, name):
+        if not isinstance(name, str):
+            return None
+        return self._subject_by_name.get(name)
+
+    def is_subject(self, name):
+        return self.find_subject(name) is not None
+
+    def find_all_by_object_name(self, object_name):
+        if self.is_subject(object_name):
+            result = []
+            for triple in self.triples:
+                if isinstance(triple.object, Subject):
+                    if triple.subject.name != triple.object.as_object_value and triple.object.as_object_value == object_name:
+                        result.append(triple)
+                elif isinstance(triple.object, ValueList):
+                    values = [v for v in triple.object.value if isinstance(v, Subject) and triple.subject.name != v.as_object_value]
+                    if any(v.as_object_value == object_name for v in values):
+                        result.append(triple)
+            return result
+        return [triple for triple in self.triples if triple.object_name == object_name]
+
+    def find_by_object_name(self, object_name):
+        key = object_name if isinstance(object_name, (str, type(None))) else repr(object_name)
+        if key not in self._find_cache:
+            triples = self.find_all_by_object_name(object_name)
+            self._find_cache[key] = triples[0] if triples else None
+        return self._find_cache[key]
+
+    def find_object(self, object_name):
+        triple = self.find_by_object_name(object_name)
+        if triple is None:
+            return None
+        if self.is_subject(object_name) and isinstance(triple.object, ValueList):
+            return next((v for v in triple.object.value if v.name == object_name), None)
+        return triple.object
+
+    def triples_by_object_name(self, object_name, start_subject=None):
+        key = (object_name, start_subject) if isinstance(start_subject, (str, type(None))) else (object_name, "<object>")
+        if isinstance(object_name, str) and key in self._path_cache:
+            return self._path_cache[key]
+        triples = []
+        triple = self.find_by_object_name(object_name)
+        while triple is not None:
+            triples.append(triple)
+            if start_subject is not None and triple.subject.name == start_subject:
+                break
+            triple = self.find_by_object_name(triple.subject.name)
+            if triple is None:
+                break
+            if any(t.same(triple) for t in triples):
+                break
+            if triple.subject.name in [t.subject.name for t in triples]:
+                triples.pop()
+                break
+        triples.reverse()
+        if isinstance(object_name, str):
+            self._path_cache[key] = triples
+        return triples
+
+    def parent_subject_names(self, object_name):
+        return [triple.subject.name for triple in self.triples_by_object_name(object_name)]
+
+    def predicate_path(self, object_name, start_subject=None):
+        return [p for triple in self.triples_by_object_name(object_name, start_subject) for p in triple.predicates]
+
+    def property_path(self, object_name, start_subject=None):
+        return [p.uri for p in self.predicate_path(object_name, start_subject)]
+
+    def same_property_path_exist(self, object_name):
+        return self._path_count.get(tuple(self.property_path(object_name)), 0) > 1
+
+    def bnode_rdf_types(self, triple):
+        if id(triple) in self._bnode_types_cache:
+            return self._bnode_types_cache[id(triple)]
+        rdf_types = []
+        for i in range(len(triple.predicates) - 1):
+            prefix = triple.predicates[:i + 1]
+            type_triples = [
+                t for t in self.triples
+                if len(t.predicates) == i + 2 and t.predicates[-1].rdf_type
+                and all(a is b for a, b in zip(t.predicates[:i + 1], prefix))
+            ]
+            if not type_triples:
+                rdf_types.append(None)
+                continue
+            types = []
+            for t in type_triples:
+                for subject in self.bnode_subjects:
+                    if not any(p is t.predicates[-1] for p in subject.predicates):
+                        continue
+                    objects = subject.objects()
+                    if any(o.blank_node for o in objects) or any(_object_equal(o, triple.object) for o in objects):
+                        types.append(t.object_value)
+            rdf_types.append(types)
+        self._bnode_types_cache[id(triple)] = rdf_types
+        return rdf_types
+
+    # endpoint.yaml (RDFConfig::Endpoint)
+    def endpoints(self):
+        target = self.endpoint.get("endpoint") if isinstance(self.endpoint, dict) else None
+        if isinstance(target, str):
+            return [target], []
+        endpoints, graphs = [], []
+        for data in target or []:
+            if isinstance(data, str) and re.match(r"\Ahttps?://", data):
+                endpoints.append(data)
+            elif isinstance(data, dict) and "graph" in data:
+                graph = data["graph"]
+                if isinstance(graph, str):
+                    graphs.append(graph)
+                elif isinstance(graph, list):
+                    graphs = graph
+        return endpoints, graphs
+
+    def stored_queries(self):
+        path = os.path.join(self.config_dir, "sparql.yaml")
+        return load_yaml(path) if os.path.exists(path) else {}
+
+
+# ---------------------------------------------------------------------------
+# WHERE clause terms (RDFConfig::SPARQL::WhereGenerator)
+# ---------------------------------------------------------------------------
+
+
+class _RDFTyped:
+    rdf_types = None
+
+    def set_rdf_types(self, rdf_types):
+        if isinstance(rdf_types, str):
+            rdf_types = [rdf_types]
+        self.rdf_types = rdf_types if isinstance(rdf_types, list) else None
+
+    def has_rdf_type(self):
+        if isinstance(self.rdf_types, list):
+            flat = _flatten(self.rdf_types)
+            return bool(flat) and flat[0] is not None
+        return False
+
+    def has_one_rdf_type(self):
+        return self.has_rdf_type() and len(self.rdf_types) == 1
+
+    def rdf_type_varname(self):
+        return f"{self.to_sparql()}__class"
+
+
+def _flatten(items):
+    result = []
+    for item in items:
+        if isinstance(item, (list, tuple)):
+            result.extend(_flatten(item))
+        else:
+            result.append(item)
+    return result
+
+
+class Variable(_RDFTyped):
+    bnode = False
+
+    def __init__(self, name):
+        self.name = name
+
+    def to_sparql(self):
+        return f"?{self.name}"
+
+
+class BlankNode(_RDFTyped):
+    bnode = True
+
+    def __init__(self, number, predicate_routes):
+        self.number = number
+        self.predicate_routes = predicate_routes
+        self.name = f"_b{number}"
+
+    def to_sparql(self):
+        return f"_:b{self.number}"
+
+    def rdf_type_varname(self):
+        return f"?{self.name}__class"
+
+
+class Triple:
+    def __init__(self, subject, predicates, obj):
+        self.subject = subject
+        self.predicates = predicates
+        self.object = obj
+
+    @property
+    def rdf_type(self):
+        return self.predicates[0].uri in ("a", "rdf:type")
+
+    @property
+    def required(self):
+        return all(p.required for p in self.predicates)
+
+    def property_path(self):
+        return PROPERTY_PATH_SEP.join(p.uri for p in self.predicates)
+
+    def to_sparql(self, indent="", is_first_triple=True, is_last_triple=True):
+        line = f"{indent}{self.subject.to_sparql()} " if is_first_triple else indent * 2
+        if self.rdf_type:
+            line += f"a {self.object.rdf_types[0]}" if self.object.has_one_rdf_type() else f"a {self.object.rdf_type_varname()}"
+        else:
+            line += f"{self.property_path()} {self.object.to_sparql()}"
+        return f"{line} {'.' if is_last_triple else ';'}"
+
+    def key(self):
+        return f"{self.subject.to_sparql()} {self.property_path()} {self.object.to_sparql()}"
+
+
+class _QueryBuilder:
+    """Generation state for one query, mirroring rdf-config's SPARQL generators."""
+
+    def __init__(self, model, variables, parameters, options=None, description=""):
+        self.model = model
+        self.parameters = dict(parameters or {})
+        self.opts = {**DEFAULT_OPTIONS, **(options or {})}
+        self.description = description
+        # VariablesHandler
+        self.variables = _uniq([*(variables or []), *self.parameters])
+        self.subjects_by_variables = [v for v in self.variables if model.is_subject(v)]
+        self.common_subject_names = model.subject_names
+        for name in self.variables:
+            if not model.is_subject(name):
+                self.common_subject_names = _intersect(self.common_subject_names, model.parent_subject_names(name))
+        hidden = _uniq([
+            self._closest_subject_name(name) for name in self.variables
+            if not model.is_subject(name) and not _intersect(model.parent_subject_names(name), self.subjects_by_variables)
+        ])
+        self.variables_for_select = [v for v in self.variables if self._valid_variable(v)]
+        self.variables_for_where = [v for v in _uniq(self.variables + hidden) if self._valid_variable(v)]
+
+    def _valid_variable(self, name):
+        return self.model.is_subject(name) or self.model.find_by_object_name(name) is not None
+
+    def _closest_subject_name(self, object_name):
+        parents = self.model.parent_subject_names(object_name)
+        in_variables = _intersect(parents, self.subjects_by_variables)
+        if in_variables:
+            return in_variables[-1]
+        common = _intersect(parents, self.common_subject_names)
+        if common:
+            return common[-1]
+        return parents[0] if parents else None
+
+    # SPARQL (generators other than WHERE)
+    def build(self):
+        return "\n".join(
+            self.comment_lines() + self.prefix_lines() + self.select_lines() + self.dataset_lines()
+            + WhereClause(self).generate() + self.solution_modifier_lines()
+        )
+
+    def comment_lines(self):
+        endpoints, _ = self.model.endpoints()
+        if endpoints:
+            lines = [f"# Endpoint: {endpoints[0]}"] + [f"#           {endpoint}" for endpoint in endpoints[1:]]
+        else:
+            lines = ["# Endpoint: Please define a SPARQL endpoint in the endpoint.yaml file."]
+        lines.append(f"# Description: {ruby_str(self.description)}")
+        for i, (name, value) in enumerate(self.parameters.items()):
+            lines.append(f"{'# Parameter: ' if i == 0 else '#            '}{name}: (example: {ruby_str(value)})")
+        lines.append("")
+        return lines
+
+    def prefix_lines(self):
+        prefixes = []
+        for name in self.variables:
+            for triple in self.model.triples_by_object_name(name):
+                uris = list(triple.subject.types) + [p.uri for p in triple.predicates] + _flatten(self.model.bnode_rdf_types(triple))
+                if isinstance(triple.object, Subject):
+                    uris += triple.object.types
+                elif isinstance(triple.object, ValueList):
+                    for value in triple.object.value:
+                        if isinstance(value, Subject):
+                            uris += value.types
+                for uri in uris:
+                    match = re.match(r"\A(\w+):\w+\Z", uri, re.ASCII) if isinstance(uri, str) else None
+                    if match and match.group(1) not in prefixes:
+                        prefixes.append(match.group(1))
+        for name, value in self.parameters.items():
+            obj = self.model.find_object(name)
+            if not isinstance(obj, (URI, Subject)) and not self.model.is_subject(name):
+                continue
+            match = re.match(r"\A(\w+):(.+)", value, re.ASCII) if isinstance(value, str) else None
+            if match and match.group(1) not in prefixes:
+                prefixes.append(match.group(1))
+        lines = [f"PREFIX {prefix}: {ruby_str(self.model.prefix.get(prefix))}" for prefix in prefixes]
+        return _uniq(lines + [""])
+
+    def select_lines(self):
+        terms = ["SELECT", "DISTINCT" if self.opts.get("distinct") is True else ""]
+        terms += [f"?{name}" for name in self.variables_for_select]
+        return [" ".join(term for term in terms if term)]
+
+    def dataset_lines(self):
+        _, graphs = self.model.endpoints()
+        return [f"FROM <{graph}>" for graph in _uniq(graphs)]
+
+    def solution_modifier_lines(self):
+        lines = []
+        order_by = self.opts.get("order_by")
+        if order_by not in (None, False):
+            if isinstance(order_by, str):
+                lines.append(f"ORDER BY ?{order_by}")
+            elif isinstance(order_by, dict):
+                lines.append(f"ORDER BY {_order_by_phrase(order_by)}")
+            elif isinstance(order_by, list):
+                phrases = [f"?{item}" if isinstance(item, str) else _order_by_phrase(item) if isinstance(item, dict) else "" for item in order_by]
+                lines.append(" ".join(phrase for phrase in ["ORDER BY"] + phrases if phrase))
+            else:
+                lines.append("")
+        limit = self.opts.get("limit")
+        if limit not in (None, False):
+            lines.append(f"LIMIT {ruby_str(limit)}")
+        offset = self.opts.get("offset")
+        if isinstance(offset, int) and not isinstance(offset, bool) and offset > 0:
+            lines.append(f"OFFSET {offset}")
+        return lines
+
+
+def _order_by_phrase(item):
+    name, direction = next(iter(item.items()))
+    return f"DESC(?{name})" if str(direction).upper() == "DESC" else f"?{name}"
+
+
+class WhereClause:
+    """Port of RDFConfig::SPARQL::WhereGenerator (no join, no template)."""
+
+    def __init__(self, query):
+        self.query = query
+        self.model = query.model
+        self.variables = query.variables
+        self.values_lines = []
+        self.rdf_type_triple = {}
+        self.object_rdf_type_triples = []
+        self.required_triples = []
+        self.optional_triples = []
+        self.bnode_subject_triples = []
+        self.variable = {}
+        self.blank_nodes = []
+        self.bnode_number = 1
+        self.target_triple = None
+        self.optional_triples_buf = []
+
+    def generate(self):
+        self._generate_triples()
+        self._add_values_lines()
+        lines = self._required_lines() + self._optional_lines()
+        return ["WHERE {"] + self._sorted_values_lines() + lines + ["}"]
+
+    # Triples
+    def _generate_triples(self):
+        for name in self.variables:
+            self._generate_triple_by_variable(name)
+            if self.optional_triples_buf:
+                self.optional_triples.append(_uniq_identity(self.optional_triples_buf))
+                self.optional_triples_buf = []
+
+        refined = []
+        for triple in _uniq_by(self.bnode_subject_triples, Triple.key):
+            if triple.subject.name in self.rdf_type_triple:
+                refined.append(self.rdf_type_triple.pop(triple.subject.name))
+                self._add_values_line_for_rdf_type(triple.subject)
+            refined.append(triple)
+        self.bnode_subject_triples = refined
+        self.optional_triples = [_uniq_identity(triples) for triples in self.optional_triples if triples]
+
+    def _generate_triple_by_variable(self, name):
+        self.target_triple = self.model.find_by_object_name(name)
+        if self.target_triple is None or self.target_triple.subject.name == name:
+            return
+        if self.target_triple.bnode_connecting() and self.model.same_property_path_exist(name):
+            self._generate_triples_with_bnode()
+        else:
+            self._generate_triple_without_bnode()
+
+    def _generate_triple_without_bnode(self):
+        object_name = self.target_triple.object_name
+        is_optional = self._optional(object_name)
+        if self.model.same_property_path_exist(object_name):
+            triple_in_model = self.model.find_by_object_name(object_name)
+            subject = self.model.subjects[0]
+            self._add_triple(Triple(
+                self._subject_instance(subject, subject.types, True),
+                self.model.predicate_path(triple_in_model.subject.name),
+                self._variable_instance(triple_in_model.subject.name),
+            ), is_optional)
+            self._add_triple(Triple(
+                self._subject_instance(triple_in_model.subject, triple_in_model.subject.types, True),
+                self.model.predicate_path(object_name, self.target_triple.subject.name),
+                self._variable_instance(self._object_name(self.target_triple)),
+            ), is_optional)
+        else:
+            subject = self._subject_by_object_name(object_name)
+            self._add_triple(Triple(
+                self._subject_instance(subject, subject.types),
+                self.model.predicate_path(object_name, subject.name),
+                self._variable_instance(self._object_name(self.target_triple)),
+            ), is_optional)
+
+    def _generate_triples_with_bnode(self):
+        object_name = self.target_triple.object_name
+        bnode_rdf_types = self.model.bnode_rdf_types(self.target_triple)
+        flat = _uniq(_flatten(bnode_rdf_types))
+        if len(flat) == 1 and flat[0] is None:
+            subject = self._subject_by_object_name(object_name)
+            if subject.name not in self.query.variables_for_where:
+                return
+            self._add_triple(Triple(
+                self._subject_instance(subject, subject.types),
+                self.model.predicate_path(object_name, subject.name),
+                self._variable_instance(self._object_name(self.target_triple)),
+            ), self._optional(object_name, subject.name))
+        else:
+            self._generate_triples_with_bnode_rdf_types(bnode_rdf_types)
+
+    def _generate_triples_with_bnode_rdf_types(self, bnode_rdf_types):
+        subject_name = self.target_triple.subject.name
+        start_subject_name = next(
+            (name for name in reversed(self.model.parent_subject_names(subject_name)) if name in self.variables), None
+        )
+        start_subject = self.model.subjects[0] if start_subject_name is None else self.model.find_subject(start_subject_name)
+        is_optional = self._optional(subject_name, start_subject)
+        self._add_triple(Triple(
+            self._subject_instance(self.model.find_subject(start_subject.name), start_subject.types),
+            self.model.predicate_path(subject_name, start_subject.name),
+            self._variable_instance(subject_name),
+        ), is_optional)
+
+        subject = self._subject_instance(self.target_triple.subject, self.target_triple.subject.types, True)
+        predicates = self.target_triple.predicates
+        bnode_predicates = []
+        for i in range(len(predicates) - 1):
+            bnode_predicates.append(predicates[i])
+            rdf_types = bnode_rdf_types[i]
+            if rdf_types is None:
+                continue
+            obj = self._blank_node([p.uri for p in predicates[:i + 1]], rdf_types)
+            self._add_triple(Triple(subject, list(bnode_predicates), obj), is_optional)
+            bnode_predicates.clear()
+            subject = obj
+            subject.set_rdf_types(rdf_types)
+
+        obj = self._variable_instance(self.target_triple.object_name)
+        self._add_triple(Triple(subject, bnode_predicates + [predicates[-1]], obj), self._optional(obj.name, subject))
+
+    def _subject_by_object_name(self, object_name):
+        # SPARQL#subject_by_object_name
+        for index, triple in enumerate(reversed(self.model.triples_by_object_name(object_name))):
+            as_object_name = triple.object.as_object_name if isinstance(triple.object, Subject) else ""
+            if index > 0 and as_object_name in self.variables:
+                return triple.object
+            if triple.subject.name in self.variables:
+                return triple.subject
+
+        triple = self.model.find_by_object_name(object_name)
+        common = self.query.common_subject_names
+        if triple is None or not common:
+            return self.model.subjects[0]
+        parents = self.model.parent_subject_names(object_name)
+        by_variables = _intersect(parents, self.variables)
+        if by_variables:
+            return self.model.find_subject(by_variables[-1])
+        names = _intersect(parents, common)
+        return self.model.find_subject(names[-1]) if names else self.model.subjects[0]
+
+    def _add_triple(self, triple, is_optional):
+        if not triple.predicates or triple.subject.name == triple.object.name:
+            return
+        more_triples = []
+        subject_type_triple = None
+        if triple.subject.has_rdf_type():
+            subject_type_triple = Triple(triple.subject, [Predicate("a")], triple.subject)
+
+        object_type_triple = None
+        if self.model.is_subject(triple.object.name):
+            obj = self.model.find_subject(triple.object.name)
+            subject = self._subject_instance(obj, obj.types, True)
+            object_type_triple = Triple(subject, [Predicate("a")], subject)
+        else:
+            obj = self.model.find_object(triple.object.name)
+            if isinstance(obj, Subject):
+                subject = self._subject_instance(obj, obj.types)
+                object_type_triple = Triple(subject, [Predicate("a")], subject)
+                for name in _intersect(self.variables, obj.object_names):
+                    if name == obj.as_object_name:
+                        continue
+                    triple_in_model = self.model.find_by_object_name(name)
+                    if triple_in_model is None:
+                        continue
+                    more_triples.append(Triple(
+                        self._subject_instance(obj, triple_in_model.subject.types),
+                        self.model.predicate_path(name, obj.as_object_value),
+                        self._variable_instance(name),
+                    ))
+
+        if subject_type_triple:
+            self._add_rdf_type_triple(subject_type_triple)
+        if object_type_triple:
+            self._add_rdf_type_triple(object_type_triple)
+
+        triples = [triple] + more_triples
+        if triple.subject.bnode:
+            self.bnode_subject_triples.extend(triples)
+        elif is_optional:
+            for t in triples:
+                self._add_optional_triple(t)
+        else:
+            for t in triples:
+                if not any(self._same_triple(required, t) for required in self.required_triples):
+                    self.required_triples.append(t)
+
+    def _add_rdf_type_triple(self, triple):
+        if not triple.subject.rdf_types:
+            return
+        self.rdf_type_triple.setdefault(triple.subject.name, triple)
+
+    def _add_optional_triple(self, triple):
+        done = False
+        for triples in self.optional_triples:
+            if not any(t.subject is triple.subject for t in triples):
+                continue
+            keys = [t.key() for t in triples]
+            if triple.key() in keys:
+                done = True
+            elif triple.required:
+                triples.append(triple)
+                done = True
+        if not done:
+            self.optional_triples_buf.append(triple)
+
+    def _same_triple(self, a, b):
+        if a.key() == b.key():
+            return True
+        if a.property_path() != b.property_path():
+            return False
+        if a.subject.name != b.subject.name and a.object.name == b.object.name:
+            if self.model.is_subject(a.subject.name):
+                triple_in_model = self.model.find_by_object_name(b.subject.name)
+            else:
+                triple_in_model = self.model.find_by_object_name(a.subject.name)
+            return triple_in_model is not None and triple_in_model.object_name in (a.subject.name, b.subject.name)
+        if a.subject.name == b.subject.name and a.object.name != b.object.name:
+            if self.model.is_subject(a.object.name):
+                triple_in_model = self.model.find_by_object_name(b.object.name)
+                return triple_in_model is not None and a.object.name == triple_in_model.object.name
+            triple_in_model = self.model.find_by_object_name(a.object.name)
+            return triple_in_model is not None and b.object.name == triple_in_model.object.name
+        return False
+
+    def _subject_instance(self, subject, rdf_types=None, use_subject_name=False):
+        if subject.blank_node and len(subject.types) > 1:
+            return self._blank_node([], subject.types)
+        if use_subject_name:
+            instance = self._variable_instance(subject.name)
+        else:
+            if subject.used_as_object:
+                triple = self.model.find_by_object_name(subject.as_object_name)
+            else:
+                triple = self.model.find_by_object_name(subject.name)
+            instance = self._variable_instance(subject.name if triple is None else self._object_name(triple))
+        if rdf_types is not None:
+            instance.set_rdf_types(rdf_types)
+        return instance
+
+    def _variable_instance(self, name):
+        if name not in self.variable:
+            self.variable[name] = Variable(name)
+        return self.variable[name]
+
+    def _blank_node(self, predicate_routes, rdf_types):
+        for bnode in self.blank_nodes:
+            if bnode.predicate_routes == predicate_routes and bnode.rdf_types == rdf_types:
+                return bnode
+        bnode = BlankNode(self.bnode_number, predicate_routes)
+        bnode.set_rdf_types(rdf_types)
+        self.blank_nodes.append(bnode)
+        self.bnode_number += 1
+        return bnode
+
+    def _optional(self, object_name, start_subject=None):
+        return any(not p.required for p in self.model.predicate_path(object_name, start_subject))
+
+    def _object_name(self, triple):
+        obj = triple.object
+        if isinstance(obj, Subject):
+            return obj.as_object_name if obj.as_object_name in self.variables else obj.as_object_value
+        if isinstance(obj, ValueList):
+            subjects = [v for v in obj.value if isinstance(v, Subject)]
+            names = _intersect(self.variables, [v.as_object_name for v in subjects])
+            if not names:
+                names = _intersect(self.variables, [v.as_object_value for v in subjects])
+            return names[0] if names else obj.name
+        return obj.name
+
+    # VALUES
+    def _add_values_lines(self):
+        for name, value in self.query.parameters.items():
+            obj = self.model.find_object(name)
+            if obj is None and self.model.find_subject(name) is None:
+                continue
+            value = ruby_str(value)
+            if self._double_quote_value(obj):
+                value = f'"{value}"'
+            self._add_values_line(f"{INDENT}VALUES ?{name} {{ {value} }}")
+
+    @staticmethod
+    def _double_quote_value(obj):
+        return (
+            isinstance(obj, Literal)
+            and not isinstance(obj.value, (int, float))
+            and not obj.has_lang_tag() and not obj.has_data_type()
+        )
+
+    def _add_values_line_for_rdf_type(self, subject):
+        if len(subject.rdf_types) < 2:
+            return
+        self._add_values_line(f"{INDENT}VALUES {subject.rdf_type_varname()} {{ {' '.join(map(ruby_str, subject.rdf_types))} }}")
+
+    def _add_values_line(self, line):
+        if line not in self.values_lines:
+            self.values_lines.append(line)
+
+    def _sorted_values_lines(self):
+        select = [f"?{name}" for name in self.query.variables_for_select]
+
+        def compare(line_a, line_b):
+            a, b = line_a.split()[1], line_b.split()[1]
+            if a.endswith("__class") and b.endswith("__class"):
+                a, b = a[:-7], b[:-7]
+                if a in select and b in select:
+                    return _cmp(select.index(a), select.index(b))
+                return -1 if a in select else 1 if b in select else 0
+            if a.endswith("__class"):
+                return 1
+            if b.endswith("__class"):
+                return -1
+            return 0
+
+        return sorted(self.values_lines, key=cmp_to_key(compare))
+
+    # Lines
+    def _required_lines(self):
+        lines = []
+        for subject_class in (Variable, BlankNode):
+            subjects = _uniq_identity([t.subject for t in self.required_triples if isinstance(t.subject, subject_class)])
+            for subject in subjects:
+                self.object_rdf_type_triples.clear()
+                if subject_class is BlankNode:
+                    continue  # lines_by_subject は空白ノードを出力しない
+                triples = self._filter_triples_by_subject(subject)
+                if triples:
+                    triples = self._sort_triples_by_object(triples)
+                    triples = self._rdf_type_added_triples(triples, required=True)
+                    lines += self._lines_by_triples(triples)
+                    if lines and lines[-1].endswith(";"):
+                        lines[-1] = lines[-1][:-1] + "."
+                for triple in self.object_rdf_type_triples:
+                    lines.append(triple.to_sparql(indent=INDENT))
+        return lines
+
+    def _required_subject_names(self):
+        return _uniq([t.subject.name for t in self.required_triples if isinstance(t.subject, Variable)])
+
+    def _filter_triples_by_subject(self, subject):
+        subject_names = self._required_subject_names()
+        triples = [
+            t for t in self.required_triples
+            if t.subject.name == subject.name and (
+                t.subject.name in self.variables or t.object.name in self.variables
+                or (not t.rdf_type and t.object.name not in subject_names)
+            )
+        ]
+        if len(triples) == 1 and triples[0].subject.name not in self.variables and self.model.is_subject(triples[0].object.name):
+            return []
+        return triples
+
+    def _sort_triples_by_object(self, triples):
+        select = self.query.variables_for_select
+
+        def compare(a, b):
+            a, b = a.object.name, b.object.name
+            if a in select and b in select:
+                return _cmp(select.index(a), select.index(b))
+            if a in select:
+                return -1
+            if b in select:
+                return 1
+            return _cmp(a, b)
+
+        return sorted(triples, key=cmp_to_key(compare))
+
+    def _rdf_type_added_triples(self, triples, required=True):
+        refined = []
+        for triple in triples:
+            added = False
+            if triple.subject.name in self.rdf_type_triple and not isinstance(triple.subject, BlankNode):
+                refined.append(self.rdf_type_triple[triple.subject.name])
+                if required:
+                    del self.rdf_type_triple[triple.subject.name]
+                refined.append(triple)
+                added = True
+                self._add_values_line_for_rdf_type(triple.subject)
+
+            if (
+                triple.object.name in self.rdf_type_triple
+                and not isinstance(triple.object, BlankNode)
+                and triple.object.name not in self._required_subject_names()
+            ):
+                if not added:
+                    refined.append(triple)
+                    added = True
+                type_triple = self.rdf_type_triple[triple.object.name]
+                if required:
+                    self.object_rdf_type_triples.append(type_triple)
+                    del self.rdf_type_triple[triple.object.name]
+                else:
+                    refined.append(type_triple)
+                self._add_values_line_for_rdf_type(triple.object)
+
+            if not added:
+                refined.append(triple)
+        return refined
+
+    def _indent(self, depth=0):
+        return INDENT * (1 + depth)
+
+    def _lines_by_triples(self, triples, depth=0):
+        lines = []
+        if not triples:
+            return lines
+        if triples[0].subject.bnode:
+            for triple in triples:
+                line = triple.to_sparql(indent=self._indent(), is_first_triple=False, is_last_triple=False)
+                match = re.search(r"_:b\d+", line)
+                if match:
+                    lines.append(self._indent(depth) + line[:match.start()] + "[")
+                    object_triples = [t for t in self.bnode_subject_triples if t.subject.to_sparql() == match.group(0)]
+                    lines += self._lines_by_triples(object_triples, depth + 1)
+                else:
+                    lines.append(self._indent(depth) + line)
+            lines.append(f"{self._indent(depth + 1)}] ;")
+        else:
+            first, last = triples[0].object.name, triples[-1].object.name
+            for triple in triples:
+                line = triple.to_sparql(
+                    indent=self._indent(),
+                    is_first_triple=triple.object.name == first,
+                    is_last_triple=triple.object.name == last,
+                )
+                match = re.search(r"_:b\d+", line)
+                if match:
+                    lines.append(line[:match.start()] + "[")
+                    object_triples = [t for t in self.bnode_subject_triples if t.subject.to_sparql() == match.group(0)]
+                    lines += self._lines_by_triples(object_triples, depth)
+                else:
+                    lines.append(line)
+        return lines
+
+    def _optional_lines(self):
+        lines = []
+        for triples in self.optional_triples:
+            if not triples:
+                continue
+            self.object_rdf_type_triples.clear()
+            triples = self._rdf_type_added_triples(triples, required=False)
+            lines += self._generate_optional_lines(_uniq_by(triples, Triple.key))
+        return lines
+
+    def _generate_optional_lines(self, triples):
+        if not triples:
+            return []
+        lines = [f"{INDENT}OPTIONAL {{"]
+        for subject_name in _uniq([t.subject.name for t in triples]):
+            by_subject = [t for t in triples if t.subject.name == subject_name]
+            lines += [INDENT + line for line in self._lines_by_triples(by_subject)]
+        if lines[-1].endswith(";"):
+            lines[-1] = lines[-1][:-1] + "."
+        lines.append(f"{INDENT}}}")
+        return lines
+
+
+# ---------------------------------------------------------------------------
+# Entry points
+# ---------------------------------------------------------------------------
+
+
+def config_dir(database):
+    return os.path.join(os.environ["PATH_RDF_CONFIG"], "config", database)
+
+
+@lru_cache(maxsize=None)
+def _load_model(path, mtimes):
+    return RDFConfigModel(path)
+
+
+def load_model(database):
+    """RDFConfigModel of config/<database>, rebuilt when one of its YAML files changes."""
+    path = config_dir(database)
+    mtimes = tuple(
+        os.path.getmtime(os.path.join(path, name)) if os.path.exists(os.path.join(path, name)) else None
+        for name in CONFIG_FILES
+    )
+    return _load_model(path, mtimes)
+
+
+def build_sparql(database, variables, parameters, options=None, description=""):
+    """
+    Build the query rdf-config generates for a sparql.yaml entry with these variables,
+    parameters (as given in sparql.yaml) and options (default: distinct).
+    """
+    model = load_model(database)
+    options = {"distinct": True} if options is None else options
+    return _QueryBuilder(model, variables, parameters, options, description).build()
+
+
+def build_sparql_from_text(database, variables, parameters):
+    """`build_sparql` for parameter strings extracted from the LLM output."""
+    return build_sparql(database, variables, {k: parameter_value(v) for k, v in parameters.items()})
+
+
+def _normalize(query):
+    return [line.rstrip() for line in query.strip().splitlines()]
+
+
+def check_parity(database, query_ids=None, reference=None):
+    """
+    Compare `build_sparql` with rdf-config on the entries of config/<database>/sparql.yaml.
+    Returns (number of entries checked, list of (query id, unified diff)).
+    Entries rdf-config rejects are skipped; other rdf-config failures (e.g. a worker that
+    cannot start) are raised.
+    """
+    from .rdf_config_executer import RDFConfigError, get_worker_pool
+
+    if reference is None:
+
+        def reference(database, entry):
+            parameters = {k: ruby_str(v) for k, v in (entry.get("parameters") or {}).items()}
+            return get_worker_pool().generate(database, entry.get("variables") or [], parameters)
+
+    stored = load_model(database).stored_queries()
+    checked, mismatches = 0, []
+    for query_id, entry in stored.items():
+        if query_ids and str(query_id) not in query_ids:
+            continue
+        if not isinstance(entry, dict) or not entry.get("variables"):
+            continue
+        parameters = {k: parameter_value(ruby_str(v)) for k, v in (entry.get("parameters") or {}).items()}
+        try:
+            expected = reference(database, entry)
+        except RDFConfigError:
+            continue  # rdf-config 自体が生成できないエントリ
+        actual = build_sparql(database, entry["variables"], parameters)
+        checked += 1
+        if _normalize(actual) != _normalize(expected):
+            diff = "\n".join(difflib.unified_diff(_normalize(expected), _normalize(actual), "rdf-config", "sparql_builder", lineterm=""))
+            mismatches.append((query_id, diff))
+    return checked, mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare sparql_builder with rdf-config on stored sparql.yaml queries")
+    parser.add_argument("--database", nargs="+", default=["rhea", "uniprot", "bgee"])
+    parser.add_argument("--id", nargs="*", help="only these query ids")
+    parser.add_argument("--show", type=int, default=3, help="number of diffs to print per database")
+    args = parser.parse_args()
+
+    failed = False
+    for database in args.database:
+        start = time.perf_counter()
+        checked, mismatches = check_parity(database, args.id)
+        elapsed = time.perf_counter() - start
+        print(f"{database}: {checked - len(mismatches)}/{checked} identical ({elapsed:.1f}s)")
+        for query_id, diff in mismatches[:args.show]:
+            print(f"--- {query_id}\n{diff}")
+        # 1件も比較できなかった場合は一致とみなさない
+        failed = failed or bool(mismatches) or checked == 0
+    raise SystemExit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
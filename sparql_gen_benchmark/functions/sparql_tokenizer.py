@@ -0,0 +1,54 @@
+import re
+from typing import List, NamedTuple
+
+
+class Token(NamedTuple):
+    kind: str
+    value: str
+    start: int
+
+
+# 上から順にマッチを試す（長いリテラルを短いものより先に）
+TOKEN_PATTERNS = [
+    ("COMMENT", r"#[^\n]*"),
+    ("WS", r"\s+"),
+    ("STRING", r'"""(?:[^"\\]|\\.|"(?!""))*"""' r"|'''(?:[^'\\]|\\.|'(?!''))*'''"),
+    ("STRING", r'"(?:[^"\\\n]|\\.)*"' r"|'(?:[^'\\\n]|\\.)*'"),
+    ("IRI", r"<[^<>\"{}|^`\\\s]*>"),
+    ("VAR", r"[?$][A-Za-z0-9_·-￿]+"),
+    ("LANGTAG", r"@[A-Za-z]+(?:-[A-Za-z0-9]+)*"),
+    ("NUMBER", r"\d*\.\d+(?:[eE][+-]?\d+)?|\d+\.?\d*[eE][+-]?\d+|\d+"),
+    ("BNODE", r"_:[A-Za-z0-9_][\w\-.]*(?<!\.)"),
+    ("PNAME", r"(?:[A-Za-zÀ-￿](?:[\w\-.]*[\w\-])?)?:(?:[\w\-:%]|\\.|\.(?=[\w\-:%\\]))*"),
+    ("NAME", r"[A-Za-z_][A-Za-z0-9_]*"),
+    ("PUNCT", r"\^\^|&&|\|\||!=|<=|>=|[{}()\[\].,;*=<>!+\-/|^?]"),
+]
+TOKEN_REGEX = re.compile("|".join(f"(?P<{kind}_{i}>{pattern})" for i, (kind, pattern) in enumerate(TOKEN_PATTERNS)))
+
+
+def tokenize(query: str, keep_whitespace: bool = False) -> List[Token]:
+    """
+    Split a SPARQL query into tokens. Characters that cannot start any token
+    (e.g. an unterminated string) become ERROR tokens instead of raising.
+    """
+    tokens = []
+    position = 0
+    length = len(query)
+    while position < length:
+        match = TOKEN_REGEX.match(query, position)
+        if match is None:
+            tokens.append(Token("ERROR", query[position], position))
+            position += 1
+            continue
+        kind = match.lastgroup.rsplit("_", 1)[0]
+        if kind != "WS" or keep_whitespace:
+            tokens.append(Token(kind, match.group(), position))
+        position = match.end()
+    return tokens
+
+
+def line_column(query: str, position: int):
+    """Return the 1-based (line, column) of a character position."""
+    line = query.count("\n", 0, position) + 1
+    column = position - (query.rfind("\n", 0, position) + 1) + 1
+    return line, column
@@ -0,0 +1,74 @@
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .llm_gateway import track_usage
+
+SPECULATIVE_FOLLOWUP = os.environ.get("SPECULATIVE_FOLLOWUP", "off").lower() == "on"
+
+_pool = ThreadPoolExecutor(max_workers=6, thread_name_prefix="speculative")
+
+# 投機実行の累計（チューニング用）
+speculation_stats = {"runs": 0, "saved_seconds": 0.0, "wasted_calls": 0, "wasted_tokens": 0}
+_stats_lock = threading.Lock()
+
+
+def _timed(function):
+    def run():
+        start = time.monotonic()
+        with track_usage() as usage:
+            result = function()
+        return result, time.monotonic() - start, usage
+    return run
+
+
+def _discard(future):
+    # 採用されなかった分岐の結果は捨て、使ったトークンだけ数える
+    if future.cancelled() or future.exception() is not None:
+        return
+    _, _, usage = future.result()
+    with _stats_lock:
+        speculation_stats["wasted_calls"] += usage["calls"]
+        speculation_stats["wasted_tokens"] += usage["prompt_tokens"] + usage["completion_tokens"]
+
+
+def speculate(decide, if_true, if_false):
+    """
+    Run `decide` and both branches at the same time and return (decision, result, report).
+
+    The losing branch is cancelled if it has not started yet; otherwise its result is
+    discarded and its tokens are added to `speculation_stats["wasted_tokens"]` when it
+    finishes. `report["saved_seconds"]` compares with running decide and the branch in sequence.
+    """
+    start = time.monotonic()
+    decision_future = _pool.submit(_timed(decide))
+    branches = {True: _pool.submit(_timed(if_true)), False: _pool.submit(_timed(if_false))}
+
+    try:
+        decision, decision_seconds, _ = decision_future.result()
+    except Exception:
+        for branch in branches.values():
+            if not branch.cancel():
+                branch.add_done_callback(_discard)
+        raise
+    decision = bool(decision)
+    loser = branches[not decision]
+    if not loser.cancel():
+        loser.add_done_callback(_discard)
+
+    result, branch_seconds, _ = branches[decision].result()
+    elapsed = time.monotonic() - start
+    saved = max(0.0, decision_seconds + branch_seconds - elapsed)
+    with _stats_lock:
+        speculation_stats["runs"] += 1
+        speculation_stats["saved_seconds"] += saved
+
+    report = {
+        "decision": decision,
+        "decision_seconds": decision_seconds,
+        "branch_seconds": branch_seconds,
+        "elapsed_seconds": elapsed,
+        "saved_seconds": saved,
+    }
+    return decision, result, report
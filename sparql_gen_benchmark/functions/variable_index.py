@@ -0,0 +1,139 @@
+"""
+Index of the names rdf-config accepts for a database (subjects and object variables of
+model.yaml, read through the sparql_builder model like query generation), used to check
+the variables and parameter keys extracted from the LLM output before a query is generated. Near misses are corrected through normalisation, an optional
+synonym table and edit distance.
+"""
+import json
+import os
+import re
+from functools import lru_cache
+
+from .schema_index import load_model
+
+VARIABLE_CHECK = os.environ.get("VARIABLE_CHECK", "on").lower() != "off"
+VARIABLE_MAX_EDIT_DISTANCE = int(os.environ.get("VARIABLE_MAX_EDIT_DISTANCE", "2"))
+# {"uniprot": {"organism": "taxonomy_scientific_name"}, ...}
+VARIABLE_SYNONYMS_PATH = os.environ.get(
+    "VARIABLE_SYNONYMS",
+    os.path.join(os.environ.get("PATH_DIR", ""), "data/prompt/variable_synonyms.json"),
+)
+
+
+class UnknownVariableError(ValueError):
+    """Raised when extracted variables do not exist in model.yaml and cannot be corrected."""
+
+    def __init__(self, database, unknown):
+        super().__init__(f"Unknown variables for {database}: {', '.join(unknown)}")
+        self.database = database
+        self.unknown = unknown
+
+
+def normalize(name):
+    # ?Protein, "taxonomy-scientific name" などを taxonomy_scientific_name の形に揃える
+    name = name.strip().strip("`'\"").lstrip("?")
+    return re.sub(r"[^0-9a-z]+", "_", name.lower()).strip("_")
+
+
+def edit_distance(a, b, limit):
+    """Levenshtein distance, or limit + 1 once it is known to exceed `limit`."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class VariableIndex:
+    """Valid names of one database with their normalised forms and synonyms."""
+
+    def __init__(self, subjects, synonyms=None):
+        self.subjects = [subject.name for subject in subjects]
+        self.variables = [variable.name for subject in subjects for variable in subject.variables]
+        self.names = set(self.subjects) | set(self.variables)
+        self.normalized = {}
+        for name in [*self.subjects, *self.variables]:
+            self.normalized.setdefault(normalize(name), name)
+        for synonym, name in (synonyms or {}).items():
+            if name in self.names:
+                self.normalized.setdefault(normalize(synonym), name)
+
+    def correct(self, name, max_distance=VARIABLE_MAX_EDIT_DISTANCE):
+        """Return the valid name meant by `name`, or None if there is no unambiguous match."""
+        if name in self.names:
+            return name
+        key = normalize(name)
+        if key in self.normalized:
+            return self.normalized[key]
+        # 短い名前ほど許容する距離を小さくする
+        limit = min(max_distance, len(key) // 4)
+        if limit == 0:
+            return None
+        distances = {}
+        for candidate_key, candidate in self.normalized.items():
+            distance = edit_distance(key, candidate_key, limit)
+            if distance <= limit:
+                distances[candidate] = min(distance, distances.get(candidate, distance))
+        if not distances:
+            return None
+        best = min(distances.values())
+        matches = [candidate for candidate, distance in distances.items() if distance == best]
+        return matches[0] if len(matches) == 1 else None
+
+
+def load_synonyms(path=VARIABLE_SYNONYMS_PATH):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+@lru_cache(maxsize=None)
+def _cached_index(subjects, synonyms):
+    return VariableIndex(subjects, dict(synonyms))
+
+
+def get_variable_index(database):
+    """VariableIndex of a database (rebuilt when model.yaml changes)."""
+    synonyms = load_synonyms().get(database, {})
+    return _cached_index(load_model(database), tuple(sorted(synonyms.items())))
+
+
+def check_spec(database, variables, parameters):
+    """
+    Check and correct the variables and parameter keys extracted from the LLM output.
+    Returns (variables, parameters, {original: corrected}); raises UnknownVariableError
+    when a name cannot be matched.
+    """
+    if not VARIABLE_CHECK:
+        return variables, parameters, {}
+    index = get_variable_index(database)
+    corrections = {}
+    unknown = []
+
+    def resolve(name):
+        corrected = index.correct(name)
+        if corrected is None:
+            unknown.append(name)
+            return name
+        if corrected != name:
+            corrections[name] = corrected
+        return corrected
+
+    checked_variables = []
+    for name in variables:
+        name = resolve(name)
+        if name not in checked_variables:
+            checked_variables.append(name)
+    checked_parameters = {}
+    for key, value in parameters.items():
+        checked_parameters.setdefault(resolve(key), value)
+    if unknown:
+        raise UnknownVariableError(database, unknown)
+    return checked_variables, checked_parameters, corrections
@@ -6,9 +6,15 @@ import pandas as pd
 import requests
 import streamlit as st
 from functions.prompt_maker import make_one_prompt
-from functions.SPARQL_executer import execute_one_query
+from functions.SPARQL_executer import execute_one_query_stream
 from functions.SPARQL_generator import generate_one_sparql
-from openai import OpenAI
+from functions.followup_classifier import FollowupClassifier, record_decision
+from functions.llm_gateway import chat, chat_stream
+from functions.paged_fetch import PagedQuery
+from functions.query_validator import format_issues, has_errors, validate_query
+from functions.result_table import to_value_frame
+from functions.speculative import SPECULATIVE_FOLLOWUP, speculate
+from functions.variable_index import get_variable_index
 
 # Streamlit layout settings
 st.set_page_config(layout="wide")
@@ -17,6 +23,10 @@ st.markdown(const.HIDE_ST_STYLE, unsafe_allow_html=True)
 # API endpoint
 API_BASE_URL = "http://chatbot-backend:8000"
 
+# Limits for streamed query results
+STREAM_MAX_ROWS = int(os.environ.get("SPARQL_STREAM_MAX_ROWS", "100000"))
+STREAM_MAX_BYTES = int(os.environ.get("SPARQL_STREAM_MAX_BYTES", str(200 * 1024 * 1024)))
+
 # Initialize session state
 if "messages" not in st.session_state:
     st.session_state["messages"] = []
@@ -46,6 +56,16 @@ if "query_history" not in st.session_state:
 if "query_history_position" not in st.session_state:
     st.session_state["query_history_position"] = -1
 
+# Paged result of the last generated query (remaining pages load on demand)
+if "paged_query" not in st.session_state:
+    st.session_state["paged_query"] = None
+
+def reset_paged_query():
+    """Cancel background loading of the previous query result"""
+    if st.session_state["paged_query"] is not None:
+        st.session_state["paged_query"].cancel()
+    st.session_state["paged_query"] = None
+
 def create_new_conversation(title=None):
     """Create a new conversation with given title or default timestamp title"""
     if title is None:
@@ -68,6 +88,7 @@ def create_new_conversation(title=None):
         st.session_state["query_result"] = None
         st.session_state["query_history"] = []
         st.session_state["query_history_position"] = -1
+        reset_paged_query()
         
         return data.get("id")
     except requests.RequestException as e:
@@ -88,6 +109,7 @@ def load_conversation(conversation_id):
         st.session_state["previous_user_input"] = ""
         st.session_state["query_history"] = []
         st.session_state["query_history_position"] = -1
+        reset_paged_query()
         
         # Convert and load messages
         last_user_question = None
@@ -159,8 +181,26 @@ def normalize_user_input(user_input: str) -> str:
     return response.json()
 
 
+@st.cache_resource
+def load_variable_indexes(databases):
+    """Build the model.yaml variable index of every database once at startup"""
+    return {database: get_variable_index(database) for database in databases}
+
+
+@st.cache_resource
+def load_followup_classifier():
+    """Local follow-up gate model (None until it has been trained)"""
+    return FollowupClassifier.load()
+
+
 def should_modify_existing_query(previous_input, previous_query, current_input):
     """Determine if existing query can be modified"""
+    # Use the local classifier when it is confident, otherwise ask GPT-4
+    classifier = load_followup_classifier()
+    if classifier is not None:
+        decision = classifier.decide(previous_input, previous_query, current_input)
+        if decision is not None:
+            return decision
         
     prompt = f"""
 You are an interactive SPARQL query generation assistant.
@@ -169,17 +209,20 @@ Previous SPARQL query: "{previous_query}"
 Current user question: "{current_input}"
 Can this question be answered if I modify it using the same graph structure within the query? Please answer Yes or No.
 """
-    client = OpenAI()
-    completion = client.chat.completions.create(
-        model="gpt-4",
-        messages=[
+    content = chat(
+        [
             {"role": "system", "content": "You are a capable assistant."},
             {"role": "user", "content": prompt},
         ],
+        model="gpt-4",
+        site="should_modify_existing_query",
     )
-    answer = completion.choices[0].message.content.strip()
+    answer = content.strip()
     
-    return "Yes" in answer
+    # Keep the LLM decision as a training label for the local classifier
+    decision = "Yes" in answer
+    record_decision(previous_input, previous_query, current_input, decision)
+    return decision
 
 def modify_existing_query(previous_query, user_input):
     """Modify existing SPARQL query"""
@@ -192,37 +235,62 @@ User's new question: "{user_input}"
 Please modify the previous query to answer the new question.
 Output only the modified SPARQL query.
 """
-    client = OpenAI()
-    completion = client.chat.completions.create(
-        model="gpt-4",
-        messages=[
+    content = chat(
+        [
             {"role": "system", "content": "You are a SPARQL expert."},
             {"role": "user", "content": prompt},
         ],
+        model="gpt-4",
+        site="modify_existing_query",
     )
     try:
-        sparql_query = completion.choices[0].message.content.strip().split("```sparql")[1].split("```")[0]
+        sparql_query = content.strip().split("```sparql")[1].split("```")[0]
     except Exception:
-        sparql_query = completion.choices[0].message.content.strip()
+        sparql_query = content.strip()
     return sparql_query
 
-def generate_answer(question, query_code, query_results):
-    """Generate answer using GPT-4"""
+def validate_before_execution(query, database):
+    """Fail fast on syntax errors before the query is sent to the endpoint"""
+    issues = validate_query(query, database)
+    if has_errors(issues):
+        raise ValueError(f"Invalid SPARQL query:\n{format_issues(issues)}")
+
+def stream_query_result(query, endpoint, placeholder):
+    """Execute a query and show the rows in the placeholder while they are downloading"""
+    frames = []
+    row_count = 0
+    for batch in execute_one_query_stream(query, endpoint, max_rows=STREAM_MAX_ROWS, max_bytes=STREAM_MAX_BYTES):
+        frames.append(to_value_frame(batch))
+        row_count += len(batch)
+        # Show the first batch as soon as it arrives and keep the row count updated
+        with placeholder.container():
+            st.caption(f"Loading results... {row_count} rows")
+            st.dataframe(frames[0])
+    placeholder.empty()
+    return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame()
+
+def generate_answer(question, query_code, query_results, placeholder=None):
+    """Generate answer using GPT-4, streaming it into the placeholder when one is given"""
     prompt = f"""
 User question: "{question}"
 SPARQL query: "{query_code}"
 Query results: {query_results.head(5)}
 Using the query results, please answer the user's question.
 """
-    client = OpenAI()
-    completion = client.chat.completions.create(
-        model="gpt-4",
-        messages=[
-            {"role": "system", "content": "You are a capable assistant."},
-            {"role": "user", "content": prompt},
-        ],
-    )
-    return completion.choices[0].message.content.strip()
+    messages = [
+        {"role": "system", "content": "You are a capable assistant."},
+        {"role": "user", "content": prompt},
+    ]
+    if placeholder is None:
+        return chat(messages, model="gpt-4", site="generate_answer").strip()
+
+    answer = ""
+    for piece in chat_stream(messages, model="gpt-4", site="generate_answer"):
+        answer += piece
+        placeholder.markdown(answer + "▌")
+    answer = answer.strip()
+    placeholder.markdown(answer)
+    return answer
 
 # Sidebar for conversation history
 with st.sidebar:
@@ -238,6 +306,7 @@ with st.sidebar:
         st.session_state["query_result"] = None
         st.session_state["query_history"] = []
         st.session_state["query_history_position"] = -1
+        reset_paged_query()
         st.rerun()
         
     # Load conversation history
@@ -275,6 +344,7 @@ col1, col2 = st.columns([1, 1])
 # Database selection
 with col1:
     database_list = ["uniprot", "rhea", "bgee"]
+    load_variable_indexes(tuple(database_list))
     selected_db = st.selectbox(
         "Select Database:",
         database_list,
@@ -290,6 +360,7 @@ if selected_db != st.session_state["selected_db"]:
     st.session_state["previous_user_input"] = ""
     st.session_state["query_history"] = []
     st.session_state["query_history_position"] = -1
+    reset_paged_query()
 
 # Display conversation
 with col1:
@@ -304,6 +375,9 @@ if user_input:
     # Normalize user input
     # user_input_normalized = normalize_user_input(user_input)
 
+    # Stop loading the previous result
+    reset_paged_query()
+
     # Create new conversation if none exists
     if not st.session_state["conversation_id"]:
         conversation_id = create_new_conversation(user_input)
@@ -320,8 +394,9 @@ if user_input:
     # Assistant response
     with col1:
         with st.chat_message("assistant"):
+            # Stage progress (prompt built -> SPARQL generated -> executed -> answering)
+            status = st.status("Generating...")
             message_placeholder = st.empty()
-            message_placeholder.write("Generating...")
 
     try:
         # Debug information
@@ -332,23 +407,46 @@ if user_input:
         }
         
         # Generate or modify SPARQL query
-        if st.session_state["previous_query"] and should_modify_existing_query(
+        if st.session_state["previous_query"] and not SPECULATIVE_FOLLOWUP:
+            status.update(label="Checking whether the previous query can be reused...")
+        if st.session_state["previous_query"] and SPECULATIVE_FOLLOWUP:
+            # Decide, modify and regenerate at the same time; the losing branch is discarded
+            status.update(label="Generating SPARQL (modify and regenerate in parallel)...")
+            previous_input = st.session_state["previous_user_input"]
+            previous_query = st.session_state["previous_query"]
+            modified, sparql_query, report = speculate(
+                lambda: should_modify_existing_query(previous_input, previous_query, user_input),
+                lambda: modify_existing_query(previous_query, user_input),
+                lambda: generate_one_sparql(selected_db, make_one_prompt(selected_db, user_input), False),
+            )
+            st.session_state["debug_info"]["speculation"] = report
+            status.write(f"{'Previous query modified' if modified else 'SPARQL generated'} ({report['saved_seconds']:.1f}s saved)")
+        elif st.session_state["previous_query"] and should_modify_existing_query(
             st.session_state["previous_user_input"],
             st.session_state["previous_query"],
             user_input
         ):
+            status.update(label="Modifying the previous query...")
             sparql_query = modify_existing_query(st.session_state["previous_query"], user_input)
+            status.write("Previous query modified")
         else:
+            status.update(label="Building prompt...")
             user_prompt = make_one_prompt(selected_db, user_input)
+            status.write("Prompt built")
+            status.update(label="Generating SPARQL...")
             sparql_query = generate_one_sparql(selected_db, user_prompt, False)
+            status.write("SPARQL generated")
         
         st.session_state["query_code"] = sparql_query
         
-        # Execute query
-        result = execute_one_query(sparql_query, os.environ[f"ENDPOINT_{selected_db.upper()}"])
-        df_result = pd.DataFrame(result)
-        df_result = df_result if df_result.empty else df_result.applymap(lambda x: x["value"] if isinstance(x, dict) and "value" in x else x)
+        # Execute query: fetch a small first page now, later pages on demand
+        status.update(label="Executing query...")
+        validate_before_execution(sparql_query, selected_db)
+        paged_query = PagedQuery(sparql_query, os.environ[f"ENDPOINT_{selected_db.upper()}"])
+        st.session_state["paged_query"] = paged_query
+        df_result = to_value_frame(paged_query.first_page())
         st.session_state["query_result"] = df_result
+        status.write(f"Query executed ({len(df_result)} rows shown)")
         
         # Add query to history
         if not st.session_state["query_history"] or sparql_query != st.session_state["query_history"][-1]:
@@ -357,9 +455,10 @@ if user_input:
             st.session_state["query_history"].append(sparql_query)
             st.session_state["query_history_position"] = len(st.session_state["query_history"]) - 1
         
-        # Generate and display answer
-        answer = generate_answer(user_input, st.session_state["query_code"], df_result)
-        message_placeholder.markdown(answer)
+        # Generate and stream the answer
+        status.update(label="Answering...")
+        answer = generate_answer(user_input, st.session_state["query_code"], df_result, message_placeholder)
+        status.update(label="Done", state="complete")
         
         # Update session state
         st.session_state["messages"].append({"user": "assistant", "message": answer})
@@ -371,6 +470,7 @@ if user_input:
 
     except Exception as e:
         error_message = f"An error occurred: {e}"
+        status.update(label="Failed", state="error")
         message_placeholder.error(error_message)
         st.session_state["messages"].append({"user": "assistant", "message": error_message})
 
@@ -406,12 +506,13 @@ with col2:
     if st.button("Execute Query"):
         try:
             # Execute modified query
-            result = execute_one_query(
+            validate_before_execution(edited_query, selected_db)
+            reset_paged_query()
+            df_result = stream_query_result(
                 edited_query,
-                os.environ[f"ENDPOINT_{selected_db.upper()}"]
+                os.environ[f"ENDPOINT_{selected_db.upper()}"],
+                st.empty()
             )
-            df_result = pd.DataFrame(result)
-            df_result = df_result if df_result.empty else df_result.applymap(lambda x: x["value"] if isinstance(x, dict) and "value" in x else x)
             st.session_state["query_result"] = df_result
             st.session_state["query_code"] = edited_query
             
@@ -426,12 +527,10 @@ with col2:
 
             # Generate new answer if there are messages
             if st.session_state["messages"]:
-                answer = generate_answer(None, st.session_state['query_code'], df_result)
-                st.session_state["messages"].append({"user": "assistant", "message": answer})
-                
                 with col1:
                     with st.chat_message("assistant"):
-                        st.write(answer)
+                        answer = generate_answer(None, st.session_state['query_code'], df_result, st.empty())
+                st.session_state["messages"].append({"user": "assistant", "message": answer})
                 
                 # Save message
                 save_message(None, answer, edited_query)
@@ -442,5 +541,16 @@ with col2:
     # Display query results
     if st.session_state["query_result"] is not None:
         st.dataframe(st.session_state["query_result"])
+
+        # Load the next page (already prefetched in the background)
+        paged_query = st.session_state["paged_query"]
+        if paged_query is not None and paged_query.has_more:
+            if st.button(f"Load more rows ({paged_query.rows_loaded} loaded)"):
+                try:
+                    more_rows = to_value_frame(paged_query.next_page())
+                    st.session_state["query_result"] = pd.concat([st.session_state["query_result"], more_rows], ignore_index=True)
+                    st.rerun()
+                except Exception as e:
+                    st.error(f"An error occurred: {e}")
     else:
         st.write("No query results.")
\ No newline at end of file